@@ -9,13 +9,21 @@ Created on Nov 2, 2013
 import logging
 import argparse
 import sys
+import socket
 from nsts.client import NSTSClient
 from nsts.server import NSTSServer
-from nsts.profiles import *
+from nsts.metrics import MetricsServer
+from nsts.selfprofile import SelfProfiler
+from nsts.profiles import base
 from nsts.profiles.base import SpeedTestRuntimeError
+from nsts.profiles.pool import pool, DEFAULT_IDLE_TIMEOUT
 from nsts.io import suite
-from nsts.io.terminal import BasicTerminal
-from nsts import core
+from nsts.io.terminal import BasicTerminal, LiveTerminal, MachineTerminal, \
+    DeferredTerminal
+from nsts import core, calibration
+from nsts.calibration import CalibrationCache, LoopbackCalibrator
+from nsts.units import Time
+from nsts.events import dispatcher
 
 from nsts.proto import ProtocolError
 
@@ -52,6 +60,16 @@ list_tests = group.add_argument(
     "--list-profiles", help="list all available benchmarking profiles.",
     action="store_true"
 )
+group.add_argument(
+    "--capabilities", help="list the external tools that profiles use "
+    "and their versions.", action="store_true")
+group.add_argument(
+    "--calibrate", help="execute tests against a local server over loopback "
+    "and cache their overhead and ceiling for --corrected.",
+    action="store_true")
+group.add_argument(
+    "--schedule", help="run suites against targets recurrently, as "
+    "described by a schedule file.", type=str, metavar='FILE')
 parser.add_argument(
     "-p", "--port", help="server/client port.",
     type=int, default=core.DEFAULT_PORT
@@ -65,6 +83,23 @@ parser.add_argument(
     "--interval",
     help="The interval time between samples in seconds. (default 0.0sec)",
     default=0.0, type=float)
+parser.add_argument(
+    "--precision",
+    help="sample adaptively until the confidence interval of the mean is "
+    "within this fraction of the mean (e.g. 0.05). --samples becomes the "
+    "minimum number of samples", type=float)
+parser.add_argument("--precision-result",
+                    help="result that --precision checks "
+                    "(default: the first result of each profile)", type=str)
+parser.add_argument("--confidence",
+                    help="confidence level of --precision (default 0.95)",
+                    type=float)
+parser.add_argument("--max-samples",
+                    help="maximum samples of adaptive sampling "
+                    "(default 100)", type=int)
+parser.add_argument("--max-duration",
+                    help="maximum seconds of adaptive sampling per test",
+                    type=float)
 parser.add_argument("--log-file",
                     help="file to save logging output", type=str)
 group = parser.add_mutually_exclusive_group()
@@ -81,8 +116,68 @@ parser.add_argument(
     action="store_true")
 parser.add_argument("-v", "--verbose", help="enable verbose output",
                     action="store_true")
+parser.add_argument("--output-format",
+                    help="format of client output. 'live' updates statistics "
+                    "after every sample, 'jsonl' and 'csv' stream a record "
+                    "per finished sample, test and suite",
+                    choices=['human', 'live', 'jsonl', 'csv'],
+                    default='human')
+parser.add_argument("--metrics-port",
+                    help="expose server metrics for scraping at "
+                    "http://127.0.0.1:PORT/metrics", type=int)
+parser.add_argument("--profile-self",
+                    help="profile NSTS itself while executing tests (client) "
+                    "or serving messages (server) and write profiling "
+                    "dumps and summaries at this directory",
+                    type=str, metavar='DIRECTORY')
+parser.add_argument("--store",
+                    help="append results of executed samples at this file",
+                    type=str)
+parser.add_argument("--corrected",
+                    help="report results corrected with the cached "
+                    "loopback calibration of each test",
+                    action="store_true")
+parser.add_argument("--calibration-cache",
+                    help="file of cached calibrations "
+                    "(default: ~/.nsts/calibration.json)",
+                    type=str, default=None)
+parser.add_argument("--reconnect",
+                    help="number of times to reconnect and resume from the "
+                    "failed sample when the connection is lost "
+                    "(default: %(default)s)",
+                    type=int, default=3)
+parser.add_argument("--warm-timeout",
+                    help="seconds to keep servers of external tools running "
+                    "between samples, 0 to stop them after every sample "
+                    "(default: %(default)s)",
+                    type=float, default=DEFAULT_IDLE_TIMEOUT)
 args = parser.parse_args()
 
+
+def load_suite():
+    '''
+    Load a suite from command line or file
+    '''
+    if args.tests is not None:
+        spsuite = suite.parse_command_line(args.tests)
+        spsuite.options['samples'] = args.samples
+        spsuite.options['interval'] = args.interval
+        for option in ['precision', 'precision_result', 'confidence',
+                       'max_samples', 'max_duration']:
+            if getattr(args, option) is not None:
+                spsuite.options[option] = getattr(args, option)
+    elif args.suite is not None:
+        try:
+            spsuite = suite.load_file(args.suite)
+        except Exception, e:
+            print "Error loading suite file."
+            print str(e)
+            sys.exit(1)
+    else:
+        print "You need to define tests or load suite."
+        sys.exit(1)
+    return spsuite
+
 # Initialize Logging
 log_params = {
     'level': logging.INFO if args.log_file else logging.WARNING,
@@ -92,9 +187,21 @@ if args.log_file:
 if args.debug is not None:
     log_params['level'] = args.debug
 logging.basicConfig(**log_params)
+pool.idle_timeout = args.warm_timeout
+
+# Profile NSTS itself
+profiler = None
+if args.profile_self is not None:
+    profiler = SelfProfiler(args.profile_self,
+                            'server' if args.server else 'client')
 
 # Prepare terminal
-terminal = BasicTerminal()
+if args.output_format == 'human':
+    terminal = BasicTerminal()
+elif args.output_format == 'live':
+    terminal = LiveTerminal()
+else:
+    terminal = MachineTerminal(args.output_format)
 terminal.options['samples'] = args.samples
 terminal.options['interval'] = args.interval
 terminal.options['verbose'] = args.verbose
@@ -106,10 +213,27 @@ if args.list_profiles:
     terminal.list_profiles(base.Profile.get_all_profiles().values())
     terminal.epilog()
 
+elif args.capabilities:
+    from nsts.profiles.subprocess import capabilities
+    terminal.welcome()
+    terminal.list_capabilities(
+        capabilities(sorted(base.Profile.get_all_profiles().values(),
+                            key=lambda p: p.id)))
+    terminal.epilog()
+
 
 elif args.server:
     # Server Mode
-    server = NSTSServer(ipv6=args.ipv6, port=args.port)
+    if args.metrics_port is not None:
+        try:
+            MetricsServer(args.metrics_port).start()
+        except socket.error, e:
+            print "Cannot expose metrics at port {0}.".format(
+                args.metrics_port)
+            print str(e)
+            sys.exit(1)
+    server = NSTSServer(ipv6=args.ipv6, port=args.port,
+                        profiler=profiler)
     try:
         server.serve()
     except KeyboardInterrupt:
@@ -117,37 +241,98 @@ elif args.server:
     except BaseException, e:
         print "Unknown error"
         print str(e)
+elif args.schedule:
+    # Scheduler Mode
+    from nsts import scheduler
+    try:
+        scheduler.main(args.schedule, profiler)
+    except scheduler.ScheduleError, e:
+        print "Error loading schedule file."
+        print str(e)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+elif args.calibrate:
+    # Calibration Mode
+    spsuite = load_suite()
+    cache = CalibrationCache(
+        args.calibration_cache or calibration.DEFAULT_CACHE)
+    calibrator = LoopbackCalibrator(samples=args.samples, ipv6=args.ipv6)
+    try:
+        for test in spsuite.tests:
+            print "Calibrating {0}...".format(test.name)
+            try:
+                cal = calibrator.calibrate(test)
+            except Exception, e:
+                print "Cannot calibrate: {0}".format(
+                    str(e) or type(e).__name__)
+                continue
+            cache.put(cal)
+            print "overhead: {0} local, {1} remote".format(
+                Time(cal.overhead), Time(cal.remote_overhead))
+            for result_id, value in cal.ceiling.items():
+                entry = test.profile.supported_results[result_id]
+                print "{0}: {1}".format(entry.name, entry.unit_type(value))
+    except KeyboardInterrupt:
+        sys.exit(-1)
+    finally:
+        calibrator.stop()
+        cache.save()
 else:
     try:
         terminal.welcome()
 
         # Client Mode
         client = NSTSClient(remote_host=args.connect,
-                            remote_port=args.port, ipv6=args.ipv6)
+                            remote_port=args.port, ipv6=args.ipv6,
+                            reconnect=args.reconnect,
+                            profiler=profiler)
         client.connect()
 
         terminal.client_connected(client.connection)
 
-        # Load a suite from command line or file
-        if args.tests is not None:
-            spsuite = suite.parse_command_line(args.tests)
-            spsuite.options['samples'] = args.samples
-            spsuite.options['interval'] = args.interval
-        elif args.suite is not None:
-            try:
-                spsuite = suite.load_file(args.suite)
-            except Exception, e:
-                print "Error loading suite file."
-                print str(e)
-                sys.exit(1)
-        else:
-            print "You need to define tests or load suite."
-            sys.exit(1)
+        spsuite = load_suite()
+
+        # Attach cached calibrations
+        if args.corrected:
+            cache = CalibrationCache(
+                args.calibration_cache or calibration.DEFAULT_CACHE)
+            for test in spsuite.tests:
+                test.calibration = cache.get(
+                    calibration.calibration_key(test))
+                if test.calibration is None:
+                    print "No calibration of '{0}', run --calibrate first."\
+                        .format(test.name)
+
+        # Store results of every test as soon as it finishes
+        writer = None
+        stored = []
+        if args.store is not None:
+            from nsts.io.results import ResultsWriter
+            writer = ResultsWriter(args.store)
+
+            def store_test(notification):
+                writer.push_test(notification.sender, args.connect)
+                writer.flush()
+                stored.append(notification.sender)
+            dispatcher.connect('test_execution_finished', store_test)
 
-        # Execute suite
-        client.run_suite(spsuite, terminal)
+        # Execute suite, rendering output off the measurement loop
+        deferred = DeferredTerminal(terminal, profiler=profiler)
+        try:
+            client.run_suite(spsuite, deferred)
+        finally:
+            deferred.close()
+            if writer is not None:
+                # Keep the samples of an interrupted test too
+                dispatcher.disconnect('test_execution_finished', store_test)
+                for test in spsuite.tests:
+                    if test not in stored:
+                        writer.push_test(test, args.connect)
+                writer.close()
 
         # Finish
+        client.disconnect()
         terminal.epilog()
     except (SpeedTestRuntimeError, ProtocolError), e:
         print "Error while executing speedtest suite:"
@@ -0,0 +1,371 @@
+'''
+Benchmarks of the overhead of NSTS itself. All benchmarks run locally
+over socketpairs or the loopback interface, so they measure only the
+cost of NSTS code and not of any network.
+
+Results can be saved in a JSON file and compared against a previous
+run (baseline) to catch performance regressions:
+
+    python -m nsts.benchmark --output current.json --baseline base.json
+
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+import sys
+import json
+import socket
+import random
+import logging
+import argparse
+import datetime
+import platform
+import threading
+from collections import OrderedDict
+from nsts import units, utils
+from nsts.proto import Message, MessageStream, NSTSConnection
+from nsts.profiles.base import ProfileExecution, ExecutionDirection
+from nsts.profiles import dummy
+from nsts.speedtest import SpeedTest
+from nsts.io.grid import Grid
+from nsts.io.terminal import ClientTerminal
+
+# Module logger
+logger = logging.getLogger("benchmark")
+
+# Registered benchmarks, in order of registration
+benchmarks = OrderedDict()
+
+# Default fraction of ops/sec that a benchmark may lose against baseline
+DEFAULT_THRESHOLD = 0.2
+
+
+class Benchmark(object):
+    '''
+    A named benchmark. The setup function prepares any state and
+    returns a callable that performs "operations" operations
+    per call, or a tuple of this callable and a callable that releases
+    the state when the benchmark has finished.
+    '''
+
+    def __init__(self, name, setup, operations):
+        self.name = name
+        self.setup = setup
+        self.operations = operations
+
+
+def benchmark(name, operations=1):
+    '''
+    Decorator to register a benchmark setup function
+    '''
+    def register(setup):
+        benchmarks[name] = Benchmark(name, setup, operations)
+        return setup
+    return register
+
+
+def measure(func, operations=1, min_time=0.2, repeat=3):
+    '''
+    Measure the time needed per operation of a function. The function
+    is called in loops that last at least min_time, and the best of
+    "repeat" loops is kept.
+    @param func The callable to be measured
+    @param operations Number of operations performed on each call
+    @param min_time Minimum duration of each loop in seconds
+    @param repeat Number of loops
+    @return Seconds per operation
+    '''
+    # Calibrate number of calls per loop
+    calls = 1
+    while True:
+        started = utils.monotonic()
+        for _ in xrange(calls):
+            func()
+        elapsed = utils.monotonic() - started
+        if elapsed >= min_time:
+            break
+        calls *= 2
+
+    best = elapsed
+    for _ in xrange(repeat - 1):
+        started = utils.monotonic()
+        for _ in xrange(calls):
+            func()
+        best = min(best, utils.monotonic() - started)
+    return best / (calls * operations)
+
+
+def run(names=None, min_time=0.2, repeat=3):
+    '''
+    Run benchmarks and return their results
+    @param names A list of benchmark names or None for all
+    @return An ordered dictionary with ops_per_sec and seconds_per_op
+        per benchmark
+    '''
+    results = OrderedDict()
+    for name, entry in benchmarks.items():
+        if names and name not in names:
+            continue
+        logger.info("Running benchmark '{0}'".format(name))
+        func = entry.setup()
+        teardown = None
+        if isinstance(func, tuple):
+            func, teardown = func
+        try:
+            seconds = measure(func, entry.operations, min_time, repeat)
+        finally:
+            if teardown is not None:
+                teardown()
+        results[name] = {
+            'seconds_per_op': seconds,
+            'ops_per_sec': 1.0 / seconds if seconds else float('inf')}
+    return results
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    '''
+    Compare results against a baseline.
+    @param results The benchmarks of current run
+    @param baseline The benchmarks of a previous run
+    @param threshold The maximum accepted fraction of ops/sec lost
+    @return A list of (name, baseline ops/sec, current ops/sec, change,
+        regressed) for benchmarks found in both runs
+    '''
+    comparison = []
+    for name, entry in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]['ops_per_sec']
+        after = entry['ops_per_sec']
+        change = (after - before) / before if before else 0.0
+        comparison.append(
+            (name, before, after, change, change < -threshold))
+    return comparison
+
+
+def save(filename, results):
+    data = {
+        'created_at': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'benchmarks': results}
+    with open(filename, 'w') as f:
+        json.dump(data, f, indent=2)
+
+
+def load(filename):
+    with open(filename) as f:
+        return json.load(f, object_pairs_hook=OrderedDict)['benchmarks']
+
+
+def make_stream_pair():
+    '''
+    Create two connected message streams over a socketpair
+    '''
+    a, b = socket.socketpair()
+    return (MessageStream(socket.socket(_sock=a)),
+            MessageStream(socket.socket(_sock=b)))
+
+
+def make_sample(test):
+    '''
+    Create a finished execution of the dummy profile with random results
+    '''
+    ctx = ProfileExecution(test.profile, test.direction,
+                           test.profile_options, make_sample.connection)
+    ctx.started_at = datetime.datetime.now()
+    ctx.ended_at = ctx.started_at
+    ctx.executor.store_result(
+        'random_transfer', units.BitRate(random.uniform(0, 1e9)))
+    ctx.executor.store_result(
+        'random_time', units.Time(random.uniform(0, 100)))
+    return ctx
+make_sample.connection = NSTSConnection(socket.socket())
+
+
+# Benchmarks
+
+SAMPLE_PARAMS = {
+    'execution_id': 'a4c1e2f0-1b2c-4d5e-8f90-123456789abc',
+    'results': {'random_transfer': 123456789.0, 'random_time': 1.5},
+    'timings': {'prepare': 0.001, 'run': 0.5, 'cleanup': 0.0001}}
+
+
+@benchmark('proto.encode', operations=1000)
+def bench_encode():
+    msg = Message('RESULTS', SAMPLE_PARAMS)
+
+    def func():
+        for _ in xrange(1000):
+            msg.encode()
+    return func
+
+
+@benchmark('proto.decode', operations=1000)
+def bench_decode():
+    raw = Message('RESULTS', SAMPLE_PARAMS).encode()
+
+    def func():
+        for _ in xrange(1000):
+            Message.decode(raw)
+    return func
+
+
+@benchmark('proto.stream', operations=100)
+def bench_stream():
+    sender, receiver = make_stream_pair()
+
+    def func():
+        for _ in xrange(100):
+            sender.send_msg('RESULTS', SAMPLE_PARAMS)
+        for _ in xrange(100):
+            receiver.wait_msg()
+    return func
+
+
+@benchmark('client.dummy_sample')
+def bench_dummy_sample():
+    from nsts.server import NSTSServer
+    from nsts.client import NSTSClient
+    server = NSTSServer('127.0.0.1', 0, quiet=True)
+    server.listen()
+    thread = threading.Thread(target=server.serve, name='benchmark-server')
+    thread.daemon = True
+    thread.start()
+
+    client = NSTSClient('127.0.0.1', server.port)
+    try:
+        client.connect()
+    except BaseException:
+        server.shutdown()
+        raise
+    terminal = ClientTerminal()
+    test = SpeedTest(dummy.p, ExecutionDirection('s'))
+
+    def func():
+        ctx = ProfileExecution(dummy.p, test.direction,
+                               test.profile_options, client.connection)
+        client.run_profile(ctx, terminal)
+
+    def teardown():
+        try:
+            client.disconnect()
+        finally:
+            server.shutdown()
+            thread.join(5)
+    return func, teardown
+
+
+@benchmark('speedtest.statistics_10k')
+def bench_statistics():
+    test = SpeedTest(dummy.p, ExecutionDirection('s'))
+    for _ in xrange(10000):
+        test.push_sample(make_sample(test))
+    return test.statistics
+
+
+@benchmark('units.parse', operations=1000)
+def bench_units_parse():
+    def func():
+        for _ in xrange(1000):
+            units.BitRate('12.5 Mbps')
+    return func
+
+
+@benchmark('units.construct', operations=1000)
+def bench_units_construct():
+    def func():
+        for _ in xrange(1000):
+            units.BitRate(12500000)
+    return func
+
+
+@benchmark('units.scale', operations=1000)
+def bench_units_scale():
+    value = units.BitRate(12500000)
+
+    def func():
+        for _ in xrange(1000):
+            value.scale('Mbps')
+            value.optimal_scale()
+    return func
+
+
+@benchmark('grid.render_1k')
+def bench_grid():
+    grid = Grid(120)
+    grid.add_column('', width='fit')
+    grid.add_column('Took', width='fit')
+    grid.add_column('Transfer')
+    grid.add_column('Time')
+    for i in xrange(1000):
+        grid.add_row([i + 1, units.Time(random.uniform(0, 10)),
+                      units.BitRate(random.uniform(0, 1e9)),
+                      units.Time(random.uniform(0, 100))])
+    return grid.render
+
+
+def print_results(results, comparison=None):
+    compared = dict((c[0], c) for c in (comparison or []))
+    grid = Grid(100, units_format="0.1f")
+    grid.add_column('Benchmark', width='fit')
+    grid.add_column('Ops/sec', width='fit', align='right')
+    grid.add_column('Time/op', width='fit', align='right')
+    grid.add_column('Baseline', width='fit', align='right')
+    grid.add_column('Change', width='fit', align='right')
+    for name, entry in results.items():
+        row = [name, "{0:.1f}".format(entry['ops_per_sec']),
+               units.Time(entry['seconds_per_op']), '', '']
+        if name in compared:
+            _, before, _, change, regressed = compared[name]
+            row[3] = "{0:.1f}".format(before)
+            row[4] = "{0:+.1%}{1}".format(change, ' !' if regressed else '')
+        grid.add_row(row)
+    grid.write(sys.stdout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the overhead of NSTS itself.")
+    parser.add_argument("names", nargs='*', metavar='BENCHMARK',
+                        help="benchmarks to run (default: all)")
+    parser.add_argument("--list", action='store_true',
+                        help="list available benchmarks")
+    parser.add_argument("--output", type=str,
+                        help="save results at a JSON file")
+    parser.add_argument("--baseline", type=str,
+                        help="compare results with a previous JSON file")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="fraction of ops/sec that may be lost before "
+                        "reporting a regression (default: %(default)s)")
+    parser.add_argument("--min-time", type=float, default=0.2,
+                        help="minimum seconds of each measurement loop")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of measurement loops per benchmark")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name in benchmarks:
+            print name
+        return 0
+
+    unknown = [n for n in args.names if n not in benchmarks]
+    if unknown:
+        parser.error("unknown benchmarks: " + ", ".join(unknown))
+
+    results = run(args.names, args.min_time, args.repeat)
+    comparison = None
+    if args.baseline:
+        comparison = compare(results, load(args.baseline), args.threshold)
+    print_results(results, comparison)
+
+    if args.output:
+        save(args.output, results)
+
+    regressions = [c[0] for c in comparison or [] if c[4]]
+    if regressions:
+        print "Regressions: " + ", ".join(regressions)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+'''
+Self-calibration of profiles over loopback. Each test is executed
+against an in-process server on the loopback interface, so that the
+orchestration and process spawn overhead of NSTS and the ceiling of
+each result on this host can be recorded. Calibrations are cached per
+host, profile, direction, option set and tool version, and can later be
+used to report overhead-corrected results next to raw ones.
+
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+import os
+import json
+import socket
+import logging
+import datetime
+import threading
+from nsts import utils
+from nsts.units import Time
+from nsts.speedtest import SpeedTest
+from nsts.profiles.subprocess import find_tools
+from nsts.io.terminal import ClientTerminal
+
+# Module logger
+logger = logging.getLogger("calibration")
+
+# Default location of calibration cache
+DEFAULT_CACHE = os.path.join(
+    os.path.expanduser('~'), '.nsts', 'calibration.json')
+
+# Default number of samples per calibration
+DEFAULT_SAMPLES = 3
+
+
+def probe_tools(test):
+    '''
+    Get the external tools that are used by both directions of a test
+    @return A dictionary with the version of each tool
+    '''
+    tools = {}
+    for direction in [test.direction, test.direction.opposite()]:
+        for _, executable in find_tools(test.profile, direction):
+            if executable is not None:
+                tools[os.path.basename(executable)] = \
+                    utils.tool_version(executable)
+    return tools
+
+
+def calibration_key(test, tools=None):
+    '''
+    Get the key that identifies a calibration of a test on this host
+    @param test The SpeedTest
+    @param tools The versions of the tools or None to probe them
+    '''
+    if tools is None:
+        tools = probe_tools(test)
+    options = []
+    for option_id in test.profile_options:
+        value = test.profile_options[option_id]
+        value = getattr(value, 'raw_value', value)
+        options.append('{0}={1!r}'.format(option_id, value))
+    return '|'.join([
+        socket.gethostname(), test.profile.id, str(test.direction),
+        ','.join(options),
+        ','.join('{0}={1}'.format(t, tools[t]) for t in sorted(tools))])
+
+
+class Calibration(object):
+    '''
+    The baseline of a test as measured over loopback
+    '''
+
+    def __init__(self, key, samples, overhead, remote_overhead, ceiling,
+                 created_at=None):
+        '''
+        @param key The key of the calibrated test
+        @param samples The number of calibration samples
+        @param overhead Mean seconds of local overhead per sample
+        @param remote_overhead Mean seconds of remote overhead per sample
+        @param ceiling A dictionary with the mean raw value of each result
+        '''
+        self.key = key
+        self.samples = samples
+        self.overhead = overhead
+        self.remote_overhead = remote_overhead
+        self.ceiling = ceiling
+        self.created_at = datetime.datetime.utcnow().isoformat() \
+            if created_at is None else created_at
+
+    @classmethod
+    def from_test(cls, key, test):
+        '''
+        Create a calibration from a test that was executed over loopback
+        '''
+        overhead = utils.RunningStatistics(Time)
+        remote_overhead = utils.RunningStatistics(Time)
+        for sample in test.samples:
+            overhead.push(sample.overhead())
+            remote_overhead.push(Time(sum(
+                [duration for phase, duration
+                 in sample.remote_timings.items() if phase != 'run'])))
+        ceiling = dict(
+            (result_id, stats['mean'].raw_value)
+            for result_id, stats in test.statistics().items())
+        return cls(key, len(test.samples), overhead.mean().raw_value,
+                   remote_overhead.mean().raw_value, ceiling)
+
+    def to_dict(self):
+        return {
+            'samples': self.samples,
+            'overhead': self.overhead,
+            'remote_overhead': self.remote_overhead,
+            'ceiling': self.ceiling,
+            'created_at': self.created_at}
+
+    @classmethod
+    def from_dict(cls, key, data):
+        return cls(key, data['samples'], data['overhead'],
+                   data['remote_overhead'], data['ceiling'],
+                   data['created_at'])
+
+    def correct(self, test):
+        '''
+        Correct the results of a test with this calibration. Time results
+        are reduced by their loopback baseline and the sample duration
+        by the orchestration overhead. Other results are not affected,
+        but their loopback ceiling is reported.
+        @return A list of (name, raw mean, baseline, corrected mean)
+        '''
+        rows = []
+        took = Time(sum([s.execution_time().raw_value for s in test.samples])
+                    / len(test.samples))
+        overhead = Time(self.overhead)
+        rows.append(('Sample time', took, overhead,
+                     Time(max(took.raw_value - overhead.raw_value, 0))))
+
+        for result_id, stats in test.statistics().items():
+            entry = test.profile.supported_results[result_id]
+            raw = stats['mean']
+            baseline = entry.unit_type(self.ceiling.get(result_id, 0))
+            if entry.unit_type is Time:
+                corrected = Time(max(raw.raw_value - baseline.raw_value, 0))
+            else:
+                corrected = raw
+            rows.append((entry.name, raw, baseline, corrected))
+        return rows
+
+
+class CalibrationCache(object):
+    '''
+    Persistent storage of calibrations in a JSON file
+    '''
+
+    def __init__(self, filename=DEFAULT_CACHE):
+        self.filename = filename
+        self.__entries = {}
+        if os.path.exists(filename):
+            try:
+                with open(filename) as f:
+                    self.__entries = json.load(f)
+            except ValueError:
+                logger.warning("Ignoring corrupted calibration cache '{0}'"
+                               .format(filename))
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key):
+        '''
+        Get the calibration of a key or None if it is not cached
+        '''
+        if key not in self.__entries:
+            return None
+        return Calibration.from_dict(key, self.__entries[key])
+
+    def put(self, calibration):
+        self.__entries[calibration.key] = calibration.to_dict()
+
+    def save(self):
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.filename, 'w') as f:
+            json.dump(self.__entries, f, indent=2, sort_keys=True)
+
+
+class LoopbackCalibrator(object):
+    '''
+    Calibrate tests against a local in-process server
+    '''
+
+    def __init__(self, samples=DEFAULT_SAMPLES, ipv6=False):
+        self.samples = samples
+        self.ipv6 = ipv6
+        self.server = None
+        self.client = None
+
+    def start(self):
+        '''
+        Start loopback server and connect to it
+        '''
+        from nsts.server import NSTSServer
+        from nsts.client import NSTSClient
+        host = '::1' if self.ipv6 else '127.0.0.1'
+        self.server = NSTSServer(host, 0, self.ipv6, quiet=True)
+        self.server.listen()
+        thread = threading.Thread(target=self.server.serve,
+                                  name='calibration-server')
+        thread.daemon = True
+        thread.start()
+
+        self.client = NSTSClient(host, self.server.port, self.ipv6)
+        self.client.connect()
+        logger.info("Calibration server listening at port {0}".format(
+            self.server.port))
+
+    def stop(self):
+        if self.client is not None:
+            self.client.disconnect()
+            self.client = None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server = None
+
+    def calibrate(self, test, terminal=None):
+        '''
+        Execute a copy of a test over loopback
+        @param test The SpeedTest to calibrate
+        @param terminal A terminal to report progress
+        @return A Calibration object
+        '''
+        if self.client is None:
+            self.start()
+        options = dict((option_id, test.profile_options[option_id])
+                       for option_id in test.profile_options
+                       if test.profile_options[option_id] is not None)
+        loopback = SpeedTest(test.profile, test.direction, options)
+        if test.options['name'] is not None:
+            loopback.options['name'] = test.options['name']
+        try:
+            self.client.run_test(loopback, self.samples, Time(0),
+                                 terminal or ClientTerminal())
+        except Exception:
+            # Connection state is unknown, start over on next calibration
+            self.stop()
+            raise
+        return Calibration.from_test(calibration_key(test), loopback)
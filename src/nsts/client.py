@@ -6,18 +6,30 @@ Created on Nov 4, 2013
 '''
 
 import socket
-import sys
 import logging
 import time
-from proto import NSTSConnection, ProtocolError
+from proto import NSTSConnection, ProtocolError, ConnectionClosedException
 from nsts.profiles import base
-from nsts.speedtest import SpeedTest, SpeedTestSuite
+from nsts.speedtest import SpeedTest, SpeedTestSuite, StoppingRule
 from nsts.profiles.base import ProfileExecution
 from nsts import core
 from nsts.events import dispatcher
 
 logger = logging.getLogger("proto")
 
+# Seconds to wait before reconnecting, doubled after every failure
+RECONNECT_BACKOFF = 1
+RECONNECT_MAX_BACKOFF = 30
+
+# Module events
+execution_finished = dispatcher.register(
+    'profile_execution_finished', ['results'])
+execution_failed = dispatcher.register('profile_execution_failed', ['error'])
+test_started = dispatcher.register('test_execution_started', [])
+test_finished = dispatcher.register('test_execution_finished', [])
+suite_started = dispatcher.register('suite_execution_started', [])
+suite_finished = dispatcher.register('suite_execution_finished', [])
+
 
 class NotConnectedError(ProtocolError):
 
@@ -26,44 +38,168 @@ class NotConnectedError(ProtocolError):
             "Cannot perform action. Client is not connected.")
 
 
-class NSTSClient(object):
+class ConnectionFailedError(ProtocolError):
+    pass
+
+
+class ConnectionManager(object):
     '''
-    NSTS client implementation that permits connecting
-    to a server and executing suites, tests or profiles
+    Owner of the control connection to a server. The connection is
+    established with retries and exponential backoff, and it can be
+    re-established (including a new HELLO handshake) after a failure.
     '''
 
-    def __init__(self, remote_host, remote_port=None, ipv6=False):
+    def __init__(self, remote_host, remote_port=None, ipv6=False,
+                 attempts=1, backoff=RECONNECT_BACKOFF):
+        '''
+        @param attempts Number of attempts to connect
+        @param backoff Seconds to wait after the first failed attempt,
+            doubled after every next failure
+        '''
         self.remote_host = remote_host
-        if remote_port is None:
-            self.remote_port = core.DEFAULT_PORT
-        else:
-            self.remote_port = remote_port
-        self.connection = None
+        self.remote_port = core.DEFAULT_PORT if remote_port is None \
+            else remote_port
         self.ipv6 = ipv6
+        self.attempts = attempts
+        self.backoff = backoff
+        self.connection = None
+        self.connections = 0
 
-    def connect(self):
-        '''
-        Perform actual connection to the server
-        '''
-        if self.ipv6:
-            self.socket = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
-        else:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    def is_connected(self):
+        return self.connection is not None and not self.connection.closed
 
+    def __open(self):
+        family = socket.AF_INET6 if self.ipv6 else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
         try:
-            self.socket.connect((self.remote_host, self.remote_port))
+            sock.connect((self.remote_host, self.remote_port))
         except socket.error, msg:
+            sock.close()
             error_msg = 'Connection failed. Error code: '\
-                + str(msg[0]) + 'Error message: ' + msg[1]
-            print error_msg
-            logger.critical(error_msg)
-            sys.exit()
+                + str(msg[0]) + ' Error message: ' + msg[1]
+            raise ConnectionFailedError(error_msg)
         logger.info("Established connection to {0}:{1}.".format(
             self.remote_host, self.remote_port))
 
-        remote_ip = self.socket.getpeername()[0]
-        self.connection = NSTSConnection(self.socket)
-        self.connection.handshake(remote_ip)
+        connection = NSTSConnection(sock)
+        try:
+            connection.handshake(sock.getpeername()[0])
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    def connect(self):
+        '''
+        Get the connection, establishing it if needed
+        @return The NSTSConnection
+        '''
+        if self.is_connected():
+            return self.connection
+        self.connection = None
+
+        delay = self.backoff
+        for attempt in range(1, self.attempts + 1):
+            try:
+                self.connection = self.__open()
+                break
+            except (ConnectionFailedError, ConnectionClosedException,
+                    socket.error), e:
+                logger.warning("Connection attempt {0}/{1} failed: {2}"
+                               .format(attempt, self.attempts,
+                                       str(e) or type(e).__name__))
+                if attempt == self.attempts:
+                    logger.critical("Cannot connect to {0}:{1}.".format(
+                        self.remote_host, self.remote_port))
+                    if isinstance(e, ConnectionFailedError):
+                        raise
+                    raise ConnectionFailedError(
+                        str(e) or "Connection closed during handshake")
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_BACKOFF)
+        self.connections += 1
+        return self.connection
+
+    def disconnect(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def reconnect(self):
+        '''
+        Drop the current connection and establish a new one
+        '''
+        self.disconnect()
+        return self.connect()
+
+
+class ConnectionPool(object):
+    '''
+    Connection managers shared per server, so that all clients of a
+    server reuse the same control connection.
+    '''
+
+    def __init__(self, attempts=1, backoff=RECONNECT_BACKOFF):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.__managers = {}
+
+    def get(self, remote_host, remote_port=None, ipv6=False):
+        '''
+        Get the connection manager of a server
+        '''
+        key = (remote_host, remote_port or core.DEFAULT_PORT, ipv6)
+        if key not in self.__managers:
+            self.__managers[key] = ConnectionManager(
+                remote_host, remote_port, ipv6, self.attempts, self.backoff)
+        return self.__managers[key]
+
+    def close(self):
+        for manager in self.__managers.values():
+            manager.disconnect()
+
+
+class NSTSClient(object):
+    '''
+    NSTS client implementation that permits connecting
+    to a server and executing suites, tests or profiles
+    '''
+
+    def __init__(self, remote_host, remote_port=None, ipv6=False,
+                 reconnect=0, manager=None, profiler=None):
+        '''
+        @param reconnect Number of times that a sample is resumed, after
+            reconnecting, when the connection is lost while executing it.
+        @param manager A ConnectionManager to share or None to create one
+        @param profiler A SelfProfiler to profile every test or None
+        '''
+        if manager is None:
+            manager = ConnectionManager(remote_host, remote_port, ipv6,
+                                        attempts=reconnect + 1)
+        self.manager = manager
+        self.remote_host = manager.remote_host
+        self.remote_port = manager.remote_port
+        self.ipv6 = manager.ipv6
+        self.reconnect = reconnect
+        self.profiler = profiler
+
+    @property
+    def connection(self):
+        if not self.manager.is_connected():
+            return None
+        return self.manager.connection
+
+    def connect(self):
+        '''
+        Perform actual connection to the server
+        '''
+        self.manager.connect()
+
+    def disconnect(self):
+        '''
+        Close connection with the server
+        '''
+        self.manager.disconnect()
 
     def is_connected(self):
         '''
@@ -86,6 +222,18 @@ class NSTSClient(object):
             raise ProtocolError("Profile {0} is not supported remotely"
                                 .format(profile_info.params['error']))
 
+    def list_profiles(self):
+        '''
+        Request the catalogue of profiles that are installed remotely
+        @return A list of profile metadata, as described by
+            nsts.profiles.plugins.describe()
+        '''
+        if not self.is_connected():
+            raise NotConnectedError()
+
+        self.connection.send_msg("LISTPROFILES")
+        return self.connection.wait_msg_type("PROFILELIST").params["profiles"]
+
     def run_profile(self, ctx, terminal):
         '''
         Run a profile and return results
@@ -104,64 +252,101 @@ class NSTSClient(object):
             # Check support (remote and local
             logger.debug("Checking profile '{0}'".format(ctx.name))
 
-            if not executor.is_supported():
-                logger.warning("Profile '{0}' is not supported locally."
-                               .format(executor.name))
-                raise ProtocolError("Profile {0} is not supported locally"
-                                    .format(ctx.name))
-            self.check_profile(ctx.profile.id)
+            with ctx.phase('check_profile'):
+                if not executor.is_supported():
+                    logger.warning("Profile '{0}' is not supported locally."
+                                   .format(ctx.name))
+                    raise ProtocolError("Profile {0} is not supported locally"
+                                        .format(ctx.name))
+                self.check_profile(ctx.profile.id)
 
             # Instantiate profile remotely
             logger.debug("Request remote to instantiate profile '{0}'."
                          .format(ctx.name))
-            self.connection.send_msg("INSTANTIATEPROFILE", {
-                "profile_id": ctx.profile.id,
-                "direction": str(ctx.direction.opposite()),
-                "options": ctx.options,
-                'execution_id': ctx.id})
-            self.connection.wait_msg_type("OK")
-            executor.prepare()
+            with ctx.phase('instantiate'):
+                self.connection.send_msg("INSTANTIATEPROFILE", {
+                    "profile_id": ctx.profile.id,
+                    "direction": str(ctx.direction.opposite()),
+                    "options": ctx.options,
+                    'execution_id': ctx.id})
+                self.connection.wait_msg_type("OK")
+            with ctx.phase('prepare'):
+                executor.prepare()
 
             # Execute profile
             logger.debug("Profile execution '{0} started'.".format(ctx.name))
-            executor.run()
+            with ctx.phase('run'):
+                executor.run()
 
             # Stop execution
             logger.debug("Profile '{0}' finished.".format(ctx.name))
-            ctx.connection.send_msg("EXECUTIONFINISHED",
-                                    {"execution_id": ctx.id})
-            ctx.connection.wait_msg_type("EXECUTIONFINISHED")
+            with ctx.phase('finish'):
+                ctx.connection.send_msg("EXECUTIONFINISHED",
+                                        {"execution_id": ctx.id})
+                finished = ctx.connection.wait_msg_type("EXECUTIONFINISHED")
+            ctx.remote_timings.update(finished.params.get('timings', {}))
 
             ctx.mark_finished()
         except BaseException, e:
             logger.critical("Unhandled exception: " + str(type(e)) + str(e))
+            if execution_failed:
+                execution_failed.send(ctx, error=e)
             executor.cleanup()
             raise
 
         # Clean up
-        executor.cleanup()
+        with ctx.phase('cleanup'):
+            executor.cleanup()
         terminal.profile_execution_finished(ctx)
+        if execution_finished:
+            execution_finished.send(ctx, results=ctx.results)
 
-    def run_test(self, test, samples, interval, terminal):
+    def run_test(self, test, samples, interval, terminal, defaults=None):
         '''
         Run a test as described by SpeedTest object.
         It will execute profile multiple times and
         save results in the given test parameter.
+        If precision is set in test options or defaults, sampling is
+        adaptive and continues until a StoppingRule is satisfied, with
+        samples being the minimum number of samples.
         @param test SpeedTest object
         @param samples int Default number of samples
         @param interval float Seconds between samples
         @param terminal The terminal to output progress
+        @param defaults Options with default adaptive sampling options
+        If the connection is lost, the client reconnects and resumes from
+        the failed sample, up to "reconnect" times in a row.
         '''
         assert isinstance(test, SpeedTest)
+        if self.profiler is None:
+            return self.__run_test(test, samples, interval, terminal,
+                                   defaults)
+
+        self.profiler.start()
+        try:
+            self.__run_test(test, samples, interval, terminal, defaults)
+        finally:
+            # Include the output that is rendered in the background
+            if hasattr(terminal, 'flush'):
+                terminal.flush()
+            self.profiler.stop(
+                "test-{0}-{1}".format(test.profile.id, test.direction),
+                [str(sample.id) for sample in test.samples])
+
+    def __run_test(self, test, samples, interval, terminal, defaults):
+        test_started.send(test)
         terminal.test_execution_started(test)
 
         if test.options['samples'] is not None:
             samples = test.options['samples']
         if test.options['interval'] is not None:
             interval = test.options['interval']
+        rule = StoppingRule.for_test(test, samples, defaults)
 
         # Run profile multiple times and save results
-        for i in range(0, samples):
+        i = 0
+        resumed = 0
+        while rule is not None or i < samples:
             # Create execution
             ctx = ProfileExecution(
                 profile=test.profile,
@@ -169,12 +354,36 @@ class NSTSClient(object):
                 connection=self.connection,
                 options=test.profile_options)
 
-            self.run_profile(ctx, terminal)
+            try:
+                self.run_profile(ctx, terminal)
+            except (ConnectionClosedException, socket.error), e:
+                resumed += 1
+                if resumed > self.reconnect:
+                    raise
+                logger.warning("Connection lost while executing sample {0} "
+                               "of '{1}', resuming ({2}/{3}).".format(
+                                   i + 1, test.name, resumed, self.reconnect))
+                self.manager.reconnect()
+                continue
+            resumed = 0
             test.push_sample(ctx)
+            i += 1
+
+            if rule is not None:
+                rule.push(ctx)
+                test.stop_reason = rule.stop_reason()
+                if test.stop_reason is not None:
+                    logger.info("Test '{0}' stopped after {1} samples "
+                                "({2}).".format(test.name, i,
+                                                test.stop_reason))
+                    break
+            elif i >= samples:
+                break
 
             # Wait if interval is set and it is not last
-            if i < (samples - 1) and interval.scale('sec') is not None:
+            if interval.scale('sec') is not None:
                 time.sleep(interval.scale('sec'))
+        test_finished.send(test)
         terminal.test_execution_finished(test)
 
     def run_suite(self, suite, terminal):
@@ -184,9 +393,12 @@ class NSTSClient(object):
         @param terminal The terminal to output progress
         '''
         assert isinstance(suite, SpeedTestSuite)
+        suite_started.send(suite)
         terminal.suite_execution_started(suite)
 
         for test in suite.tests:
             self.run_test(test, suite.options['samples'],
-                          suite.options['interval'], terminal)
+                          suite.options['interval'], terminal,
+                          suite.options)
+        suite_finished.send(suite)
         terminal.suite_execution_finished(suite)
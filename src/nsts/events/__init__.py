@@ -5,6 +5,12 @@ notification.
 @license: GPLv3
 @author: NSTS Contributors (see AUTHORS.txt)
 """
+import logging
+import threading
+import Queue
+
+# Module logger
+logger = logging.getLogger("events")
 
 
 class Notification(object):
@@ -12,12 +18,124 @@ class Notification(object):
     Object that is passed to subscribers when
     they are notified about an event.
     """
+    __slots__ = ['event_name', 'sender', 'extra']
+
     def __init__(self, event_name, sender, extra):
         self.event_name = event_name
         self.sender = sender
         self.extra = extra
 
 
+class Event(object):
+    """
+    A named event and the list of its subscribers. Events that
+    are registered with a list of fields are typed, and every
+    notification must carry exactly these fields.
+
+    The truth value of an event is True only if it has subscribers,
+    so publishers can skip building notification parameters:
+        if event:
+            event.send(self, param=expensive())
+    """
+
+    def __init__(self, name, fields=None):
+        self.name = name
+        self.fields = None if fields is None else frozenset(fields)
+        self.subscribers = []
+
+    def __nonzero__(self):
+        return bool(self.subscribers)
+
+    def send(self, sender=None, **kwargs):
+        """
+        Notify all subscribers of this event
+        @param sender The sender of this notification
+        All extra parameters are passed directly to the notification
+        object.
+        """
+        if not self.subscribers:
+            return
+        if self.fields is not None and self.fields != frozenset(kwargs):
+            raise TypeError(
+                "Event '{0}' expects fields {1}, got {2}".format(
+                    self.name, sorted(self.fields), sorted(kwargs)))
+
+        n = Notification(event_name=self.name, sender=sender, extra=kwargs)
+        for callback in self.subscribers:
+            callback(n)
+
+
+class AsyncSubscriber(object):
+    """
+    Wrapper of a subscriber that receives notifications through a
+    bounded queue and processes them in a background thread, so that
+    a slow subscriber never stalls the publisher.
+
+    When the queue is full, the "drop" policy discards the notification
+    while the "block" policy waits until there is free space.
+    """
+
+    POLICIES = ['drop', 'block']
+
+    def __init__(self, callback, maxsize=1024, policy='drop'):
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown queue policy '{0}'".format(policy))
+        self.callback = callback
+        self.policy = policy
+        self.delivered = 0
+        self.dropped = 0
+        self.failed = 0
+        self.__queue = Queue.Queue(maxsize)
+        self.__thread = threading.Thread(target=self.__worker,
+                                         name='events-async')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    @property
+    def pending(self):
+        """
+        Number of notifications waiting in queue
+        """
+        return self.__queue.qsize()
+
+    def __call__(self, notification):
+        if self.policy == 'block':
+            self.__queue.put(notification)
+            return
+        try:
+            self.__queue.put_nowait(notification)
+        except Queue.Full:
+            self.dropped += 1
+
+    def __worker(self):
+        while True:
+            notification = self.__queue.get()
+            try:
+                if notification is None:
+                    return
+                self.callback(notification)
+                self.delivered += 1
+            except Exception, e:
+                self.failed += 1
+                logger.error("Subscriber of '{0}' failed: {1}".format(
+                    notification.event_name, e))
+            finally:
+                self.__queue.task_done()
+
+    def flush(self):
+        """
+        Wait until all queued notifications are processed
+        """
+        self.__queue.join()
+
+    def close(self):
+        """
+        Process queued notifications and stop background thread
+        """
+        self.__queue.put(None)
+        self.__thread.join()
+
+
 class Dispatcher(dict):
     """
     Event dispatcher implements a central
@@ -25,15 +143,44 @@ class Dispatcher(dict):
     publisher to send notifications.
     """
 
-    def connect(self, event_name, callback):
+    def register(self, event_name, fields=None):
+        """
+        Register an event ahead of time. Publishers on hot paths
+        should keep the returned Event and send through it.
+        @param event_name The name of the event
+        @param fields If given, the list of fields that all
+            notifications of this event carry.
+        @return The Event object
+        """
+        if event_name in self:
+            event = self[event_name]
+            if fields is not None:
+                event.fields = frozenset(fields)
+            return event
+        event = self[event_name] = Event(event_name, fields)
+        return event
+
+    def connect(self, event_name, callback, queue_size=None, policy='drop'):
         """
         Connect a subscriber at an event.
         @param event_name The name of the event
         @param callback The callback to be called on publishing.
+        @param queue_size If given, callback is called asynchronously
+            through a queue of this size (see AsyncSubscriber).
+        @param policy Policy of the asynchronous queue when it is full.
+        @return The callback that was connected
         """
-        if event_name not in self:
-            self[event_name] = []
-        self[event_name].append(callback)
+        if queue_size is not None:
+            callback = AsyncSubscriber(callback, queue_size, policy)
+        self.register(event_name).subscribers.append(callback)
+        return callback
+
+    def disconnect(self, event_name, callback):
+        """
+        Disconnect a subscriber from an event.
+        """
+        if event_name in self and callback in self[event_name].subscribers:
+            self[event_name].subscribers.remove(callback)
 
     def send(self, event_name, sender=None, **kwargs):
         """
@@ -44,11 +191,9 @@ class Dispatcher(dict):
         All extra parameters are passed directly to the notification
         object.
         """
-        if event_name not in self:
+        event = self.get(event_name)
+        if event is None or not event.subscribers:
             return
-
-        n = Notification(event_name=event_name, sender=sender, extra=kwargs)
-        for callback in self[event_name]:
-            callback(n)
+        event.send(sender, **kwargs)
 
 dispatcher = Dispatcher()
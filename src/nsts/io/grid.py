@@ -21,13 +21,20 @@ class ColumnDescriptor(object):
 
 
 class Grid(object):
-    pass
+    '''
+    Render tabular data in plain text. Cells are formatted and the width
+    of 'fit' columns is tracked incrementally as rows are added, so
+    rendering is a single pass over the rows.
+    '''
 
     def __init__(self, width, units_format="0.3f"):
         self.width = width
         self.column_descriptor = []
         self.rows = []
         self.units_format = units_format
+        self.__unit_cell_format = "{0:" + units_format + "} {1}"
+        self.__number_cell_format = "{0:" + units_format + "}"
+        self.__content_widths = []
 
     def add_column(self, title, width='equal', align='left'):
         '''
@@ -37,26 +44,33 @@ class Grid(object):
         - number: a fixed width in number of characters
         Align can be 'left', 'right' or 'center'
         '''
-        self.column_descriptor.append(
-            ColumnDescriptor(title=title, width=width, align=align))
+        column = ColumnDescriptor(title=title, width=width, align=align)
+        self.column_descriptor.append(column)
+        index = len(self.column_descriptor) - 1
+        self.__content_widths.append(max(
+            [len(column.title)] +
+            [len(row[index]) for row in self.rows if len(row) > index]))
+
+    def format_cell(self, cell):
+        '''
+        Convert a cell value to its string representation
+        '''
+        if isinstance(cell, basestring):
+            return cell.strip()
+        elif isinstance(cell, int):
+            return str(cell)
+        elif isinstance(cell, units.Unit):
+            oscale = cell.optimal_scale()
+            return self.__unit_cell_format.format(oscale[0], oscale[1])
+        return self.__number_cell_format.format(cell)
 
     def add_row(self, row):
         assert isinstance(row, list)
+        content_widths = self.__content_widths
         for i, cell in enumerate(row):
-            if isinstance(cell, basestring):
-                row[i] = cell.strip()
-            elif isinstance(cell, int):
-                row[i] = str(cell)
-            elif isinstance(cell, units.Unit):
-                oscale = cell.optimal_scale()
-                row[i] = "{value:{format}} {unit}".format(
-                    value=oscale[0],
-                    format=self.units_format,
-                    unit=oscale[1])
-            else:
-                row[i] = "{value:{format}}".format(
-                    value=cell,
-                    format=self.units_format)
+            row[i] = cell = self.format_cell(cell)
+            if i < len(content_widths) and len(cell) > content_widths[i]:
+                content_widths[i] = len(cell)
         self.rows.append(row)
 
     def get_column_widths(self):
@@ -66,19 +80,17 @@ class Grid(object):
         column_widths = [c.width for c in self.column_descriptor]
         for i, c_width in enumerate(column_widths):
             if c_width == 'fit':
-                column_widths[i] = -1
-                column_widths[i] = max([len(row[i]) for row in self.rows])
-                column_widths[i] = max(
-                    column_widths[i],
-                    len(self.column_descriptor[i].title))
+                column_widths[i] = self.__content_widths[i]
 
         # Calculate space that is fixed
-        fixed_space = sum([w for w in column_widths if w is not 'equal'])
+        fixed_space = sum([w for w in column_widths if w != 'equal'])
         # Space used by cell delimiters
         fixed_space += (len(self.column_descriptor) - 1) * 3 + 4
 
         # Calculate equal space
         total_equal = column_widths.count('equal')
+        if not total_equal:
+            return column_widths
         equal_cell_width = int(self.width - fixed_space) // total_equal
 
         # Find error from rounding and append to the first column
@@ -92,69 +104,90 @@ class Grid(object):
         return column_widths
 
     def __render_split_row(self, column_widths):
+        return "+-" + "-+-".join(["-" * w for w in column_widths]) + "-+"
 
-        output = "+-"
-        for i, cwidth in enumerate(column_widths):
-            output += "{0:-<{width}}".format("", width=cwidth)
-            if i != len(column_widths) - 1:
-                output += "-+-"
-        output += "-+"
-        return output
-
-    def __render_row(self, row, column_widths):
-
-        row_data = [cell for cell in row]
-        # This variable will be populated with an extra row
-        # if data does not fit
-        extra_row = None
-
-        output = "| "
-        for i, cwidth in enumerate(column_widths):
-
-            # Split in multiple rows if cell does not fit
-            if len(row_data[i]) > cwidth:
-                # If this is the first multiline cell, initialize next row
-                if extra_row is None:
-                    extra_row = [""] * len(column_widths)
-                # Split data to current row and next row(s)
-                extra_row[i] = row_data[i][cwidth:]
-                row_data[i] = row_data[i][:cwidth]
-
-            # Format cell
-            output += "{0: {align}{width}}".format(
-                row_data[i],
-                width=cwidth,
-                align=self.column_descriptor[i].align_symbol)
-            if i != len(column_widths) - 1:
-                output += " | "
-        output += " |"
-
-        # Recursively populate extra rows
-        if extra_row:
-            output += "\n" + self.__render_row(extra_row, column_widths)
-        return output
+    def __cell_formats(self, column_widths):
+        '''
+        Prepare the format string of each cell for the given widths
+        '''
+        return [
+            "{0: " + self.column_descriptor[i].align_symbol + str(w) + "}"
+            for i, w in enumerate(column_widths)]
 
-    def render(self):
+    def __render_row(self, row, column_widths, cell_formats, output):
+        '''
+        Append the lines of a row at the output list
+        '''
+        while row is not None:
+            # This variable will be populated with an extra row
+            # if data does not fit
+            extra_row = None
+            cells = []
+            for i, cwidth in enumerate(column_widths):
+                cell = row[i]
+                # Split in multiple rows if cell does not fit
+                if len(cell) > cwidth:
+                    if extra_row is None:
+                        extra_row = [""] * len(column_widths)
+                    extra_row[i] = cell[cwidth:]
+                    cell = cell[:cwidth]
+                cells.append(cell_formats[i].format(cell))
+            output.append("| " + " | ".join(cells) + " |")
+            row = extra_row
+
+    def __render_header(self, column_widths, cell_formats, output):
+        split_row = self.__render_split_row(column_widths)
+        output.append(split_row)
+
+        # Render titles
+        titles = [c.title for c in self.column_descriptor]
+        if max([len(t) for t in titles]):
+            self.__render_row(titles, column_widths, cell_formats, output)
+            output.append(split_row)
+
+    def iter_lines(self, page_rows=None):
+        '''
+        Generator of rendered lines, one row at a time.
+        @param page_rows If set, header is repeated every page_rows rows
+        '''
         if not self.column_descriptor:
             raise RuntimeError("Cannot create a grid with no columns")
 
         column_widths = self.get_column_widths()
-        output = ""
-
-        output += self.__render_split_row(column_widths) + "\n"
-
-        # Render titles
-        titles = [c.title for c in self.column_descriptor]
-        title_max_size = max([len(t) for t in titles])
-        if title_max_size:
-            output += self.__render_row(titles, column_widths) + "\n"
-            output += self.__render_split_row(column_widths) + "\n"
+        cell_formats = self.__cell_formats(column_widths)
+        lines = []
+        self.__render_header(column_widths, cell_formats, lines)
+        for line in lines:
+            yield line
 
         # Render data
-        for row in self.rows:
-            output += self.__render_row(row, column_widths) + "\n"
-        output += self.__render_split_row(column_widths)
-        return output
+        for index, row in enumerate(self.rows):
+            lines = []
+            if page_rows and index and not index % page_rows:
+                self.__render_header(column_widths, cell_formats, lines)
+            self.__render_row(row, column_widths, cell_formats, lines)
+            for line in lines:
+                yield line
+        yield self.__render_split_row(column_widths)
+
+    def write(self, stream, page_rows=None, chunk_rows=1024):
+        '''
+        Stream rendering of grid at a file-like object, writing
+        chunk_rows lines at a time.
+        @param page_rows If set, header is repeated every page_rows rows
+        '''
+        chunk = []
+        for line in self.iter_lines(page_rows):
+            chunk.append(line)
+            if len(chunk) >= chunk_rows:
+                chunk.append('')
+                stream.write("\n".join(chunk))
+                chunk = []
+        chunk.append('')
+        stream.write("\n".join(chunk))
+
+    def render(self):
+        return "\n".join(self.iter_lines())
 
     def __repr__(self):
         return self.render()
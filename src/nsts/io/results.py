@@ -0,0 +1,422 @@
+'''
+Storage and querying of speedtest results.
+
+Results are stored in a flat binary file of fixed-size records, one record
+per result value of every sample. Next to it, an index file keeps the
+minimum and maximum values of every block of records so that queries can
+skip whole blocks without touching them. Reading is performed through
+memory-mapping, so files of millions of rows are never loaded as a whole.
+
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+import os
+import calendar
+import datetime
+import numpy as np
+from nsts.profiles.base import Profile
+
+# Magic header of a results file
+MAGIC = 'NSTSRES\0'
+
+# Version of the file format
+FORMAT_VERSION = 1
+
+# Number of records that are summarized by one index entry
+BLOCK_SIZE = 4096
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('block_size', '<u4')])
+
+RECORD_DTYPE = np.dtype([
+    ('started_at', '<f8'),
+    ('execution_time', '<f8'),
+    ('value', '<f8'),
+    ('direction', 'u1'),
+    ('profile', 'S32'),
+    ('result', 'S32'),
+    ('target', 'S64')])
+
+INDEX_DTYPE = np.dtype([
+    ('started_min', '<f8'),
+    ('started_max', '<f8'),
+    ('directions', 'u1'),
+    ('profile_min', 'S32'),
+    ('profile_max', 'S32'),
+    ('target_min', 'S64'),
+    ('target_max', 'S64')])
+
+# Encoding of execution direction in records
+DIRECTION_SEND = 1
+DIRECTION_RECEIVE = 2
+
+
+class ResultsFileError(IOError):
+    '''
+    Exception raised when a results file is malformed
+    '''
+    pass
+
+
+def to_timestamp(value):
+    '''
+    Convert a datetime (UTC) or a number to a unix timestamp
+    '''
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        return calendar.timegm(value.utctimetuple()) \
+            + value.microsecond / 1000000.0
+    return float(value)
+
+
+def encode_direction(direction):
+    '''
+    Convert an ExecutionDirection or a string to its record code
+    '''
+    if str(direction) in ['send', 's']:
+        return DIRECTION_SEND
+    elif str(direction) in ['receive', 'r']:
+        return DIRECTION_RECEIVE
+    raise ValueError("Direction '{0}' is not a valid direction."
+                     .format(direction))
+
+
+def check_field(name, value):
+    '''
+    Ensure that a value fits in a string field of a record
+    @param name The name of the field in RECORD_DTYPE
+    @param value The value that will be stored
+    @return The value as a string
+    '''
+    value = str(value)
+    size = RECORD_DTYPE[name].itemsize
+    if len(value) > size:
+        raise ValueError("The {0} '{1}' is longer than {2} characters and "
+                         "cannot be stored in a results file."
+                         .format(name, value, size))
+    return value
+
+
+def index_filename(filename):
+    '''
+    Get the filename of the index that accompanies a results file
+    '''
+    return filename + '.idx'
+
+
+def summarize_block(records):
+    '''
+    Calculate the index entry of a block of records
+    '''
+    entry = np.zeros(1, dtype=INDEX_DTYPE)
+    entry['started_min'] = records['started_at'].min()
+    entry['started_max'] = records['started_at'].max()
+    entry['directions'] = np.bitwise_or.reduce(records['direction'])
+    # Strings cannot be reduced, np.unique() returns them sorted
+    profiles = np.unique(records['profile'])
+    entry['profile_min'] = profiles[0]
+    entry['profile_max'] = profiles[-1]
+    targets = np.unique(records['target'])
+    entry['target_min'] = targets[0]
+    entry['target_max'] = targets[-1]
+    return entry
+
+
+class ResultsWriter(object):
+    '''
+    Append results of executed samples at a results file.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.__pending = []
+
+        if not os.path.isfile(self.filename) or \
+                os.path.getsize(self.filename) == 0:
+            header = np.zeros(1, dtype=HEADER_DTYPE)
+            header['magic'] = MAGIC
+            header['version'] = FORMAT_VERSION
+            header['block_size'] = BLOCK_SIZE
+            with open(self.filename, 'wb') as f:
+                f.write(header.tostring())
+        else:
+            # Validate that we append on a compatible file
+            ResultsFile(self.filename)
+
+    def push_sample(self, sample, target):
+        '''
+        Queue all result values of a sample for writing
+        @param sample The ProfileExecution object of the sample
+        @param target The host that the sample was executed against
+        '''
+        started_at = to_timestamp(sample.started_at)
+        execution_time = sample.execution_time().raw_value
+        direction = encode_direction(sample.direction)
+        profile_id = check_field('profile', sample.profile.id)
+        target = check_field('target', target)
+        for result_id, value in sample.results.items():
+            self.__pending.append((
+                started_at,
+                execution_time,
+                value.raw_value,
+                direction,
+                profile_id,
+                check_field('result', result_id),
+                target))
+
+    def push_test(self, test, target):
+        '''
+        Queue all samples of a SpeedTest for writing
+        '''
+        for sample in test.samples:
+            self.push_sample(sample, target)
+
+    def flush(self):
+        '''
+        Write all queued records and update block index
+        '''
+        if self.__pending:
+            records = np.array(self.__pending, dtype=RECORD_DTYPE)
+            with open(self.filename, 'ab') as f:
+                f.write(records.tostring())
+            self.__pending = []
+        self.__update_index()
+
+    def close(self):
+        self.flush()
+
+    def __update_index(self):
+        '''
+        Append index entries for every block that was completed
+        '''
+        data_size = os.path.getsize(self.filename) - HEADER_DTYPE.itemsize
+        total_blocks = (data_size // RECORD_DTYPE.itemsize) // BLOCK_SIZE
+
+        idx_filename = index_filename(self.filename)
+        indexed_blocks = 0
+        if os.path.isfile(idx_filename):
+            indexed_blocks = os.path.getsize(idx_filename) \
+                // INDEX_DTYPE.itemsize
+        if indexed_blocks >= total_blocks:
+            return
+
+        records = np.memmap(
+            self.filename, dtype=RECORD_DTYPE, mode='r',
+            offset=HEADER_DTYPE.itemsize,
+            shape=(total_blocks * BLOCK_SIZE,))
+        with open(idx_filename, 'ab') as f:
+            for block in range(indexed_blocks, total_blocks):
+                f.write(summarize_block(
+                    records[block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE])
+                    .tostring())
+        del records
+
+
+class ResultsFile(object):
+    '''
+    Read-only, memory-mapped access on a results file.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+
+        header = np.fromfile(filename, dtype=HEADER_DTYPE, count=1)
+        if len(header) != 1 or header['magic'][0] != MAGIC.rstrip('\0'):
+            raise ResultsFileError(
+                "'{0}' is not an NSTS results file".format(filename))
+        if header['version'][0] != FORMAT_VERSION:
+            raise ResultsFileError(
+                "Unsupported results file version {0}"
+                .format(header['version'][0]))
+        self.block_size = int(header['block_size'][0])
+
+        rows = (os.path.getsize(filename) - HEADER_DTYPE.itemsize) \
+            // RECORD_DTYPE.itemsize
+        if rows:
+            self.records = np.memmap(
+                filename, dtype=RECORD_DTYPE, mode='r',
+                offset=HEADER_DTYPE.itemsize, shape=(rows,))
+        else:
+            self.records = np.zeros(0, dtype=RECORD_DTYPE)
+
+        idx_filename = index_filename(filename)
+        if os.path.isfile(idx_filename):
+            self.index = np.fromfile(idx_filename, dtype=INDEX_DTYPE)
+        else:
+            self.index = np.zeros(0, dtype=INDEX_DTYPE)
+
+        # Summarize blocks that are not indexed yet (normally the last one)
+        total_blocks = (rows + self.block_size - 1) // self.block_size
+        if len(self.index) < total_blocks:
+            missing = [
+                summarize_block(self.records[
+                    b * self.block_size:(b + 1) * self.block_size])
+                for b in range(len(self.index), total_blocks)]
+            self.index = np.concatenate([self.index[:total_blocks]]
+                                        + missing)
+        self.index = self.index[:total_blocks]
+
+    def __len__(self):
+        return len(self.records)
+
+    def __candidate_blocks(self, profile, direction, target, since, until):
+        '''
+        Find blocks that may contain matching records using the index
+        '''
+        index = self.index
+        mask = np.ones(len(index), dtype=bool)
+        if profile is not None:
+            mask &= (index['profile_min'] <= profile) \
+                & (index['profile_max'] >= profile)
+        if target is not None:
+            mask &= (index['target_min'] <= target) \
+                & (index['target_max'] >= target)
+        if direction is not None:
+            mask &= (index['directions'] & direction) != 0
+        if since is not None:
+            mask &= index['started_max'] >= since
+        if until is not None:
+            mask &= index['started_min'] < until
+        return np.flatnonzero(mask)
+
+    def __candidate_ranges(self, blocks):
+        '''
+        Merge consecutive candidate blocks in row ranges
+        '''
+        if not len(blocks):
+            return
+        splits = np.flatnonzero(np.diff(blocks) != 1) + 1
+        for run in np.split(blocks, splits):
+            yield (run[0] * self.block_size,
+                   min((run[-1] + 1) * self.block_size, len(self.records)))
+
+    def query(self, result_id, profile=None, direction=None, target=None,
+              since=None, until=None):
+        '''
+        Select the values of a result that match all given filters.
+        @param result_id The id of the result value
+        @param profile The id of the profile
+        @param direction ExecutionDirection or 'send'/'receive'
+        @param target The host that samples were executed against
+        @param since Datetime (UTC) or timestamp of the earliest sample
+        @param until Datetime (UTC) or timestamp that samples must precede
+        @return ResultsSelection object
+        '''
+        if direction is not None:
+            direction = encode_direction(direction)
+        since = to_timestamp(since)
+        until = to_timestamp(until)
+
+        unit_type = None
+        if profile is not None and profile in Profile.get_all_profiles():
+            results = Profile.get_all_profiles()[profile].supported_results
+            if result_id in results:
+                unit_type = results[result_id].unit_type
+
+        started_at = []
+        values = []
+        blocks = self.__candidate_blocks(
+            profile, direction, target, since, until)
+        for start, end in self.__candidate_ranges(blocks):
+            chunk = self.records[start:end]
+            mask = chunk['result'] == result_id
+            if profile is not None:
+                mask &= chunk['profile'] == profile
+            if target is not None:
+                mask &= chunk['target'] == target
+            if direction is not None:
+                mask &= chunk['direction'] == direction
+            if since is not None:
+                mask &= chunk['started_at'] >= since
+            if until is not None:
+                mask &= chunk['started_at'] < until
+            started_at.append(chunk['started_at'][mask])
+            values.append(chunk['value'][mask])
+
+        if values:
+            return ResultsSelection(
+                np.concatenate(started_at), np.concatenate(values),
+                unit_type)
+        return ResultsSelection(np.zeros(0), np.zeros(0), unit_type)
+
+
+class ResultsSelection(object):
+    '''
+    A set of result values as selected by a query.
+    '''
+
+    def __init__(self, started_at, values, unit_type=None):
+        self.started_at = started_at
+        self.values = values
+        self.unit_type = unit_type
+
+    def __len__(self):
+        return len(self.values)
+
+    def __wrap(self, value):
+        if self.unit_type is None:
+            return float(value)
+        return self.unit_type(value)
+
+    def statistics(self):
+        '''
+        Calculate statistics the same way SpeedTest.statistics() does
+        '''
+        if not len(self.values):
+            raise ValueError("Cannot calculate statistics on empty selection")
+        return {
+            'mean': self.__wrap(self.values.mean()),
+            'min': self.__wrap(self.values.min()),
+            'max': self.__wrap(self.values.max()),
+            'std': self.__wrap(self.values.std())}
+
+    def percentiles(self, percents=(50, 90, 95, 99)):
+        '''
+        Calculate percentiles of values
+        @return A list of tuples with percent and value
+        '''
+        if not len(self.values):
+            raise ValueError("Cannot calculate percentiles on empty selection")
+        computed = np.percentile(self.values, percents)
+        return [(p, self.__wrap(v)) for p, v in zip(percents, computed)]
+
+    def rollup(self, bucket):
+        '''
+        Calculate statistics per time bucket
+        @param bucket The width of each bucket in seconds or units.Time
+        @return A list of dictionaries ordered by bucket start time
+        '''
+        if hasattr(bucket, 'raw_value'):
+            bucket = bucket.raw_value
+        if not len(self.values):
+            return []
+
+        keys = np.floor(self.started_at / bucket)
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        values = self.values[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+        counts = np.diff(np.r_[starts, len(values)])
+        sums = np.add.reduceat(values, starts)
+        means = sums / counts
+        squares = np.add.reduceat((values - np.repeat(means, counts)) ** 2,
+                                  starts)
+        mins = np.minimum.reduceat(values, starts)
+        maxs = np.maximum.reduceat(values, starts)
+        stds = np.sqrt(squares / counts)
+
+        rollup = []
+        for i, start in enumerate(starts):
+            rollup.append({
+                'started_at': datetime.datetime.utcfromtimestamp(
+                    keys[start] * bucket),
+                'samples': int(counts[i]),
+                'mean': self.__wrap(means[i]),
+                'min': self.__wrap(mins[i]),
+                'max': self.__wrap(maxs[i]),
+                'std': self.__wrap(stds[i])})
+        return rollup
@@ -8,12 +8,22 @@ Created on Nov 6, 2013
 import datetime
 import sys
 import socket
-from nsts import core
+import json
+import csv
+import logging
+import threading
+import Queue
+from collections import OrderedDict
+from cStringIO import StringIO
+from nsts import core, utils
 from nsts.speedtest import SpeedTest, SpeedTestSuite
 from nsts.options import OptionsDescriptor, Options
 from grid import Grid
 from nsts.profiles.base import ProfileExecution
 
+# Module logger
+logger = logging.getLogger("terminal")
+
 
 class ClientTerminalOptionsDescriptor(OptionsDescriptor):
 
@@ -60,6 +70,11 @@ class ClientTerminal(object):
         Called to list all available profile
         '''
 
+    def list_capabilities(self, report):
+        '''
+        Called to list the external tools of profiles and their versions
+        '''
+
     def profile_execution_started(self, profile):
         '''
         Called when profile has started execution
@@ -113,11 +128,13 @@ class BasicTerminal(ClientTerminal):
         super(BasicTerminal, self).__init__()
         self.width = 80
 
-    def __print_test_properties(self, test):
-        print "samples: {0} | took: {1} | started: {2}".format(
+    def _print_test_properties(self, test):
+        print "samples: {0} | took: {1} | started: {2}{3}".format(
             len(test.samples),
             test.execution_time().optimal_combined_scale_str(),
-            test.started_at)
+            test.started_at,
+            '' if test.stop_reason is None
+            else ' | stopped: ' + test.stop_reason)
 
     def welcome(self):
         print "Network SpeedTest Suite [NSTS] Version" \
@@ -175,6 +192,18 @@ class BasicTerminal(ClientTerminal):
             print ""
             # print "{0:-<{width}}".format("",width = self.width)
 
+    def list_capabilities(self, report):
+        # List external tools mode
+        for entry in report:
+            if entry['executable'] is None:
+                status = "not installed"
+            else:
+                status = "{0} ({1})".format(
+                    entry['executable'], entry['version'] or "unknown version")
+            print "{e[profile]: <15} {e[direction]: <8} {e[binary]: <17}: " \
+                "{status}".format(e=entry, status=status)
+        print ""
+
     def profile_execution_finished(self, profile):
         assert isinstance(profile, ProfileExecution)
         if not self.options['verbose']:
@@ -192,7 +221,7 @@ class BasicTerminal(ClientTerminal):
         if not self.options['verbose']:
             print '{0} samples, Done!'.format(len(test.samples))
         else:
-            self.__print_test_properties(test)
+            self._print_test_properties(test)
             grid = Grid(self.width)
             grid.add_column('', width='fit')
             grid.add_column('Took', width='fit')
@@ -204,7 +233,28 @@ class BasicTerminal(ClientTerminal):
                 row.extend(sample.results.values())
 
                 grid.add_row(row)
-            print grid
+            grid.write(sys.stdout)
+            self._print_overhead_breakdown(test)
+
+    def _print_overhead_breakdown(self, test):
+        '''
+        Print how much time each execution phase took on this peer
+        '''
+        phases = test.phase_statistics()
+        if not phases:
+            return
+        total = sum([stats['mean'].raw_value for stats in phases.values()])
+        grid = Grid(self.width)
+        grid.add_column('Phase', width='fit')
+        grid.add_column('Mean', width='equal')
+        grid.add_column('Min', width='equal')
+        grid.add_column('Max', width='equal')
+        grid.add_column('Share', width='fit', align='right')
+        for phase, stats in phases.items():
+            share = 0 if not total else stats['mean'].raw_value / total
+            grid.add_row([phase, stats['mean'], stats['min'], stats['max'],
+                          "{0:.1%}".format(share)])
+        grid.write(sys.stdout)
 
     def suite_execution_finished(self, suite):
         assert isinstance(suite, SpeedTestSuite)
@@ -217,10 +267,7 @@ class BasicTerminal(ClientTerminal):
         for test in suite.tests:
             print ""
             print test.name
-            print "samples: {0} | took: {1} | started: {2}".format(
-                len(test.samples),
-                test.execution_time().optimal_combined_scale_str(),
-                test.started_at)
+            self._print_test_properties(test)
             grid = Grid(self.width)
             grid.add_column('Metric', width='fit')
             grid.add_column('Mean', width='equal')
@@ -238,6 +285,276 @@ class BasicTerminal(ClientTerminal):
                     metric_stats['max'],
                     metric_stats['std']])
             print grid
+            if test.calibration is not None and test.samples:
+                self._print_corrected_results(test)
+
+    def _print_corrected_results(self, test):
+        '''
+        Print results corrected by the loopback calibration of the test
+        '''
+        print "Corrected with loopback calibration of {0}".format(
+            test.calibration.created_at)
+        grid = Grid(self.width)
+        grid.add_column('Metric', width='fit')
+        grid.add_column('Raw', width='equal')
+        grid.add_column('Loopback', width='equal')
+        grid.add_column('Corrected', width='equal')
+        for row in test.calibration.correct(test):
+            grid.add_row(list(row))
+        print grid
 
     def epilog(self):
         print 'Bye!'
+
+
+class LiveTerminal(BasicTerminal):
+    '''
+    Terminal for humans that updates running statistics in place
+    every time a sample is finished. Statistics are accumulated
+    incrementally so the cost per sample does not depend on the number
+    of samples already executed.
+    '''
+
+    def __init__(self):
+        super(LiveTerminal, self).__init__()
+        self.__statistics = None
+        self.__test_name = None
+        self.__line_length = 0
+
+    def test_execution_started(self, test):
+        self.__test_name = test.name
+        self.__statistics = OrderedDict()
+        for result_entry in test.profile.supported_results.values():
+            self.__statistics[result_entry.id] = utils.RunningStatistics(
+                result_entry.unit_type)
+        self.__line_length = 0
+        sys.stdout.write('{0}: '.format(self.__test_name))
+        sys.stdout.flush()
+
+    def __render_progress(self):
+        '''
+        Render a single line with the progress of the primary result
+        '''
+        stats = self.__statistics.values()[0]
+        line = "{name}: #{count} last {last} | mean {mean} | std {std} | " \
+            "min {min} | max {max}".format(
+                name=self.__test_name,
+                count=stats.count,
+                last=self.__format(stats.last),
+                mean=self.__format(stats.mean()),
+                std=self.__format(stats.std()),
+                min=self.__format(stats.min()),
+                max=self.__format(stats.max()))
+        # Pad with spaces to overwrite any leftovers of the previous line
+        padded = "{0: <{width}}".format(line, width=self.__line_length)
+        self.__line_length = len(line)
+        return padded
+
+    def __format(self, value):
+        oscale = value.optimal_scale()
+        return "{0:0.3f} {1}".format(oscale[0], oscale[1])
+
+    def profile_execution_finished(self, profile):
+        assert isinstance(profile, ProfileExecution)
+        for result_id, value in profile.results.items():
+            self.__statistics[result_id].push(value)
+        if not self.__statistics:
+            return
+        sys.stdout.write('\r' + self.__render_progress())
+        sys.stdout.flush()
+
+    def test_execution_finished(self, test):
+        assert isinstance(test, SpeedTest)
+        sys.stdout.write('\n')
+        self._print_test_properties(test)
+
+
+class MachineTerminal(ClientTerminal):
+    '''
+    Terminal that streams one machine-readable record per finished
+    execution, test and suite. Records are written as JSON Lines or CSV
+    and flushed as soon as they are produced. CSV is in long format,
+    with a row per value of a record: the "result" and "stat" columns
+    name the value ("value" for samples, "mean", "min", "max" or "std"
+    for tests).
+    '''
+
+    CSV_FIELDS = ['event', 'test', 'profile', 'direction', 'execution_id',
+                  'started_at', 'execution_time', 'samples', 'result',
+                  'stat', 'value']
+
+    CSV_STATS = ['mean', 'min', 'max', 'std']
+
+    def __init__(self, output_format='jsonl', stream=None, extra_fields=None):
+        '''
+        @param output_format 'jsonl' or 'csv'
+        @param stream The output stream, by default stdout
+        @param extra_fields A dictionary of fields added to every JSON record
+        '''
+        super(MachineTerminal, self).__init__()
+        if output_format not in ['jsonl', 'csv']:
+            raise ValueError("Unknown output format '{0}'"
+                             .format(output_format))
+        self.output_format = output_format
+        self.stream = sys.stdout if stream is None else stream
+        self.extra_fields = extra_fields or {}
+        self.__header_written = False
+
+    def __format_csv(self, record):
+        buf = StringIO()
+        writer = csv.writer(buf, lineterminator='\n')
+        if not self.__header_written:
+            writer.writerow(self.CSV_FIELDS)
+            self.__header_written = True
+        values = record.get('values', {})
+        metrics = []
+        for key in sorted(values):
+            if isinstance(values[key], dict):
+                for stat in self.CSV_STATS:
+                    metrics.append(
+                        [key, stat, '{0}'.format(values[key][stat])])
+            else:
+                metrics.append([key, 'value', '{0}'.format(values[key])])
+        common = [record.get(field, '') for field in self.CSV_FIELDS[:-3]]
+        for metric in metrics or [['', '', '']]:
+            writer.writerow(common + metric)
+        return buf.getvalue()
+
+    def write_record(self, record):
+        '''
+        Serialize a record and flush it to the output stream
+        '''
+        if self.output_format == 'jsonl':
+            if self.extra_fields:
+                record = dict(self.extra_fields, **record)
+            data = json.dumps(record, sort_keys=True) + '\n'
+        else:
+            data = self.__format_csv(record)
+        self.stream.write(data)
+        self.stream.flush()
+
+    def profile_execution_finished(self, profile):
+        assert isinstance(profile, ProfileExecution)
+        self.write_record({
+            'event': 'profile_execution_finished',
+            'profile': profile.profile.id,
+            'direction': str(profile.direction),
+            'execution_id': profile.id,
+            'started_at': profile.started_at.isoformat(),
+            'execution_time': profile.execution_time().raw_value,
+            'timings': dict(profile.timings),
+            'remote_timings': dict(profile.remote_timings),
+            'values': dict(
+                (result_id, value.raw_value)
+                for result_id, value in profile.results.items())})
+
+    def test_execution_finished(self, test):
+        assert isinstance(test, SpeedTest)
+        statistics = {}
+        started_at = None
+        if test.samples:
+            started_at = test.started_at.isoformat()
+            for result_id, stats in test.statistics().items():
+                statistics[result_id] = dict(
+                    (key, value.raw_value) for key, value in stats.items())
+        record = {
+            'event': 'test_execution_finished',
+            'test': test.name,
+            'profile': test.profile.id,
+            'direction': str(test.direction),
+            'started_at': started_at,
+            'execution_time': test.execution_time().raw_value,
+            'samples': len(test.samples),
+            'values': statistics}
+        if test.stop_reason is not None:
+            record['stop_reason'] = test.stop_reason
+        if test.calibration is not None and test.samples:
+            record['corrected'] = dict(
+                (name, corrected.raw_value) for name, _, _, corrected
+                in test.calibration.correct(test))
+        self.write_record(record)
+
+    def suite_execution_finished(self, suite):
+        assert isinstance(suite, SpeedTestSuite)
+        self.write_record({
+            'event': 'suite_execution_finished',
+            'execution_time': sum(
+                [t.execution_time().raw_value for t in suite.tests]),
+            'samples': sum([len(t.samples) for t in suite.tests])})
+
+
+class DeferredTerminal(object):
+    '''
+    Wrapper of a terminal that performs all calls in a background thread,
+    so that rendering and statistics never delay the control traffic
+    of the next sample. Calls are queued in order, and when the queue
+    is full the caller waits so that no output is lost. Objects are
+    passed to the terminal when they are final (e.g. a finished sample
+    or test), so they are not modified while the terminal reads them.
+    '''
+
+    def __init__(self, terminal, maxsize=1024, profiler=None):
+        '''
+        @param terminal The terminal to perform calls on
+        @param maxsize The maximum number of queued calls
+        @param profiler A SelfProfiler to profile calls with or None
+        '''
+        self.terminal = terminal
+        self.profiler = profiler
+        self.failed = 0
+        self.__queue = Queue.Queue(maxsize)
+        self.__thread = threading.Thread(target=self.__worker,
+                                         name='terminal')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    @property
+    def options(self):
+        return self.terminal.options
+
+    @property
+    def pending(self):
+        '''
+        Number of calls waiting in queue
+        '''
+        return self.__queue.qsize()
+
+    def __getattr__(self, name):
+        method = getattr(self.terminal, name)
+        if not callable(method):
+            return method
+
+        def deferred(*args, **kwargs):
+            self.__queue.put((method, args, kwargs))
+        return deferred
+
+    def __worker(self):
+        while True:
+            call = self.__queue.get()
+            try:
+                if call is None:
+                    return
+                method, args, kwargs = call
+                if self.profiler is not None:
+                    self.profiler.call(method, *args, **kwargs)
+                else:
+                    method(*args, **kwargs)
+            except Exception, e:
+                self.failed += 1
+                logger.error("Terminal call '{0}' failed: {1}".format(
+                    method.__name__, e))
+            finally:
+                self.__queue.task_done()
+
+    def flush(self):
+        '''
+        Wait until all queued calls are performed
+        '''
+        self.__queue.join()
+
+    def close(self):
+        '''
+        Perform queued calls and stop background thread
+        '''
+        self.__queue.put(None)
+        self.__thread.join()
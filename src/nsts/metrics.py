@@ -0,0 +1,257 @@
+'''
+Runtime metrics of NSTS and an HTTP endpoint that exposes them
+in Prometheus/OpenMetrics text format.
+
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+import threading
+import logging
+import BaseHTTPServer
+import SocketServer
+
+# Module logger
+logger = logging.getLogger("metrics")
+
+# Default buckets of histograms (in seconds)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5,
+                   1, 5, 10, 30, 60, 300)
+
+
+def escape_label_value(value):
+    '''
+    Escape a label value as defined by the text exposition format
+    '''
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')\
+        .replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=()):
+    '''
+    Render a set of labels in the form {name="value",...}
+    '''
+    pairs = ['{0}="{1}"'.format(n, escape_label_value(v))
+             for n, v in list(zip(names, values)) + list(extra)]
+    if not pairs:
+        return ''
+    return '{' + ','.join(pairs) + '}'
+
+
+class Metric(object):
+    '''
+    Base class for all metrics. A metric holds one value per
+    combination of label values.
+    '''
+
+    type_name = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError("Metric '{0}' expects labels {1}".format(
+                self.name, self.labels))
+        return tuple(labels[l] for l in self.labels)
+
+    def value(self, **labels):
+        '''
+        Get the current value for the given labels
+        '''
+        return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        '''
+        Render metric in text exposition format
+        '''
+        lines = ['# HELP {0} {1}'.format(self.name, self.help),
+                 '# TYPE {0} {1}'.format(self.name, self.type_name)]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append('{0}{1} {2!r}'.format(
+                self.name, format_labels(self.labels, key), float(value)))
+        return lines
+
+
+class Counter(Metric):
+    '''
+    A value that can only increase
+    '''
+
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    '''
+    A value that can go up and down
+    '''
+
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    '''
+    Distribution of observed values in cumulative buckets
+    '''
+
+    type_name = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            entry = self._values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += 1
+            entry[2] += value
+
+    def value(self, **labels):
+        '''
+        Get the number of observations for the given labels
+        '''
+        entry = self._values.get(self._key(labels))
+        return 0 if entry is None else entry[1]
+
+    def render(self):
+        lines = ['# HELP {0} {1}'.format(self.name, self.help),
+                 '# TYPE {0} {1}'.format(self.name, self.type_name)]
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2]))
+                           for k, v in self._values.items())
+        for key, (buckets, count, total) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, buckets):
+                cumulative += bucket_count
+                lines.append('{0}_bucket{1} {2!r}'.format(
+                    self.name,
+                    format_labels(self.labels, key, [('le', repr(bound))]),
+                    float(cumulative)))
+            lines.append('{0}_bucket{1} {2!r}'.format(
+                self.name,
+                format_labels(self.labels, key, [('le', '+Inf')]),
+                float(count)))
+            lines.append('{0}_count{1} {2!r}'.format(
+                self.name, format_labels(self.labels, key), float(count)))
+            lines.append('{0}_sum{1} {2!r}'.format(
+                self.name, format_labels(self.labels, key), total))
+        return lines
+
+
+class Registry(object):
+    '''
+    A collection of metrics that are exposed together
+    '''
+
+    def __init__(self):
+        self.__metrics = []
+        self.__lock = threading.Lock()
+
+    def register(self, metric):
+        assert isinstance(metric, Metric)
+        with self.__lock:
+            self.__metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        '''
+        Render all metrics in text exposition format
+        '''
+        lines = []
+        with self.__lock:
+            metrics = list(self.__metrics)
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+
+class MetricsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Serve the metrics of the registry at /metrics
+    '''
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class MetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''
+    HTTP server that exposes a metrics registry. It serves
+    in a background daemon thread.
+    '''
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port, host='127.0.0.1', registry=registry):
+        BaseHTTPServer.HTTPServer.__init__(
+            self, (host, port), MetricsRequestHandler)
+        self.registry = registry
+        self.thread = None
+
+    def start(self):
+        '''
+        Start serving in a background thread
+        '''
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       name='metrics')
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info("Metrics are exposed at http://{0}:{1}/metrics".format(
+            *self.server_address))
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
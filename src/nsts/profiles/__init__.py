@@ -1 +1 @@
-__all__ = ["base", "dummy", "ping", "iperf", "apache"]
+__all__ = ["base", "builtin", "dummy", "ping", "iperf", "apache", "http"]
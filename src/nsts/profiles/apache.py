@@ -10,43 +10,205 @@ import hashlib
 import os
 import signal
 import re
-from nsts.profiles.base import SpeedTestRuntimeError, Profile
+import math
+import stat
+import errno
+import logging
+import tempfile
+from nsts.profiles.base import SpeedTestRuntimeError, ProfileExecutor
 from nsts import units, utils
-from subprocess import SubProcessExecutorBase
+from subprocess import SubProcessExecutorBase, spawn, wait_until, \
+    is_listening, PIPE
+from pool import WarmResource, pool
+from builtin import LATENCY_PERCENTILES
+import http
 
+# Module logger
+logger = logging.getLogger("apache")
 
-class ApacheExecutorServer(SubProcessExecutorBase):
 
-    def __init__(self, owner):
-        super(ApacheExecutorServer, self).__init__(owner, '/usr/sbin/apache2')
-        self.apache_basic_options = [
-            "HostnameLookups Off",
-            "KeepAlive On",
-            "MaxKeepAliveRequests 100",
-            "KeepAliveTimeout 5"]
-        self.execution_id = None
-        self.apache_running = False
+# Directory of generated files that are reused across executions. It is
+# private to the user, as apache serves whatever files it contains.
+CACHE_DIRECTORY = os.path.join(
+    tempfile.gettempdir(), "nsts-apache-cache-{0}".format(os.getuid()))
+
+# Maximum total size of cached files in bytes
+CACHE_LIMIT = 1024 ** 3
+
+# Seconds to wait for apache to exit after SIGTERM, and after SIGKILL
+STOP_TIMEOUT = 10
+
+# Size of the random block that generated files are made of. It is larger
+# than the window of common compressors so content is not compressible.
+RANDOM_BLOCK_SIZE = 1024 * 1024
+
+# Ratio of successive file sizes of time mode
+SIZE_STEP = 2 ** 0.25
+
+
+def quantize_size(size, minimum=1024):
+    '''
+    Round a file size up to the closest size of a geometric ladder, so
+    that close sizes resolve to the same cached file.
+    '''
+    size = max(int(size), minimum)
+    steps = math.ceil(round(math.log(float(size) / minimum, SIZE_STEP), 6))
+    return int(math.ceil(minimum * SIZE_STEP ** steps))
+
+
+class FileCache(object):
+    '''
+    Cache of files with random content, generated once per size from a
+    single random block and reused across samples and executions.
+    '''
+
+    def __init__(self, directory=CACHE_DIRECTORY, limit=CACHE_LIMIT):
+        self.directory = directory
+        self.limit = limit
+        self.__block = None
+
+    @property
+    def block(self):
+        if self.__block is None:
+            self.__block = os.urandom(RANDOM_BLOCK_SIZE)
+        return self.__block
+
+    # Filenames of finished cached files
+    FILENAME = re.compile(r'^file-\d+$')
+
+    def path_for(self, size):
+        return os.path.join(self.directory, "file-{0}".format(int(size)))
+
+    def ensure_directory(self):
+        '''
+        Create the cache directory, private to the current user, and
+        check that a directory that already exists is not shared.
+        '''
+        try:
+            os.makedirs(self.directory, 0700)
+        except OSError, e:
+            # Created by a concurrent execution
+            if e.errno != errno.EEXIST:
+                raise
+        info = os.lstat(self.directory)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() \
+                or info.st_mode & 0077:
+            raise SpeedTestRuntimeError(
+                "Cache directory '{0}' must be a directory that only the "
+                "current user can access.".format(self.directory))
+
+    def get(self, size):
+        '''
+        Get the path of a cached file of exactly this size,
+        generating it if needed.
+        @param size The size in bytes, e.g. the raw value of units.Byte
+        '''
+        size = int(size)
+        path = self.path_for(size)
+        if os.path.isfile(path) and os.path.getsize(path) == size:
+            os.utime(path, None)
+            return path
+        self.evict(size)
+        self.generate(path, size)
+        return path
+
+    def generate(self, path, size):
+        self.ensure_directory()
+        logger.debug("Generating cached file {0} with size {1}".format(
+            path, size))
+        temp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        block = self.block
+        with open(temp_path, "wb", len(block)) as f:
+            remaining = size
+            while remaining > 0:
+                chunk = block[:remaining]
+                f.write(chunk)
+                remaining -= len(chunk)
+        os.rename(temp_path, path)
+
+    def evict(self, needed):
+        '''
+        Remove least recently used files to keep cache under limit.
+        Files that are being generated are never removed.
+        '''
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        for filename in os.listdir(self.directory):
+            if not self.FILENAME.match(filename):
+                continue
+            try:
+                info = os.stat(os.path.join(self.directory, filename))
+            except OSError:
+                # Evicted by a concurrent execution
+                continue
+            entries.append((info.st_mtime, info.st_size, filename))
+        total = sum([e[1] for e in entries]) + needed
+        for _, size, filename in sorted(entries):
+            if total <= self.limit:
+                break
+            try:
+                os.unlink(os.path.join(self.directory, filename))
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+            total -= size
+
+file_cache = FileCache()
+
+
+class ApacheInstance(WarmResource):
+    '''
+    A running apache server with its own document root. It is kept
+    warm in the pool, so that consecutive executions only publish
+    their files in the document root.
+    '''
+
+    basic_options = [
+        "HostnameLookups Off",
+        "KeepAlive On",
+        "MaxKeepAliveRequests 100",
+        "KeepAliveTimeout 5"]
+
+    def __init__(self, executable, port):
+        self.executable = executable
+        self.port = port
+        sha1 = hashlib.sha1()
+        sha1.update(str(random.random()) + str(time.time()))
+        self.instance_id = sha1.hexdigest()
+        self.running = False
 
     @property
     def pid_file(self):
-        return "/tmp/nsts-apache-{0}.pid".format(self.execution_id)
+        return "/tmp/nsts-apache-{0}.pid".format(self.instance_id)
 
     @property
     def error_log_file(self):
-        return "/tmp/nsts-apache-error-{0}.log".format(self.execution_id)
+        return "/tmp/nsts-apache-error-{0}.log".format(self.instance_id)
 
     @property
     def access_log_file(self):
-        return "/tmp/nsts-apache-access-{0}.log".format(self.execution_id)
+        return "/tmp/nsts-apache-access-{0}.log".format(self.instance_id)
 
     @property
     def document_root(self):
-        return "/tmp/nsts-apache-root-{0}".format(self.execution_id)
-
-    def start_apache(self):
+        return "/tmp/nsts-apache-root-{0}".format(self.instance_id)
+
+    def read_pid(self):
+        '''
+        Get the PID of apache from its PID file or None
+        '''
+        try:
+            with open(self.pid_file, "r") as f:
+                return int(f.read().strip())
+        except (IOError, ValueError):
+            return None
+
+    def start(self):
+        os.mkdir(self.document_root)
 
         # Prepare apache arguments
-        extra_arguments = list(self.apache_basic_options)
+        extra_arguments = list(self.basic_options)
         extra_arguments.append("PidFile {0}".format(self.pid_file))
         extra_arguments.append(
             'LogFormat "%h %l %u %t \\"%r\\" %>s %b \\"%{Referer}'
@@ -56,75 +218,124 @@ class ApacheExecutorServer(SubProcessExecutorBase):
             "CustomLog {0} combined".format(self.access_log_file))
         extra_arguments.append(
             "DocumentRoot {0}".format(self.document_root))
-        extra_arguments.append(
-            "Listen {0}".format(self.context.options['port']))
+        extra_arguments.append("Listen {0}".format(self.port))
 
-        apache_arguments = ["-d", "/tmp"]
+        apache_arguments = [self.executable, "-d", "/tmp"]
         for opt in extra_arguments:
             apache_arguments.append("-c")
             apache_arguments.append(opt)
 
-        # Start apache
-        self.logger.debug("Starting apache server")
-        self.execute_subprocess(*apache_arguments)
-
-        # Wait for apache to begin
-        while self.is_subprocess_running():
-            time.sleep(0.2)
-        self.apache_running = True
-        self.logger.debug("Apache server started")
-
-    def stop_apache(self):
-        if not self.apache_running:
+        # Start apache and wait for it to detach
+        logger.debug("Starting apache server")
+        handle = spawn(apache_arguments, self, stdout=PIPE)
+        output = handle.communicate()[0]
+        if handle.returncode != 0:
+            self.remove_files()
+            raise SpeedTestRuntimeError(
+                "Apache failed to start: {0}".format(output.strip()))
+        self.running = True
+        waited = wait_until(lambda: is_listening(self.port),
+                            description="apache to listen")
+        logger.debug("Apache server started, listening after {0:.3f} sec"
+                     .format(waited))
+
+    def stop(self):
+        if not self.running:
+            self.remove_files()
             return
+        self.running = False
+        try:
+            logger.debug("Stopping apache server gracefully.")
+            pid = self.read_pid()
+            if pid is None:
+                raise SpeedTestRuntimeError(
+                    "There is no PID file {0}".format(self.pid_file))
+
+            logger.debug(
+                "Found PID {0} in pid file, sending SIGTERM signal"
+                .format(pid))
+            os.kill(pid, signal.SIGTERM)
+            try:
+                wait_until(lambda: not utils.check_pid(pid), STOP_TIMEOUT,
+                           description="apache to exit")
+            except SpeedTestRuntimeError:
+                logger.warning("Apache did not exit after SIGTERM, "
+                               "sending SIGKILL signal.")
+                # Workers are in the process group of the detached apache
+                try:
+                    os.killpg(pid, signal.SIGKILL)
+                except OSError:
+                    os.kill(pid, signal.SIGKILL)
+                wait_until(lambda: not utils.check_pid(pid), STOP_TIMEOUT,
+                           description="apache to be killed")
+        finally:
+            self.remove_files()
+
+    def is_healthy(self):
+        if not self.running:
+            return False
+        pid = self.read_pid()
+        return pid is not None and utils.check_pid(pid)
+
+    def publish(self, filename, filesize):
+        '''
+        Publish a cached file of the requested size in document root
+        '''
+        logger.debug(
+            "Publishing document {0} with size {1}".format(filename, filesize))
+        source = file_cache.get(filesize)
+        target = os.path.join(self.document_root, filename)
+        if os.path.lexists(target):
+            os.unlink(target)
+        try:
+            os.link(source, target)
+        except OSError:
+            # Different filesystems
+            os.symlink(source, target)
 
-        self.logger.debug("Stopping apache server gracefully.")
-        if not os.path.isfile(self.pid_file):
-            raise SpeedTestRuntimeError(
-                "There is no PID file {0}".format(self.pid_file))
+    def clear_root(self):
+        logger.debug("Request to empty document root.")
+        if not os.path.isdir(self.document_root):
+            return
+        for filename in os.listdir(self.document_root):
+            os.unlink(os.path.join(self.document_root, filename))
 
-        # Stopping apache
-        pid = int(open(self.pid_file, "r").read().strip())
-        self.logger.debug(
-            "Found PID {0} in pid file, sending SIGTERM signal".format(pid))
-        os.kill(pid, signal.SIGTERM)
+    def remove_files(self):
+        for filename in [self.pid_file, self.error_log_file,
+                         self.access_log_file]:
+            if os.path.isfile(filename):
+                os.unlink(filename)
+        self.clear_root()
+        if os.path.isdir(self.document_root):
+            os.rmdir(self.document_root)
 
-        while utils.check_pid(pid):
-            time.sleep(0.2)
-        self.apache_running = False
 
-    def prepare(self):
-        # Generate execution id
-        sha1 = hashlib.sha1()
-        sha1.update(str(random.random()) + str(time.time()))
-        self.execution_id = sha1.hexdigest()
+class ApacheExecutorServer(SubProcessExecutorBase):
 
-        # Create document root
-        os.mkdir(self.document_root)
+    binary_name = '/usr/sbin/apache2'
 
-    def generate_root_file(self, filename, filesize):
-        self.logger.debug(
-            "Generating document {0} with size {1}".format(filename, filesize))
-        with open(os.path.join(self.document_root, filename), "w") as f:
-            chunk_size = 1024 * 1024
-            written_size = 0
-            while written_size < filesize:
-                f.write(os.urandom(chunk_size))
-                if filesize - written_size < chunk_size:
-                    chunk_size = filesize - written_size
-                written_size += chunk_size
+    def __init__(self, owner):
+        super(ApacheExecutorServer, self).__init__(owner)
+        self.apache = None
+        self.apache_key = None
 
-    def clear_root(self):
-        self.logger.debug("Request to empty document root.")
-        if not os.path.isdir(self.document_root):
-            return
-        for filename in os.listdir(self.document_root):
-            os.unlink(os.path.join(self.document_root, filename))
+    def prepare(self):
+        # Warm up cache with the initial file
+        supported = self.context.options.supported
+        filesize = int(self.context.options['filesize'].raw_value)
+        if 'mode' in supported and self.context.options['mode'] == 'time':
+            filesize = quantize_size(filesize)
+        file_cache.get(filesize)
 
     def run(self):
-        # Start server
+        # Get a running server
         self.wait_msg_type("STARTSERVER")
-        self.start_apache()
+        port = self.context.options['port']
+        self.apache_key = (self.context.profile.id,
+                           self.subprocess_executable, port)
+        self.apache = pool.acquire(
+            self.apache_key,
+            lambda: ApacheInstance(self.subprocess_executable, port))
         self.send_msg("OK")
 
         # Generate random files as requested by client
@@ -132,12 +343,13 @@ class ApacheExecutorServer(SubProcessExecutorBase):
             msg = self.wait_msg_type("GENERATEFILE")
             if msg.params['size'] == 0:
                 break
-            self.clear_root()
-            self.generate_root_file(msg.params['filename'], msg.params['size'])
-            time.sleep(1)
+            self.apache.clear_root()
+            self.apache.publish(msg.params['filename'], msg.params['size'])
             self.send_msg("OK")
 
-        self.stop_apache()
+        self.apache.clear_root()
+        pool.release(self.apache_key, self.apache)
+        self.apache = None
         self.send_msg("OK")
 
         # Collect results
@@ -145,25 +357,18 @@ class ApacheExecutorServer(SubProcessExecutorBase):
 
     def cleanup(self):
         self.logger.debug("Cleaning up everything!")
-        self.stop_apache()
-
-        # Cleaning up files
-        if os.path.isfile(self.pid_file):
-            os.unlink(self.pid_file)
-        if os.path.isfile(self.error_log_file):
-            os.unlink(self.error_log_file)
-        if os.path.isfile(self.access_log_file):
-            os.unlink(self.access_log_file)
-
-        self.clear_root()
-        if os.path.isdir(self.document_root):
-            os.rmdir(self.document_root)
+        super(ApacheExecutorServer, self).cleanup()
+        if self.apache is not None:
+            pool.discard(self.apache_key, self.apache)
+            self.apache = None
 
 
 class WgetExecutorClient(SubProcessExecutorBase):
 
+    binary_name = 'wget'
+
     def __init__(self, owner):
-        super(WgetExecutorClient, self).__init__(owner, 'wget')
+        super(WgetExecutorClient, self).__init__(owner)
         self.basic_argumnets = [
             "--no-cache",
             "-O", "/dev/null"]
@@ -186,46 +391,112 @@ class WgetExecutorClient(SubProcessExecutorBase):
 
     def download_file(self, filename):
         self.logger.debug("Request to download file {0}".format(filename))
+        started = utils.monotonic()
         self.execute_subprocess(self.url_for(filename), *self.basic_argumnets)
-        while self.is_subprocess_running():
-            time.sleep(0.5)
+        self.wait_subprocess()
+        self.download_duration = utils.monotonic() - started
         self.logger.debug("Download finished")
         return self.parse_output()
 
+    def download_concurrently(self, filename, concurrency):
+        '''
+        Download a file with concurrent flows of the built-in HTTP client
+        @return A FlowsResult
+        '''
+        self.logger.debug("Request to download file {0} with {1} flows"
+                          .format(filename, concurrency))
+        result = http.fetch_concurrently(
+            self.context.connection.remote_addr, self.context.options['port'],
+            ['/' + filename], concurrency)
+        if not result.requests:
+            raise SpeedTestRuntimeError("All HTTP downloads failed.")
+        return result
+
+    def probe_latency(self, filename):
+        '''
+        Measure the latency of small requests of a file
+        @return A LogHistogram
+        '''
+        histogram = http.probe_latency(
+            self.context.connection.remote_addr, self.context.options['port'],
+            '/' + filename)
+        if not histogram.count:
+            raise SpeedTestRuntimeError("All HTTP latency probes failed.")
+        return histogram
+
+    def download(self, filename):
+        '''
+        Download a file with wget, or with the concurrent flows of the
+        built-in HTTP client if concurrency is more than one. The
+        measurement is kept at self.speed or self.flows respectively.
+        @return The duration of the download in seconds
+        '''
+        concurrency = self.context.options['concurrency']
+        if concurrency > 1:
+            self.flows = self.download_concurrently(filename, concurrency)
+            return self.flows.duration
+        self.speed = self.download_file(filename)
+        return self.download_duration
+
+    def store_single_flow_results(self, speed, latency):
+        '''
+        Store the results of a single flow
+        @param speed The transfer rate that wget reported
+        @param latency A LogHistogram of latency of small requests
+        '''
+        self.store_result('transfer_rate', speed)
+        self.store_result('flow_rate', speed)
+        self.store_result('fairness', 100)
+        for percent in LATENCY_PERCENTILES:
+            self.store_result('latency_p{0}'.format(percent),
+                              latency.percentile(percent))
+
+    def store_flows_results(self, result):
+        self.store_result('transfer_rate', result.throughput())
+        rates = result.flow_throughputs()
+        self.store_result('flow_rate', sum(rates) / len(rates))
+        self.store_result('fairness', result.fairness() * 100)
+        histogram = result.latency_histogram()
+        for percent in LATENCY_PERCENTILES:
+            self.store_result('latency_p{0}'.format(percent),
+                              histogram.percentile(percent))
+
     def run(self):
         self.send_msg("STARTSERVER")
         self.wait_msg_type("OK")
 
-        filesize = self.context.options['filesize'].raw_value
+        filesize = int(self.context.options['filesize'].raw_value)
 
         if (self.context.options['mode'] == 'time'):
-            # Run wget on incremental sizes
+            # Download incremental sizes
             count = 0
+            filesize = quantize_size(filesize)
             while True:
                 filename = "file_{0}".format(count)
                 self.send_msg(
                     "GENERATEFILE",
                     {'filename': filename, 'size': filesize})
                 self.wait_msg_type('OK')
-                speed = self.download_file(filename)
+                duration = self.download(filename)
 
-                # Ensure that the achieved speed was 10 times
-                # smaller than file size or reached max file size
+                # Ensure that the download lasted at least downloadtime
+                # or reached max file size
                 maxfilesize = self.context.options['maxfilesize'].raw_value
                 downloadtime = self.context.options['downloadtime'].raw_value
-                if filesize >= maxfilesize or\
-                        speed.raw_value < (filesize / downloadtime):
+                if filesize >= maxfilesize or duration > downloadtime:
                     break
-                self.logger.debug("Downloaded {0} bytes with {1} speed".format(
-                    filesize, speed))
-
-                # Calculate new filesize and ensure
-                # that we don't exceeded cap size
-                filesize = min(
-                    int(speed.raw_value * downloadtime * 1.5),
-                    self.context.options['maxfilesize'].raw_value)
+                self.logger.debug("Downloaded {0} bytes in {1} sec".format(
+                    filesize, duration))
+
+                # Project the size that needs downloadtime at the achieved
+                # speed and round it up to a cached size, without
+                # exceeding cap size
+                filesize = int(min(
+                    quantize_size(
+                        filesize * downloadtime / max(duration, 1e-6) * 1.2),
+                    maxfilesize))
                 self.logger.debug("Increased file_size to  {0} bytes".format(
-                    filesize, speed))
+                    filesize))
                 count += 1
         else:
             filename = "file_static"
@@ -233,9 +504,14 @@ class WgetExecutorClient(SubProcessExecutorBase):
                 "GENERATEFILE",
                 {'filename': filename, 'size': filesize})
             self.wait_msg_type('OK')
-            speed = self.download_file(filename)
+            self.download(filename)
 
-        self.store_result('transfer_rate', speed)
+        if self.context.options['concurrency'] > 1:
+            self.store_flows_results(self.flows)
+        else:
+            # wget reports no latency, probe it with small requests
+            self.store_single_flow_results(
+                self.speed, self.probe_latency(filename))
 
         # Stop server
         self.send_msg("GENERATEFILE", {'size': 0})
@@ -259,25 +535,48 @@ class WgetExecutorClient(SubProcessExecutorBase):
     def cleanup(self):
         SubProcessExecutorBase.cleanup(self)
 
-p = Profile(
-    "apache", "HTTP (apache)", ApacheExecutorServer, WgetExecutorClient,
-    "Measure the performance of HTTP, by setting up a "
-    "sandboxed apache server and download arbitrary binary files.")
-p.add_result("transfer_rate", "TransferRate", units.ByteRate)
-p.supported_options.add_option(
-    "port", "Apache listen port",
-    unit_type=int, default=58338)
-p.supported_options.add_option(
-    'mode', '"size" to download a specific filesize,'
-    ' "time" to download for a specified period',
-    unit_type=str, default='size')
-p.supported_options.add_option(
-    "filesize", "The size of file to download (size mode), "
-    "or the initial filesize to try.(time mode)",
-    unit_type=units.Byte, default="1 Mbyte")
-p.supported_options.add_option(
-    "maxfilesize", "The maximum filesize to download (time mode)",
-    unit_type=units.Byte, default="100 Mbyte")
-p.supported_options.add_option(
-    'downloadtime', 'Minimum time to download a continuous file (time mode)',
-    unit_type=units.Time, default='10 sec')
+
+class RequestRateExecutorClient(ProfileExecutor):
+    '''
+    Generate load of small keep-alive requests against the sandboxed
+    apache server.
+    '''
+
+    def is_supported(self):
+        return True
+
+    def prepare(self):
+        pass
+
+    def run(self):
+        options = self.context.options
+        self.send_msg("STARTSERVER")
+        self.wait_msg_type("OK")
+        self.send_msg("GENERATEFILE", {
+            'filename': 'object',
+            'size': int(options['filesize'].raw_value)})
+        self.wait_msg_type('OK')
+
+        try:
+            rate = options['rate']
+            result = http.generate_load(
+                self.context.connection.remote_addr, options['port'],
+                '/object', options['duration'].raw_value,
+                options['concurrency'], rate.raw_value if rate else None)
+        finally:
+            # Stop server
+            self.send_msg("GENERATEFILE", {'size': 0})
+            self.wait_msg_type("OK")
+
+        if not result.requests:
+            raise SpeedTestRuntimeError(
+                "All {0} requests failed.".format(result.errors))
+        self.store_result('request_rate', result.request_rate())
+        self.store_result('errors', result.errors)
+        for percent in LATENCY_PERCENTILES:
+            self.store_result('latency_p{0}'.format(percent),
+                              result.histogram.percentile(percent))
+        self.propagate_results()
+
+    def cleanup(self):
+        pass
@@ -9,14 +9,26 @@ import logging
 import datetime
 import hashlib
 import random
+import importlib
 from collections import OrderedDict
+from contextlib import contextmanager
 from nsts.proto import NSTSConnection
 from nsts.units import Time, Unit
 from nsts.options import OptionsDescriptor, Options
+from nsts.events import dispatcher
+from nsts import utils
 
 # Module logger
 logger = logging.getLogger("test")
 
+# Module events
+phase_finished = dispatcher.register(
+    'execution_phase_finished', ['phase', 'duration'])
+profile_instantiated = dispatcher.register(
+    'profile_instantiated', ['profile', 'direction'])
+result_stored = dispatcher.register('result_stored', ['result_id', 'value'])
+results_collected = dispatcher.register('results_collected', ['results'])
+
 
 class SpeedTestRuntimeError(RuntimeError):
     '''
@@ -183,6 +195,9 @@ class ProfileExecutor(object):
                 .format(result_id))
         self.__results[result_id] = self.profile.supported_results[result_id]\
             .unit_type(value)
+        if result_stored:
+            result_stored.send(self, result_id=result_id,
+                               value=self.__results[result_id])
 
     def propagate_results(self):
         '''
@@ -197,6 +212,8 @@ class ProfileExecutor(object):
         '''
         results_msg = self.wait_msg_type("RESULTS")
         self.__results = results_msg.params['results']
+        if results_collected:
+            results_collected.send(self, results=self.__results)
 
     def is_supported(self):
         '''
@@ -237,18 +254,26 @@ class Profile(object):
     '''
 
     __registered_profiles = {}
+    __discovered = False
+
+    # Module with the declarations of the profiles shipped with NSTS
+    BUILTIN_PROFILES = 'nsts.profiles.builtin'
 
     def __init__(self, test_id, name, send_executor_class,
                  receive_executor_class, description=None):
-        if not issubclass(send_executor_class, ProfileExecutor) or \
-                not issubclass(receive_executor_class, ProfileExecutor):
-            raise TypeError(
-                "executor_class must be subclass "
-                "of ProfileExecutor")
+        '''
+        @param send_executor_class The send executor type or its dotted
+            path (e.g. "nsts.profiles.iperf.IperfExecutorSender"). A path
+            is imported on first use of the executor, so that listing
+            profiles does not import the modules of all the tools.
+        @param receive_executor_class The receive executor type or path
+        '''
+        self.__send_executor_class = self.__check_executor_class(
+            send_executor_class)
+        self.__receive_executor_class = self.__check_executor_class(
+            receive_executor_class)
         self.__test_id = test_id
         self.__name = name
-        self.__send_executor_class = send_executor_class
-        self.__receive_executor_class = receive_executor_class
         self.__supported_results = OrderedDict()
         self.__supported_options = OptionsDescriptor()
         self.__description = description
@@ -256,8 +281,37 @@ class Profile(object):
         # Add profile instance in the global list
         self.__registered_profiles[self.id] = self
 
+    @staticmethod
+    def __check_executor_class(executor_class):
+        if isinstance(executor_class, basestring):
+            return executor_class
+        if not isinstance(executor_class, type) or \
+                not issubclass(executor_class, ProfileExecutor):
+            raise TypeError(
+                "executor_class must be subclass "
+                "of ProfileExecutor")
+        return executor_class
+
+    @staticmethod
+    def __resolve_executor_class(path):
+        '''
+        Import the executor type of a dotted path
+        '''
+        logger.debug("Importing executor {0}.".format(path))
+        return Profile.__check_executor_class(utils.import_object(path))
+
     @staticmethod
     def get_all_profiles():
+        '''
+        Get all registered profiles, declaring the built-in ones and those
+        of plugins on first call. Declarations are lightweight, executor
+        modules are imported only when a profile is executed.
+        '''
+        if not Profile.__discovered:
+            Profile.__discovered = True
+            importlib.import_module(Profile.BUILTIN_PROFILES)
+            from nsts.profiles import plugins
+            plugins.discover(Profile.__registered_profiles)
         return Profile.__registered_profiles
 
     @property
@@ -286,6 +340,9 @@ class Profile(object):
         '''
         Type of the send executor
         '''
+        if isinstance(self.__send_executor_class, basestring):
+            self.__send_executor_class = self.__resolve_executor_class(
+                self.__send_executor_class)
         return self.__send_executor_class
 
     @property
@@ -293,8 +350,29 @@ class Profile(object):
         '''
         Type of the receive executor object
         '''
+        if isinstance(self.__receive_executor_class, basestring):
+            self.__receive_executor_class = self.__resolve_executor_class(
+                self.__receive_executor_class)
         return self.__receive_executor_class
 
+    @property
+    def send_executor_path(self):
+        '''
+        Dotted path of the send executor, without importing it
+        '''
+        if isinstance(self.__send_executor_class, basestring):
+            return self.__send_executor_class
+        return utils.object_path(self.__send_executor_class)
+
+    @property
+    def receive_executor_path(self):
+        '''
+        Dotted path of the receive executor, without importing it
+        '''
+        if isinstance(self.__receive_executor_class, basestring):
+            return self.__receive_executor_class
+        return utils.object_path(self.__receive_executor_class)
+
     @property
     def supported_results(self):
         '''
@@ -353,6 +431,11 @@ class ProfileExecution(object):
         self.started_at = datetime.datetime.utcnow()
         self.ended_at = None
 
+        # Duration (seconds) of each execution phase on this peer
+        # and as reported by the remote peer.
+        self.timings = OrderedDict()
+        self.remote_timings = OrderedDict()
+
         # Generate execution id
         if execution_id is None:
             sha1 = hashlib.sha1()
@@ -367,6 +450,9 @@ class ProfileExecution(object):
             self.__executor = self.profile.send_executor_class(self)
         else:
             self.__executor = self.profile.receive_executor_class(self)
+        if profile_instantiated:
+            profile_instantiated.send(self, profile=self.profile,
+                                      direction=self.direction)
 
     @property
     def id(self):
@@ -424,6 +510,36 @@ class ProfileExecution(object):
         '''
         return self.executor.results
 
+    def record_phase(self, phase, duration):
+        '''
+        Record the duration of an execution phase and notify
+        subscribers of "execution_phase_finished" event
+        @param phase The name of the phase
+        @param duration The duration in seconds
+        '''
+        self.timings[phase] = duration
+        if phase_finished:
+            phase_finished.send(self, phase=phase, duration=duration)
+
+    @contextmanager
+    def phase(self, phase):
+        '''
+        Context manager that measures the enclosed block with
+        a monotonic clock and records it as an execution phase
+        '''
+        started = utils.monotonic()
+        try:
+            yield
+        finally:
+            self.record_phase(phase, utils.monotonic() - started)
+
+    def overhead(self):
+        '''
+        Get the time spent in all recorded phases except "run"
+        '''
+        return Time(sum([duration for phase, duration
+                         in self.timings.items() if phase != 'run']))
+
     def mark_finished(self):
         '''
         Fill end timestamp and save results values in the object
@@ -0,0 +1,168 @@
+'''
+Declarations of the profiles that are shipped with NSTS. Profiles are
+declared here with the dotted paths of their executors, so that listing
+profiles or starting a server does not import the modules of every tool.
+The module of an executor is imported the first time it is needed.
+
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+from nsts.profiles.base import Profile
+from nsts import units
+
+# Latency percentiles that apache profiles report
+LATENCY_PERCENTILES = [50, 90, 99]
+
+# Dummy profile
+p = Profile(
+    "dummy", "Dummy SpeedTest",
+    'nsts.profiles.dummy.DummyTestSender',
+    'nsts.profiles.dummy.DummyTestReceiver',
+    "A truly dummy test that returns some random numbers.")
+p.supported_options.add_option(
+    'min_transfer', 'The minimum random value of transfer',
+    units.BitRate, default=0)
+p.supported_options.add_option(
+    'max_transfer', 'The maximum random value of transfer',
+    units.BitRate, default=1)
+p.supported_options.add_option(
+    'min_time', 'The minimum random value of time',
+    units.Time, default=0)
+p.supported_options.add_option(
+    'max_time', 'The maximum random value of time',
+    units.Time, default=1)
+p.add_result('random_transfer', 'Random Transfer', units.BitRate)
+p.add_result('random_time', 'Random Time', units.Time)
+
+# Ping profile
+p = Profile(
+    "ping", "Ping",
+    'nsts.profiles.ping.PingExecutorSender',
+    'nsts.profiles.ping.PingExecutorReceiver',
+    description='A wrapper for "ping" system tool to" +\
+        " measure round trip latency')
+p.add_result("rtt", "RTT", units.Time)
+
+# TCP Profile
+p = Profile(
+    "iperf_tcp", "TCP (iperf)",
+    'nsts.profiles.iperf.IperfExecutorSender',
+    'nsts.profiles.iperf.IperfExecutorReceiver',
+    'Wrapper for "iperf" benchmark tool, to measure raw TCP throughput.')
+p.add_result("transfer_rate", "Transfer Rate", units.BitRate)
+p.supported_options.add_option(
+    'time', 'time to transmit for (maximum time if tolerance is set)',
+    units.Time, default=10)
+p.supported_options.add_option(
+    'tolerance', 'stop transmitting once the throughput of the last '
+    'reports is within this tolerance of their mean', units.Percentage)
+p.supported_options.add_option(
+    'min_time', 'minimum time to transmit if tolerance is set',
+    units.Time, default=2)
+p.supported_options.add_option(
+    'report_interval', 'interval of throughput reports if tolerance is set',
+    units.Time, default=1)
+
+# Jitter profile
+p = Profile(
+    "iperf_jitter", "Jitter (iperf)",
+    'nsts.profiles.iperf.IperfJitterExecutorSender',
+    'nsts.profiles.iperf.IperfExecutorReceiver',
+    description='Wrapper for "iperf" benchmark tool, to '
+    + 'measure latency jittering on UDP transmissions')
+p.add_result("transfer_rate", "Trans. Rate", units.BitRate)
+p.add_result("jitter", "Jitter", units.Time)
+p.add_result("lost_packets", "Lost Pck", units.Packet)
+p.add_result("total_packets", "Total Pck", units.Packet)
+p.add_result("percentage_lost", "Lost Pck %", units.Percentage)
+p.supported_options.add_option(
+    'time', 'time to transmit for',
+    units.Time, default=10)
+p.supported_options.add_option(
+    'rate', 'rate to send udp packages',
+    units.BitRate, default="1 Mbps")
+
+# Apache profile
+p = Profile(
+    "apache", "HTTP (apache)",
+    'nsts.profiles.apache.ApacheExecutorServer',
+    'nsts.profiles.apache.WgetExecutorClient',
+    "Measure the performance of HTTP, by setting up a "
+    "sandboxed apache server and download arbitrary binary files.")
+p.add_result("transfer_rate", "TransferRate", units.ByteRate)
+p.add_result("flow_rate", "Flow Rate", units.ByteRate)
+p.add_result("fairness", "Fairness", units.Percentage)
+for percent in LATENCY_PERCENTILES:
+    p.add_result("latency_p{0}".format(percent),
+                 "Latency p{0}".format(percent), units.Time)
+p.supported_options.add_option(
+    "concurrency", "Number of parallel downloads of the file",
+    unit_type=int, default=1)
+p.supported_options.add_option(
+    "port", "Apache listen port",
+    unit_type=int, default=58338)
+p.supported_options.add_option(
+    'mode', '"size" to download a specific filesize,'
+    ' "time" to download for a specified period',
+    unit_type=str, default='size')
+p.supported_options.add_option(
+    "filesize", "The size of file to download (size mode), "
+    "or the initial filesize to try.(time mode)",
+    unit_type=units.Byte, default="1 Mbyte")
+p.supported_options.add_option(
+    "maxfilesize", "The maximum filesize to download (time mode)",
+    unit_type=units.Byte, default="100 Mbyte")
+p.supported_options.add_option(
+    'downloadtime', 'Minimum time to download a continuous file (time mode)',
+    unit_type=units.Time, default='10 sec')
+
+# Apache requests profile
+p = Profile(
+    "apache_rps", "HTTP requests (apache)",
+    'nsts.profiles.apache.ApacheExecutorServer',
+    'nsts.profiles.apache.RequestRateExecutorClient',
+    "Measure the rate and latency of small HTTP requests over keep-alive "
+    "connections against a sandboxed apache server.")
+p.add_result("request_rate", "Request Rate", units.RequestRate)
+p.add_result("errors", "Errors", units.Requests)
+for percent in LATENCY_PERCENTILES:
+    p.add_result("latency_p{0}".format(percent),
+                 "Latency p{0}".format(percent), units.Time)
+p.supported_options.add_option(
+    "port", "Apache listen port",
+    unit_type=int, default=58338)
+p.supported_options.add_option(
+    "filesize", "The size of the requested object",
+    unit_type=units.Byte, default="1 KByte")
+p.supported_options.add_option(
+    "duration", "Time to generate requests for",
+    unit_type=units.Time, default="10 sec")
+p.supported_options.add_option(
+    "concurrency", "Number of concurrent keep-alive connections",
+    unit_type=int, default=8)
+p.supported_options.add_option(
+    "rate", "Target total request rate (default: as fast as possible)",
+    unit_type=units.RequestRate)
+
+# Built-in HTTP profile
+p = Profile(
+    "http", "HTTP (built-in)",
+    'nsts.profiles.http.HTTPExecutorServer',
+    'nsts.profiles.http.HTTPExecutorClient',
+    "Measure the performance of HTTP with a built-in server that "
+    "serves generated content from memory and a built-in client.")
+p.add_result("transfer_rate", "TransferRate", units.ByteRate)
+p.add_result("ttfb", "TTFB", units.Time)
+p.add_result("latency", "Latency", units.Time)
+p.supported_options.add_option(
+    "port", "HTTP server listen port",
+    unit_type=int, default=58339)
+p.supported_options.add_option(
+    "filesize", "The size of content to download per request",
+    unit_type=units.Byte, default="10 Mbyte")
+p.supported_options.add_option(
+    "requests", "Number of sequential requests per flow",
+    unit_type=int, default=1)
+p.supported_options.add_option(
+    "concurrency", "Number of concurrent flows",
+    unit_type=int, default=1)
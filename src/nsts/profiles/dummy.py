@@ -51,20 +51,5 @@ class DummyTestReceiver(ProfileExecutor):
     def cleanup(self):
         pass
 
-p = Profile(
-    "dummy", "Dummy SpeedTest", DummyTestSender, DummyTestReceiver,
-    "A truly dummy test that returns some random numbers.")
-p.supported_options.add_option(
-    'min_transfer', 'The minimum random value of transfer',
-    units.BitRate, default=0)
-p.supported_options.add_option(
-    'max_transfer', 'The maximum random value of transfer',
-    units.BitRate, default=1)
-p.supported_options.add_option(
-    'min_time', 'The minimum random value of time',
-    units.Time, default=0)
-p.supported_options.add_option(
-    'max_time', 'The maximum random value of time',
-    units.Time, default=1)
-p.add_result('random_transfer', 'Random Transfer', units.BitRate)
-p.add_result('random_time', 'Random Time', units.Time)
+# Declared in builtin, kept for users of the profile object
+p = Profile.get_all_profiles()['dummy']
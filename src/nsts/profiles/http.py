@@ -0,0 +1,552 @@
+'''
+HTTP profile with a built-in server and client. The server serves
+generated content from memory with keep-alive and range requests, so
+no disk I/O or external tools are involved. The client measures time
+to first byte, request latency and throughput of concurrent flows.
+
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+from __future__ import absolute_import
+import os
+import re
+import time
+import socket
+import logging
+import threading
+import httplib
+import BaseHTTPServer
+import SocketServer
+from nsts.profiles.base import ProfileExecutor, SpeedTestRuntimeError
+from nsts import units, utils
+
+# Module logger
+logger = logging.getLogger("http")
+
+# Size of the random block that content is made of
+CONTENT_BLOCK_SIZE = 1024 * 1024
+
+# Size of buffer when reading response bodies
+READ_BUFFER_SIZE = 256 * 1024
+
+# Seconds between checks for server shutdown
+POLL_INTERVAL = 0.05
+
+# Initial and maximum seconds that a load worker waits after a failed
+# connection, doubled on every consecutive failure
+LOAD_BACKOFF = 0.01
+LOAD_MAX_BACKOFF = 1.0
+
+# Consecutive failed connections after which a load worker gives up
+LOAD_MAX_FAILURES = 10
+
+# Number of requests that probe_latency() sends
+LATENCY_PROBES = 5
+
+# Pattern of content paths, e.g. /content/1048576
+CONTENT_PATH = re.compile(r'^/content/(\d+)$')
+
+# Pattern of a single byte range
+RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def content_path(size):
+    '''
+    Get the path of generated content of this size
+    '''
+    return '/content/{0}'.format(int(size))
+
+
+class ContentRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Serve generated content of any size at /content/<size>. Bodies
+    are written directly from memory views of a single random block.
+    '''
+
+    protocol_version = 'HTTP/1.1'
+
+    def parse_range(self, size):
+        '''
+        @return (start, end) of requested bytes, None for whole content
+            or False if range is not satisfiable
+        '''
+        header = self.headers.getheader('Range')
+        if header is None:
+            return None
+        match = RANGE_HEADER.match(header.strip())
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if first == '':
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start = int(first)
+            end = size - 1 if last == '' else min(int(last), size - 1)
+        if start > end or start >= size:
+            return False
+        return (start, end)
+
+    def send_content(self, with_body):
+        match = CONTENT_PATH.match(self.path.split('?')[0])
+        if not match:
+            self.send_error(404)
+            return
+        size = int(match.group(1))
+
+        byte_range = self.parse_range(size)
+        if byte_range is False:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */{0}'.format(size))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if byte_range is None:
+            start, end = 0, size - 1
+            self.send_response(200)
+        else:
+            start, end = byte_range
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(
+                start, end, size))
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+        if with_body:
+            self.write_body(start, end + 1)
+
+    def write_body(self, start, stop):
+        '''
+        Write bytes [start, stop) of content
+        '''
+        block = self.server.block
+        block_size = len(block)
+        position = start
+        while position < stop:
+            offset = position % block_size
+            length = min(block_size - offset, stop - position)
+            self.connection.sendall(block[offset:offset + length])
+            position += length
+
+    def do_GET(self):
+        self.send_content(True)
+
+    def do_HEAD(self):
+        self.send_content(False)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class ContentServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''
+    Threaded HTTP server of generated content. It serves in a
+    background daemon thread.
+    '''
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port, host='', ipv6=False):
+        if ipv6:
+            self.address_family = socket.AF_INET6
+        BaseHTTPServer.HTTPServer.__init__(
+            self, (host, port), ContentRequestHandler)
+        self.block = memoryview(os.urandom(CONTENT_BLOCK_SIZE))
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        '''
+        Start serving in a background thread
+        '''
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       args=(POLL_INTERVAL,),
+                                       name='http-content')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class RequestStatistics(object):
+    '''
+    Measurements of a single HTTP request
+    '''
+    __slots__ = ['ttfb', 'latency', 'size', 'status']
+
+    def __init__(self, ttfb, latency, size, status):
+        self.ttfb = ttfb
+        self.latency = latency
+        self.size = size
+        self.status = status
+
+
+class HTTPFetcher(object):
+    '''
+    Fetch paths from an HTTP server over a persistent connection
+    and measure every request.
+    '''
+
+    def __init__(self, host, port, timeout=60):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connection = None
+
+    def fetch(self, path, headers={}):
+        '''
+        Fetch a path and discard its body
+        @return RequestStatistics
+        '''
+        if self.connection is None:
+            self.connection = httplib.HTTPConnection(
+                self.host, self.port, timeout=self.timeout)
+        started = utils.monotonic()
+        try:
+            self.connection.request('GET', path, headers=headers)
+            response = self.connection.getresponse()
+            ttfb = utils.monotonic() - started
+            size = self.read_body(response)
+        except (httplib.HTTPException, socket.error):
+            self.close()
+            raise
+        if response.will_close:
+            self.close()
+        return RequestStatistics(ttfb, utils.monotonic() - started, size,
+                                 response.status)
+
+    def read_body(self, response):
+        '''
+        Read and discard a response body
+        @return The number of bytes read
+        '''
+        size = 0
+        while True:
+            data = response.read(READ_BUFFER_SIZE)
+            if not data:
+                break
+            size += len(data)
+        return size
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class FlowsResult(object):
+    '''
+    Requests of concurrent flows and the wall time they took
+    '''
+
+    def __init__(self, flows, duration, errors):
+        '''
+        @param flows A list with the RequestStatistics list of every flow
+        @param duration The wall time of all flows in seconds
+        @param errors The number of failed requests
+        '''
+        self.flows = flows
+        self.duration = duration
+        self.errors = errors
+
+    @property
+    def requests(self):
+        return [r for flow in self.flows for r in flow]
+
+    def total_size(self):
+        return sum([r.size for r in self.requests])
+
+    def throughput(self):
+        '''
+        Aggregated throughput in bytes/sec
+        '''
+        if not self.duration:
+            return 0.0
+        return self.total_size() / self.duration
+
+    def flow_throughputs(self):
+        '''
+        Throughput of every flow in bytes/sec
+        '''
+        return [sum([r.size for r in flow]) /
+                (sum([r.latency for r in flow]) or 1.0)
+                for flow in self.flows if flow]
+
+    def latency_histogram(self):
+        '''
+        Histogram of the latency of all requests
+        '''
+        histogram = utils.LogHistogram(units.Time)
+        for request in self.requests:
+            histogram.push(request.latency)
+        return histogram
+
+    def fairness(self):
+        '''
+        Jain's fairness index of per flow throughput (1 is fair)
+        '''
+        rates = self.flow_throughputs()
+        squares = sum([r ** 2 for r in rates])
+        if not squares:
+            return 1.0
+        return sum(rates) ** 2 / (len(rates) * squares)
+
+
+def fetch_concurrently(host, port, paths, concurrency=1):
+    '''
+    Fetch paths with concurrent flows. Each flow is a thread with a
+    persistent connection that fetches all paths in order. Requests
+    that fail or get an error status are counted as errors.
+    @param paths The list of paths that every flow fetches
+    @param concurrency The number of flows
+    @return A FlowsResult
+    '''
+    flows = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+
+    def flow(index):
+        fetcher = HTTPFetcher(host, port)
+        try:
+            for path in paths:
+                try:
+                    stats = fetcher.fetch(path)
+                except (httplib.HTTPException, socket.error), e:
+                    logger.warning("Request of {0} failed: {1}".format(
+                        path, e))
+                    errors[index] += 1
+                    continue
+                if stats.status >= 400:
+                    logger.warning("Request of {0} failed with status {1}"
+                                   .format(path, stats.status))
+                    errors[index] += 1
+                    continue
+                flows[index].append(stats)
+        finally:
+            fetcher.close()
+
+    threads = [threading.Thread(target=flow, args=(i,), name='http-flow')
+               for i in range(concurrency)]
+    started = utils.monotonic()
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return FlowsResult(flows, utils.monotonic() - started, sum(errors))
+
+
+def probe_latency(host, port, path, count=LATENCY_PROBES):
+    '''
+    Measure the latency of small requests, for the first byte of a path,
+    over a persistent connection
+    @param count The number of requests
+    @return A LogHistogram of latency of successful requests
+    '''
+    histogram = utils.LogHistogram(units.Time)
+    fetcher = HTTPFetcher(host, port)
+    try:
+        for _ in range(count):
+            try:
+                stats = fetcher.fetch(path, {'Range': 'bytes=0-0'})
+            except (httplib.HTTPException, socket.error), e:
+                logger.warning("Latency probe of {0} failed: {1}".format(
+                    path, e))
+                continue
+            if stats.status < 400:
+                histogram.push(stats.latency)
+    finally:
+        fetcher.close()
+    return histogram
+
+
+class LoadResult(object):
+    '''
+    Outcome of a load of small requests
+    '''
+
+    def __init__(self, requests, errors, duration, histogram):
+        '''
+        @param requests The number of successful requests
+        @param errors The number of failed requests
+        @param duration The wall time of the load in seconds
+        @param histogram LogHistogram of latency of successful requests
+        '''
+        self.requests = requests
+        self.errors = errors
+        self.duration = duration
+        self.histogram = histogram
+
+    def request_rate(self):
+        '''
+        Successful requests per second
+        '''
+        if not self.duration:
+            return 0.0
+        return self.requests / self.duration
+
+
+def generate_load(host, port, path, duration, concurrency=1, rate=None):
+    '''
+    Request a path repeatedly with concurrent keep-alive connections.
+    Without a rate, every connection sends its next request as soon as
+    the previous one is finished. With a target rate, requests are
+    scheduled at fixed intervals and latency is measured from the
+    scheduled time, so a stalled server is not hidden by the requests
+    it delayed (coordinated omission). Failed connections are retried
+    with exponential backoff, and a connection is abandoned after
+    LOAD_MAX_FAILURES consecutive failures.
+    @param duration Seconds to generate load
+    @param concurrency The number of connections
+    @param rate The target total requests per second or None
+    @return A LoadResult
+    '''
+    histograms = [utils.LogHistogram(units.Time) for _ in range(concurrency)]
+    requests = [0] * concurrency
+    errors = [0] * concurrency
+    interval = float(concurrency) / rate if rate else None
+    started = utils.monotonic()
+    deadline = started + duration
+
+    def worker(index):
+        fetcher = HTTPFetcher(host, port)
+        scheduled = None
+        failures = 0
+        if interval is not None:
+            scheduled = started + index * interval / concurrency
+        try:
+            while True:
+                now = utils.monotonic()
+                if scheduled is not None:
+                    if scheduled >= deadline:
+                        break
+                    if scheduled > now:
+                        time.sleep(scheduled - now)
+                    began = scheduled
+                    scheduled += interval
+                elif now >= deadline:
+                    break
+                else:
+                    began = now
+                try:
+                    stats = fetcher.fetch(path)
+                except (httplib.HTTPException, socket.error), e:
+                    errors[index] += 1
+                    failures += 1
+                    if failures >= LOAD_MAX_FAILURES:
+                        logger.warning(
+                            "Load connection {0} stopped after {1} failed "
+                            "requests: {2}".format(index, failures, e))
+                        break
+                    if scheduled is None:
+                        time.sleep(min(
+                            LOAD_BACKOFF * 2 ** (failures - 1),
+                            LOAD_MAX_BACKOFF,
+                            max(deadline - utils.monotonic(), 0)))
+                    continue
+                failures = 0
+                if stats.status >= 400:
+                    errors[index] += 1
+                    continue
+                histograms[index].push(utils.monotonic() - began)
+                requests[index] += 1
+        finally:
+            fetcher.close()
+
+    threads = [threading.Thread(target=worker, args=(i,), name='http-load')
+               for i in range(concurrency)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    histogram = histograms[0]
+    for other in histograms[1:]:
+        histogram.merge(other)
+    return LoadResult(sum(requests), sum(errors),
+                      utils.monotonic() - started, histogram)
+
+
+class HTTPExecutorServer(ProfileExecutor):
+
+    def __init__(self, context):
+        super(HTTPExecutorServer, self).__init__(context)
+        self.server = None
+
+    def is_supported(self):
+        return True
+
+    def prepare(self):
+        pass
+
+    def run(self):
+        self.wait_msg_type("STARTSERVER")
+        self.server = ContentServer(self.context.options['port'],
+                                    ipv6=self.context.connection.is_ipv6())
+        self.server.start()
+        self.send_msg("OK")
+
+        self.wait_msg_type("STOPSERVER")
+        self.server.stop()
+        self.server = None
+        self.send_msg("OK")
+
+        self.collect_results()
+
+    def cleanup(self):
+        if self.server is not None:
+            self.server.stop()
+            self.server = None
+
+
+class HTTPExecutorClient(ProfileExecutor):
+
+    def is_supported(self):
+        return True
+
+    def prepare(self):
+        pass
+
+    def fetch(self):
+        '''
+        Fetch content with concurrent flows
+        @return A FlowsResult
+        '''
+        options = self.context.options
+        path = content_path(options['filesize'].raw_value)
+        return fetch_concurrently(
+            self.context.connection.remote_addr, options['port'],
+            [path] * options['requests'], options['concurrency'])
+
+    def store_flows_result(self, result):
+        requests = result.requests
+        if not requests:
+            raise SpeedTestRuntimeError("All HTTP requests failed.")
+        self.store_result('transfer_rate', result.throughput())
+        self.store_result('ttfb', sum([r.ttfb for r in requests])
+                          / len(requests))
+        self.store_result('latency', sum([r.latency for r in requests])
+                          / len(requests))
+
+    def run(self):
+        self.send_msg("STARTSERVER")
+        self.wait_msg_type("OK")
+
+        try:
+            result = self.fetch()
+        finally:
+            self.send_msg("STOPSERVER")
+            self.wait_msg_type("OK")
+
+        self.store_flows_result(result)
+        self.propagate_results()
+
+    def cleanup(self):
+        pass
@@ -4,38 +4,158 @@ Created on Nov 4, 2013
 @license: GPLv3
 @author: NSTS Contributors (see AUTHORS.txt)
 '''
-import time
-from nsts.profiles.base import Profile
+import os
+import signal
+from nsts.profiles.base import SpeedTestRuntimeError
 from nsts import units
-from subprocess import SubProcessExecutorBase
+from subprocess import SubProcessExecutorBase, spawn, wait_until, \
+    is_listening
+from pool import WarmResource, pool
+
+# Port of iperf server when it is not defined in arguments
+DEFAULT_PORT = 5001
+
+
+def parse_interval_report(line):
+    '''
+    Parse a CSV report line of iperf
+    @return A tuple with (start, end, bits/sec) or None if the line
+        is not a report
+    '''
+    fields = line.strip().split(',')
+    if len(fields) < 9 or '-' not in fields[6]:
+        return None
+    try:
+        start, end = [float(t) for t in fields[6].split('-')]
+        return (start, end, float(fields[8]))
+    except ValueError:
+        return None
+
+
+class ThroughputConvergence(object):
+    '''
+    Detect convergence of throughput from the periodic reports of iperf.
+    Throughput has converged when the rates of the last "window" reports
+    are all within a tolerance of their mean, and the minimum duration
+    has passed.
+    '''
+
+    def __init__(self, tolerance, min_time, window=3):
+        '''
+        @param tolerance The accepted deviation as a fraction of the mean
+        @param min_time Seconds to transmit before checking convergence
+        @param window Number of recent reports to compare
+        '''
+        self.tolerance = tolerance
+        self.min_time = min_time
+        self.window = window
+        self.rates = []
+
+    def push(self, ended_at, rate):
+        '''
+        Account a report of an interval
+        @param ended_at The seconds since start at the end of the interval
+        @param rate The bits/sec of the interval
+        @return True if throughput has converged
+        '''
+        self.rates.append(rate)
+        del self.rates[:-self.window]
+        if ended_at < self.min_time or len(self.rates) < self.window:
+            return False
+        mean = sum(self.rates) / len(self.rates)
+        if not mean:
+            return False
+        return max([abs(r - mean) for r in self.rates]) <= \
+            self.tolerance * mean
+
+
+class IperfServer(WarmResource):
+    '''
+    A running iperf server that is reused across executions
+    '''
+
+    def __init__(self, executable, arguments):
+        self.executable = executable
+        self.arguments = list(arguments)
+        self.handle = None
+        self.__devnull = None
+        self.port = DEFAULT_PORT
+        if '-p' in self.arguments[:-1]:
+            self.port = int(
+                self.arguments[self.arguments.index('-p') + 1])
+        self.protocol = 'udp' if '-u' in self.arguments else 'tcp'
+
+    def start(self):
+        # Reports of the server are not used, discard them so that
+        # a long-lived server never blocks on a full pipe.
+        self.__devnull = open(os.devnull, 'w')
+        self.handle = spawn([self.executable] + self.arguments, self,
+                            stdout=self.__devnull)
+        try:
+            wait_until(
+                lambda: is_listening(self.port, self.protocol),
+                alive=self.is_healthy, description="iperf to listen")
+        except SpeedTestRuntimeError:
+            self.stop()
+            raise
+
+    def stop(self):
+        if self.is_healthy():
+            self.handle.kill()
+            self.handle.wait()
+        self.handle = None
+        if self.__devnull is not None:
+            self.__devnull.close()
+            self.__devnull = None
+
+    def is_healthy(self):
+        return self.handle is not None and self.handle.poll() is None
 
 
 class IperfExecutorReceiver(SubProcessExecutorBase):
 
+    binary_name = 'iperf'
+
     def __init__(self, owner):
-        super(IperfExecutorReceiver, self).__init__(owner, 'iperf')
+        super(IperfExecutorReceiver, self).__init__(owner)
+        self.server = None
+        self.server_key = None
 
     def prepare(self):
         return True
 
     def run(self):
         msg = self.wait_msg_type("STARTSERVER")
-        self.execute_subprocess(*msg.params['server_arguments'])
-        time.sleep(0.2)
+        arguments = msg.params['server_arguments']
+        self.server_key = (self.context.profile.id,
+                           self.subprocess_executable) + \
+            tuple(arguments)
+        self.server = pool.acquire(
+            self.server_key,
+            lambda: IperfServer(self.subprocess_executable, arguments))
         self.send_msg("OK")
 
         self.wait_msg_type("STOPSERVER")
-        self.kill_subprocess()
+        pool.release(self.server_key, self.server)
+        self.server = None
         self.send_msg("OK")
 
         # Collect __results
         self.collect_results()
 
+    def cleanup(self):
+        super(IperfExecutorReceiver, self).cleanup()
+        if self.server is not None:
+            pool.discard(self.server_key, self.server)
+            self.server = None
+
 
 class IperfExecutorSender(SubProcessExecutorBase):
 
+    binary_name = 'iperf'
+
     def __init__(self, context):
-        super(IperfExecutorSender, self).__init__(context, 'iperf')
+        super(IperfExecutorSender, self).__init__(context)
         self.server_arguments = ["-s"]
         self.client_arguments = ["-y", "C"]
         if context.connection.is_ipv6():
@@ -45,29 +165,69 @@ class IperfExecutorSender(SubProcessExecutorBase):
     def prepare(self):
         return True
 
+    def is_adaptive(self):
+        '''
+        Check if transmission stops as soon as throughput converges
+        '''
+        return 'tolerance' in self.context.options.supported and \
+            self.context.options['tolerance'] is not None
+
     def parse_and_store_output(self):
-        output = self.get_subprocess_output()
-        self.store_result('transfer_rate',
-                          units.BitRate(float(output.split(',')[8])))
+        # The summary is the report that spans the longest interval
+        reports = [parse_interval_report(line) for line in self.output]
+        reports = [r for r in reports if r is not None]
+        if not reports:
+            raise SpeedTestRuntimeError("Cannot parse iperf output.")
+        summary = max(reversed(reports), key=lambda r: r[1] - r[0])
+        self.store_result('transfer_rate', units.BitRate(summary[2]))
+
+    def wait_convergence(self):
+        '''
+        Watch periodic reports as they are streamed and interrupt
+        iperf once throughput has converged.
+        '''
+        options = self.context.options
+        convergence = ThroughputConvergence(
+            options['tolerance'].raw_value / 100.0,
+            options['min_time'].raw_value)
+        while True:
+            line = self.read_subprocess_line()
+            if not line:
+                break
+            self.output.append(line)
+            report = parse_interval_report(line)
+            if report is None:
+                continue
+            if convergence.push(report[1], report[2]):
+                self.logger.debug("Throughput converged after {0} sec."
+                                  .format(report[1]))
+                self.signal_subprocess(signal.SIGINT)
+                break
 
     def run(self):
         self.send_msg("STARTSERVER",
                       {"server_arguments": self.server_arguments})
         self.wait_msg_type('OK')
 
-        self.execute_subprocess(
-            "-c", self.context.connection.remote_addr,
-            "-t", str(self.context.options['time'].raw_value),
-            *self.client_arguments)
+        arguments = ["-c", self.context.connection.remote_addr,
+                     "-t", str(self.context.options['time'].raw_value)]
+        if self.is_adaptive():
+            arguments.extend([
+                "-i", str(self.context.options['report_interval'].raw_value)])
+        arguments.extend(self.client_arguments)
+        self.output = []
+        self.execute_subprocess(*arguments)
 
-        while self.is_subprocess_running():
-            time.sleep(0.2)
+        if self.is_adaptive():
+            self.wait_convergence()
 
+        self.wait_subprocess()
         self.logger.debug("iperf stopped running.")
         self.send_msg("STOPSERVER")
         self.wait_msg_type("OK")
 
         # Parse output
+        self.output.extend(self.get_subprocess_output().splitlines())
         self.parse_and_store_output()
         self.propagate_results()
 
@@ -83,38 +243,9 @@ class IperfJitterExecutorSender(IperfExecutorSender):
             "-b", str(self.context.options['rate'].raw_value)])
 
     def parse_and_store_output(self):
-        output = self.get_subprocess_output().split("\n")
-
-        received = output[1].split(',')
+        received = self.output[1].split(',')
         self.store_result('transfer_rate', units.BitRate(received[8]))
         self.store_result('jitter', units.Time(received[9] + "ms"))
         self.store_result('lost_packets', units.Packet(received[10]))
         self.store_result('total_packets', units.Packet(received[11]))
         self.store_result('percentage_lost', units.Percentage(received[12]))
-
-# TCP Profile
-p = Profile(
-    "iperf_tcp", "TCP (iperf)",
-    IperfExecutorSender, IperfExecutorReceiver,
-    'Wrapper for "iperf" benchmark tool, to measure raw TCP throughput.')
-p.add_result("transfer_rate", "Transfer Rate", units.BitRate)
-p.supported_options.add_option(
-    'time', 'time to transmit for', units.Time, default=10)
-
-# Jitter profile
-p = Profile(
-    "iperf_jitter", "Jitter (iperf)",
-    IperfJitterExecutorSender, IperfExecutorReceiver,
-    description='Wrapper for "iperf" benchmark tool, to '
-    + 'measure latency jittering on UDP transmissions')
-p.add_result("transfer_rate", "Trans. Rate", units.BitRate)
-p.add_result("jitter", "Jitter", units.Time)
-p.add_result("lost_packets", "Lost Pck", units.Packet)
-p.add_result("total_packets", "Total Pck", units.Packet)
-p.add_result("percentage_lost", "Lost Pck %", units.Percentage)
-p.supported_options.add_option(
-    'time', 'time to transmit for',
-    units.Time, default=10)
-p.supported_options.add_option(
-    'rate', 'rate to send udp packages',
-    units.BitRate, default="1 Mbps")
@@ -4,19 +4,21 @@ Created on Nov 6, 2013
 @license: GPLv3
 @author: NSTS Contributors (see AUTHORS.txt)
 '''
-import time
-from nsts.profiles.base import SpeedTestRuntimeError, ProfileExecutor, Profile
+from nsts.profiles.base import SpeedTestRuntimeError, ProfileExecutor
 from nsts import units
 from subprocess import SubProcessExecutorBase
 
 
 class PingExecutorSender(SubProcessExecutorBase):
 
+    binary_name = 'ping'
+
+    @classmethod
+    def binary_for(cls, ipv6=False):
+        return 'ping6' if ipv6 else 'ping'
+
     def __init__(self, context):
-        executable = 'ping'
-        if context.connection.is_ipv6():
-            executable = 'ping6'
-        super(PingExecutorSender, self).__init__(context, executable)
+        super(PingExecutorSender, self).__init__(context)
 
     def prepare(self):
         pass
@@ -41,8 +43,7 @@ class PingExecutorSender(SubProcessExecutorBase):
     def run(self):
         self.execute_subprocess("-c", "1", self.context.connection.remote_addr)
 
-        while self.is_subprocess_running():
-            time.sleep(0.2)
+        self.wait_subprocess()
 
         self.logger.debug("ping stopped running.")
 
@@ -67,9 +68,3 @@ class PingExecutorReceiver(ProfileExecutor):
 
     def cleanup(self):
         return True
-
-p = Profile(
-    "ping", "Ping", PingExecutorSender, PingExecutorReceiver,
-    description='A wrapper for "ping" system tool to" +\
-        " measure round trip latency')
-p.add_result("rtt", "RTT", units.Time)
@@ -0,0 +1,233 @@
+'''
+Discovery of profiles that other packages provide. A package declares
+its profiles in a module and exposes it as an entry point of the
+"nsts.profiles" group, e.g. in its setup.py:
+
+    entry_points={
+        'nsts.profiles': ['iperf3 = nsts_iperf3.profiles']}
+
+Importing every plugin on startup is slow, so the metadata of their
+profiles (ids, options and results) is cached in an index file. The
+index is used as long as the metadata of installed packages does not
+change, and plugin modules are imported only when a profile is executed.
+
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+import os
+import sys
+import json
+import types
+import hashlib
+import logging
+from nsts.profiles.base import Profile
+from nsts import utils
+
+# Module logger
+logger = logging.getLogger("plugins")
+
+# Entry point group of modules that declare profiles
+ENTRY_POINT_GROUP = 'nsts.profiles'
+
+# Default file of the cached index of plugin profiles
+DEFAULT_INDEX = os.path.join(
+    os.path.expanduser('~'), '.nsts', 'profiles.json')
+
+# Version of the format of the index file
+INDEX_VERSION = 1
+
+# The index file that discover() uses, None to always import plugins
+index_filename = DEFAULT_INDEX
+
+
+def fingerprint(paths=None):
+    '''
+    Fingerprint the entry points of installed packages, by the metadata
+    files on the path. It changes whenever a package with entry points is
+    installed, upgraded or removed, and is much faster than pkg_resources.
+    @param paths The directories to look for packages (default sys.path)
+    '''
+    digest = hashlib.sha1()
+    for directory in (sys.path if paths is None else paths):
+        try:
+            names = sorted(os.listdir(directory or os.curdir))
+        except OSError:
+            continue
+        for name in names:
+            if name.endswith(('.egg-info', '.dist-info')):
+                filename = os.path.join(directory, name, 'entry_points.txt')
+            elif name.endswith('.egg'):
+                filename = os.path.join(
+                    directory, name, 'EGG-INFO', 'entry_points.txt')
+            else:
+                continue
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            digest.update("{0}:{1}:{2}\n".format(
+                filename, stat.st_mtime, stat.st_size))
+    return digest.hexdigest()
+
+
+def describe(profile):
+    '''
+    Describe a profile with JSON serializable metadata. Executors are
+    described by their dotted path and are not imported.
+    '''
+    options = []
+    for option in profile.supported_options.supported.values():
+        options.append({
+            'id': option.id,
+            'help': option.help,
+            'type': utils.object_path(option.type),
+            'default': getattr(option.default, 'raw_value', option.default)})
+    results = []
+    for result in profile.supported_results.values():
+        results.append({
+            'id': result.id,
+            'name': result.name,
+            'unit_type': utils.object_path(result.unit_type)})
+    return {
+        'id': profile.id,
+        'name': profile.name,
+        'description': profile.description,
+        'send_executor': profile.send_executor_path,
+        'receive_executor': profile.receive_executor_path,
+        'options': options,
+        'results': results}
+
+
+def declare(entry):
+    '''
+    Declare a profile from the metadata of describe()
+    @return The new Profile
+    '''
+    profile = Profile(
+        entry['id'], entry['name'], entry['send_executor'],
+        entry['receive_executor'], entry['description'])
+    for option in entry['options']:
+        profile.supported_options.add_option(
+            option['id'], option['help'], utils.import_object(option['type']),
+            option['default'])
+    for result in entry['results']:
+        profile.add_result(result['id'], result['name'],
+                           utils.import_object(result['unit_type']))
+    return profile
+
+
+def read_index(filename, current):
+    '''
+    Read the cached metadata of plugin profiles
+    @param current The current fingerprint of installed packages
+    @return A list of profile metadata or None if the index is stale
+    '''
+    try:
+        with open(filename) as f:
+            index = json.load(f)
+    except IOError:
+        return None
+    except ValueError:
+        logger.warning("Ignoring corrupted profile index '{0}'".format(
+            filename))
+        return None
+    if index.get('version') != INDEX_VERSION or \
+            index.get('fingerprint') != current:
+        logger.debug("Profile index '{0}' is stale.".format(filename))
+        return None
+    return index['profiles']
+
+
+def write_index(filename, current, entries):
+    '''
+    Cache the metadata of plugin profiles
+    '''
+    directory = os.path.dirname(filename)
+    try:
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(filename, 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'fingerprint': current,
+                       'profiles': entries}, f, indent=2, sort_keys=True)
+    except (IOError, OSError, TypeError, ValueError), e:
+        logger.warning("Cannot write profile index '{0}': {1}".format(
+            filename, e))
+
+
+def iter_entry_points():
+    '''
+    Get the entry points of all installed plugins
+    '''
+    try:
+        import pkg_resources
+    except ImportError:
+        logger.debug("pkg_resources is not installed, plugins are ignored.")
+        return []
+    return list(pkg_resources.iter_entry_points(ENTRY_POINT_GROUP))
+
+
+def load_entry_point(entry_point, registry):
+    '''
+    Import a plugin. Its target is a module that declares profiles when
+    imported, or a function that declares them when called.
+    @param registry The dictionary of registered profiles
+    @return The list of profiles that the plugin declared or None if the
+        plugin cannot be loaded
+    '''
+    before = dict(registry)
+    try:
+        target = entry_point.load()
+        if not isinstance(target, types.ModuleType):
+            target()
+    except Exception, e:
+        logger.warning("Cannot load profile plugin '{0}': {1}".format(
+            entry_point, e))
+        return None
+
+    declared = []
+    for profile_id, profile in registry.items():
+        if before.get(profile_id) is profile:
+            continue
+        if profile_id in before:
+            logger.warning("Plugin '{0}' declares profile '{1}' again, "
+                           "ignoring it.".format(entry_point, profile_id))
+            registry[profile_id] = before[profile_id]
+            continue
+        declared.append(profile)
+    return declared
+
+
+def discover(registry):
+    '''
+    Declare the profiles of plugins, from the index if it is up to date or
+    else by importing all plugins and writing a new index. The index is
+    not written if a plugin cannot be loaded, so that it is retried.
+    @param registry The dictionary of registered profiles
+    @return The list of declared plugin profiles
+    '''
+    current = fingerprint()
+    if index_filename is not None:
+        entries = read_index(index_filename, current)
+        if entries is not None:
+            try:
+                return [declare(entry) for entry in entries
+                        if entry['id'] not in registry]
+            except Exception, e:
+                logger.warning("Cannot use profile index '{0}': {1}".format(
+                    index_filename, e))
+
+    profiles = []
+    failed = False
+    for entry_point in iter_entry_points():
+        declared = load_entry_point(entry_point, registry)
+        if declared is None:
+            failed = True
+        else:
+            profiles.extend(declared)
+    logger.debug("Discovered {0} plugin profiles.".format(len(profiles)))
+    if failed:
+        logger.debug("Profile index is not written, some plugins failed.")
+    elif index_filename is not None:
+        write_index(index_filename, current,
+                    [describe(profile) for profile in profiles])
+    return profiles
@@ -0,0 +1,211 @@
+'''
+Pool of warm resources that executors reuse across executions. Servers
+of external tools (e.g. iperf or apache) are expensive to spawn, so
+instead of tearing them down at the end of every sample they are
+released in the pool, where the next execution with the same key
+will find them running. Resources that stay idle for longer than the
+idle timeout are stopped, and unhealthy resources are never reused.
+
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+import time
+import atexit
+import logging
+import threading
+from nsts import utils, metrics
+
+# Module logger
+logger = logging.getLogger("pool")
+
+# Default seconds that a released resource is kept warm
+DEFAULT_IDLE_TIMEOUT = 60
+
+# Maximum seconds between checks for expired resources
+REAP_INTERVAL = 5
+
+# Module metrics
+pool_hits = metrics.registry.counter(
+    'nsts_pool_hits_total', 'Warm resources reused from the pool',
+    ['profile'])
+pool_misses = metrics.registry.counter(
+    'nsts_pool_misses_total', 'Resources started because none was warm',
+    ['profile'])
+pool_evictions = metrics.registry.counter(
+    'nsts_pool_evictions_total', 'Resources stopped by the pool',
+    ['profile', 'reason'])
+pool_idle = metrics.registry.gauge(
+    'nsts_pool_idle_resources', 'Resources kept warm in the pool')
+
+
+class WarmResource(object):
+    '''
+    Base class of resources that can be kept warm in a ResourcePool
+    '''
+
+    # The port that the resource listens to, if any. An idle resource
+    # is stopped when a new resource needs the same port.
+    port = None
+
+    def start(self):
+        raise NotImplementedError()
+
+    def stop(self):
+        raise NotImplementedError()
+
+    def is_healthy(self):
+        '''
+        Check if the resource can serve another execution
+        '''
+        return True
+
+
+class ResourcePool(object):
+    '''
+    Idle resources keyed by a tuple that starts with the profile id and
+    contains everything that affects the resource (e.g. arguments).
+    At most one idle resource is kept per key.
+    '''
+
+    def __init__(self, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        '''
+        @param idle_timeout Seconds that a released resource is kept warm.
+            If it is 0, resources are stopped as soon as they are released.
+        '''
+        self.idle_timeout = idle_timeout
+        self.__idle = {}
+        self.__lock = threading.Lock()
+        self.__reaper = None
+
+    def __len__(self):
+        return len(self.__idle)
+
+    def __contains__(self, key):
+        return key in self.__idle
+
+    @property
+    def enabled(self):
+        return self.idle_timeout > 0
+
+    def __stop(self, key, resource, reason):
+        logger.debug("Stopping resource {0} ({1}).".format(key, reason))
+        pool_evictions.inc(profile=key[0], reason=reason)
+        try:
+            resource.stop()
+        except Exception, e:
+            logger.warning("Failed to stop resource {0}: {1}".format(key, e))
+
+    def __take(self, key):
+        with self.__lock:
+            entry = self.__idle.pop(key, None)
+            pool_idle.set(len(self.__idle))
+        return None if entry is None else entry[0]
+
+    def acquire(self, key, factory):
+        '''
+        Get a warm resource or start a new one
+        @param key The key of the resource
+        @param factory A callable that creates a new (not started) resource
+        @return A running resource that must be given back with release()
+        '''
+        resource = self.__take(key)
+        if resource is not None:
+            if resource.is_healthy():
+                logger.debug("Reusing warm resource {0}.".format(key))
+                pool_hits.inc(profile=key[0])
+                return resource
+            self.__stop(key, resource, 'unhealthy')
+
+        pool_misses.inc(profile=key[0])
+        resource = factory()
+        if resource.port is not None:
+            self.evict_port(resource.port)
+        resource.start()
+        return resource
+
+    def release(self, key, resource):
+        '''
+        Give back a resource after an execution has finished with it
+        '''
+        if not self.enabled:
+            self.__stop(key, resource, 'disabled')
+            return
+        if not resource.is_healthy():
+            self.__stop(key, resource, 'unhealthy')
+            return
+
+        previous = self.__take(key)
+        if previous is not None:
+            self.__stop(key, previous, 'replaced')
+        with self.__lock:
+            self.__idle[key] = (resource, utils.monotonic())
+            pool_idle.set(len(self.__idle))
+        self.__start_reaper()
+
+    def discard(self, key, resource):
+        '''
+        Stop a resource whose state is unknown (e.g. after a failure)
+        '''
+        self.__stop(key, resource, 'discarded')
+
+    def evict_port(self, port):
+        '''
+        Stop idle resources that listen to a port
+        '''
+        with self.__lock:
+            keys = [k for k, (r, _) in self.__idle.items() if r.port == port]
+        for key in keys:
+            resource = self.__take(key)
+            if resource is not None:
+                self.__stop(key, resource, 'port')
+
+    def evict_idle(self, now=None):
+        '''
+        Stop resources that are idle for longer than the idle timeout
+        @return The number of stopped resources
+        '''
+        if now is None:
+            now = utils.monotonic()
+        with self.__lock:
+            keys = [k for k, (_, released_at) in self.__idle.items()
+                    if now - released_at >= self.idle_timeout]
+        evicted = 0
+        for key in keys:
+            resource = self.__take(key)
+            if resource is not None:
+                self.__stop(key, resource, 'idle')
+                evicted += 1
+        return evicted
+
+    def close(self):
+        '''
+        Stop all idle resources
+        '''
+        with self.__lock:
+            keys = self.__idle.keys()
+        for key in keys:
+            resource = self.__take(key)
+            if resource is not None:
+                self.__stop(key, resource, 'closed')
+
+    def __start_reaper(self):
+        with self.__lock:
+            if self.__reaper is not None:
+                return
+            self.__reaper = threading.Thread(target=self.__reap,
+                                             name='pool-reaper')
+            self.__reaper.daemon = True
+            self.__reaper.start()
+
+    def __reap(self):
+        while True:
+            time.sleep(min(max(self.idle_timeout, 0.1), REAP_INTERVAL))
+            self.evict_idle()
+            with self.__lock:
+                if not self.__idle:
+                    self.__reaper = None
+                    return
+
+# The pool of this process
+pool = ResourcePool()
+atexit.register(pool.close)
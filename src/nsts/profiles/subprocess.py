@@ -6,9 +6,167 @@ and control child processes.
 @author: NSTS Contributors (see AUTHORS.txt)
 '''
 from __future__ import absolute_import
-from .base import ProfileExecutor
-from nsts import utils
+import os
+import time
+import socket
+from .base import ProfileExecutor, SpeedTestRuntimeError, \
+    ExecutionDirection
+from nsts import utils, metrics
+from nsts.events import dispatcher
 import subprocess as proc
+from subprocess import PIPE
+
+# Module metrics
+spawn_latency = metrics.registry.histogram(
+    'nsts_subprocess_spawn_seconds', 'Time to spawn a subprocess',
+    ['binary'])
+spawn_failures = metrics.registry.counter(
+    'nsts_subprocess_spawn_failures_total', 'Failures to spawn a subprocess',
+    ['binary'])
+
+# Initial and maximum seconds between readiness probes
+PROBE_INTERVAL = 0.002
+PROBE_MAX_INTERVAL = 0.1
+
+# Default seconds to wait for a server to become ready
+READY_TIMEOUT = 10
+
+# Socket tables of the kernel
+PROC_NET = '/proc/net'
+
+# State of listening TCP sockets in socket tables
+TCP_LISTEN = '0A'
+
+# Module events
+subprocess_started = dispatcher.register(
+    'subprocess_started', ['binary', 'args', 'pid'])
+subprocess_exited = dispatcher.register(
+    'subprocess_exited', ['binary', 'returncode'])
+
+
+def wait_until(condition, timeout=READY_TIMEOUT, alive=None,
+               description='condition'):
+    '''
+    Poll a condition with exponential backoff until it is true
+    @param condition A callable that returns True when satisfied
+    @param timeout Maximum seconds to wait or None to wait forever
+    @param alive An optional callable that returns False if waiting
+        is pointless (e.g. the server process has exited)
+    @param description Description of the condition for error messages
+    @return Seconds waited
+    '''
+    started = utils.monotonic()
+    interval = PROBE_INTERVAL
+    while not condition():
+        if alive is not None and not alive():
+            raise SpeedTestRuntimeError(
+                "Process exited while waiting for {0}.".format(description))
+        waited = utils.monotonic() - started
+        if timeout is not None and waited >= timeout:
+            raise SpeedTestRuntimeError(
+                "Timeout after {0} sec waiting for {1}.".format(
+                    timeout, description))
+        time.sleep(interval)
+        interval = min(interval * 2, PROBE_MAX_INTERVAL)
+    return utils.monotonic() - started
+
+
+def is_listening(port, protocol='tcp'):
+    '''
+    Check if a local socket listens to a port, by looking it up in the
+    socket tables of the kernel. If they are not available, TCP ports
+    are probed with a connection and UDP ports are assumed to listen.
+    @param port The port number
+    @param protocol 'tcp' or 'udp'
+    '''
+    found_table = False
+    for table in [protocol, protocol + '6']:
+        try:
+            f = open(os.path.join(PROC_NET, table))
+        except IOError:
+            continue
+        found_table = True
+        with f:
+            f.readline()
+            for line in f:
+                fields = line.split()
+                if int(fields[1].rsplit(':', 1)[1], 16) != port:
+                    continue
+                if protocol != 'tcp' or fields[3] == TCP_LISTEN:
+                    return True
+    if found_table:
+        return False
+    if protocol != 'tcp':
+        return True
+
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        probe.settimeout(PROBE_MAX_INTERVAL)
+        return probe.connect_ex(('127.0.0.1', port)) == 0
+    finally:
+        probe.close()
+
+
+def spawn(proc_args, sender=None, stdout=None):
+    '''
+    Spawn a child process and record its spawn latency
+    @param proc_args The executable followed by its arguments
+    @param sender The sender of "subprocess_started" event
+    @param stdout Where output (and error) is redirected, as in Popen
+    @return The Popen handle
+    '''
+    binary = os.path.basename(str(proc_args[0]))
+    spawn_started = utils.monotonic()
+    try:
+        handle = proc.Popen(proc_args, stdout=stdout,
+                            stderr=proc.STDOUT, close_fds=True)
+    except OSError:
+        spawn_failures.inc(binary=binary)
+        raise
+    spawn_latency.observe(utils.monotonic() - spawn_started, binary=binary)
+    if subprocess_started:
+        subprocess_started.send(sender, binary=binary, args=proc_args,
+                                pid=handle.pid)
+    return handle
+
+
+def find_tools(profile, direction, ipv6=False):
+    '''
+    Find the application that the executor of a profile spawns, without
+    creating an execution
+    @param ipv6 True to find the application of executions over IPv6
+    @return A list of (binary name, executable or None) tuples
+    '''
+    if direction.is_send():
+        executor_class = profile.send_executor_class
+    else:
+        executor_class = profile.receive_executor_class
+    if not issubclass(executor_class, SubProcessExecutorBase):
+        return []
+    binary = executor_class.binary_for(ipv6)
+    return [(binary, utils.which(binary))]
+
+
+def capabilities(profiles):
+    '''
+    Report the applications that profiles spawn and their versions
+    @param profiles The Profile objects to report
+    @return A list of dictionaries with the "profile", "direction",
+        "binary", "executable" (None if missing) and "version" of each
+    '''
+    report = []
+    for profile in profiles:
+        for direction in [ExecutionDirection('send'),
+                          ExecutionDirection('receive')]:
+            for binary, executable in find_tools(profile, direction):
+                report.append({
+                    'profile': profile.id,
+                    'direction': str(direction),
+                    'binary': binary,
+                    'executable': executable,
+                    'version': None if executable is None
+                    else utils.tool_version(executable)})
+    return report
 
 
 class SubProcessExecutorBase(ProfileExecutor):
@@ -17,16 +175,28 @@ class SubProcessExecutorBase(ProfileExecutor):
     in order to perform a benchmark.
     '''
 
-    def __init__(self, context, binary_name):
+    # The filename of the application binary to be spawned
+    binary_name = None
+
+    @classmethod
+    def binary_for(cls, ipv6=False):
+        '''
+        Get the filename of the application binary to be spawned
+        @param ipv6 True if the execution is over IPv6
+        '''
+        return cls.binary_name
+
+    def __init__(self, context):
         '''
         @param context The execution context
-        @param binary_name The filename of the application binary to be
-            spawned.
         @see ProfileExecutor
         '''
         super(SubProcessExecutorBase, self).__init__(context)
+        binary_name = self.binary_for(context.connection.is_ipv6())
+        self.subprocess_binary = binary_name
         self.subprocess_executable = utils.which(binary_name)
         self.subprocess_handle = None
+        self.__exit_notified = False
 
     def execute_subprocess(self, *args):
         '''
@@ -39,12 +209,22 @@ class SubProcessExecutorBase(ProfileExecutor):
         proc_args = [self.subprocess_executable]
         proc_args.extend(args)
         self.logger.debug("Starting subprocess - {0}.".format(proc_args))
-        self.subprocess_handle = proc.Popen(proc_args, stdout=proc.PIPE,
-                                            stderr=proc.STDOUT, close_fds=True)
+        self.__exit_notified = False
+        self.subprocess_handle = spawn(proc_args, self, stdout=PIPE)
 
     def is_supported(self):
         return self.subprocess_executable is not None
 
+    @property
+    def subprocess_version(self):
+        '''
+        The version of the application, probed once per executable, for
+        executors that parse output differently per version
+        '''
+        if self.subprocess_executable is None:
+            return None
+        return utils.tool_version(self.subprocess_executable)
+
     def is_subprocess_running(self):
         '''
         Check if the subprocess is still running
@@ -52,8 +232,23 @@ class SubProcessExecutorBase(ProfileExecutor):
         if self.subprocess_handle is None:
             return False
 
-        self.subprocess_handle.poll()
-        return self.subprocess_handle.returncode is None
+        if self.subprocess_handle.poll() is None:
+            return True
+        self.__notify_exited()
+        return False
+
+    def __notify_exited(self):
+        '''
+        Send "subprocess_exited" event once for the current handle
+        '''
+        if self.__exit_notified:
+            return
+        self.__exit_notified = True
+        if subprocess_exited:
+            subprocess_exited.send(
+                self,
+                binary=os.path.basename(str(self.subprocess_executable)),
+                returncode=self.subprocess_handle.returncode)
 
     def kill_subprocess(self):
         '''
@@ -64,8 +259,36 @@ class SubProcessExecutorBase(ProfileExecutor):
             return False
 
         self.subprocess_handle.kill()
+        self.subprocess_handle.wait()
+        self.__notify_exited()
         self.subprocess_handle = None
 
+    def wait_subprocess(self):
+        '''
+        Block until the spawned subprocess exits
+        '''
+        if self.subprocess_handle is None:
+            return
+        self.subprocess_handle.wait()
+        self.__notify_exited()
+
+    def read_subprocess_line(self):
+        '''
+        Read the next line of output of the spawned subprocess, blocking
+        until it is available.
+        @return The line or an empty string if output has ended
+        '''
+        if self.subprocess_handle is None:
+            return ''
+        return self.subprocess_handle.stdout.readline()
+
+    def signal_subprocess(self, signal):
+        '''
+        Send a signal to the spawned subprocess
+        '''
+        if self.is_subprocess_running():
+            self.subprocess_handle.send_signal(signal)
+
     def get_subprocess_output(self):
         '''
         Get all the output of the spawned subprocess
@@ -8,6 +8,8 @@ import pickle
 import base64
 import logging
 import socket
+from nsts import metrics
+from nsts.events import dispatcher
 
 # PROTOCOL VERSION
 VERSION = 1
@@ -15,6 +17,32 @@ VERSION = 1
 # Module logger
 logger = logging.getLogger("proto")
 
+# Seconds of idleness before keepalive probes, between probes,
+# and number of unanswered probes before a connection is dropped
+KEEPALIVE_IDLE = 60
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 5
+
+# Module metrics
+messages_sent = metrics.registry.counter(
+    'nsts_messages_sent_total', 'Messages sent per message type', ['type'])
+message_bytes_sent = metrics.registry.counter(
+    'nsts_message_bytes_sent_total', 'Bytes of messages sent per type',
+    ['type'])
+messages_received = metrics.registry.counter(
+    'nsts_messages_received_total', 'Messages received per message type',
+    ['type'])
+message_bytes_received = metrics.registry.counter(
+    'nsts_message_bytes_received_total',
+    'Bytes of messages received per type', ['type'])
+
+# Module events
+message_sent = dispatcher.register('message_sent', ['type', 'size'])
+message_received = dispatcher.register('message_received', ['type', 'size'])
+connection_opened = dispatcher.register(
+    'connection_opened', ['local_addr', 'remote_addr'])
+connection_closed = dispatcher.register('connection_closed', ['error'])
+
 
 class ConnectionClosedException(Exception):
     '''
@@ -86,6 +114,25 @@ class Message(object):
         return self.__str__()
 
 
+def tune_socket(sock):
+    '''
+    Tune a TCP socket for control traffic. Nagle's algorithm is
+    disabled, as it holds back small messages until the previous one
+    is acknowledged, and keepalive is enabled so that a dead peer is
+    detected while waiting for a message.
+    '''
+    if sock.family not in [socket.AF_INET, socket.AF_INET6]:
+        return
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in [('TCP_KEEPIDLE', KEEPALIVE_IDLE),
+                          ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL),
+                          ('TCP_KEEPCNT', KEEPALIVE_COUNT)]:
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option),
+                            value)
+
+
 class MessageStream(object):
     '''
     Wrapper for exchanging plain-text messages over
@@ -96,8 +143,10 @@ class MessageStream(object):
 
     def __init__(self, socket_):
         assert isinstance(socket_, socket.socket)
+        tune_socket(socket_)
         self.__socket = socket_
         self.receiver_buffer = ''
+        self.closed = False
 
     @property
     def socket(self):
@@ -126,7 +175,13 @@ class MessageStream(object):
             return None  # Drop empty messages
 
         # Decode message
-        return Message.decode(raw_msg)
+        msg = Message.decode(raw_msg)
+        size = len(raw_msg) + len(MessageStream.MSG_DELIMITER)
+        messages_received.inc(type=msg.type)
+        message_bytes_received.inc(size, type=msg.type)
+        if message_received:
+            message_received.send(self, type=msg.type, size=size)
+        return msg
 
     def __buffer_push_data(self, data):
         '''
@@ -179,11 +234,31 @@ class MessageStream(object):
         Send a message to the other end.
         '''
         msg = Message(msg_type, msg_params)
-        self.socket.send(msg.encode() + MessageStream.MSG_DELIMITER)
+        data = msg.encode() + MessageStream.MSG_DELIMITER
+        self.socket.sendall(data)
+        messages_sent.inc(type=msg_type)
+        message_bytes_sent.inc(len(data), type=msg_type)
+        if message_sent:
+            message_sent.send(self, type=msg_type, size=len(data))
 
     def is_ipv6(self):
         return self.socket.family == socket.AF_INET6
 
+    def close(self, error=None):
+        '''
+        Close the underlying socket and notify subscribers
+        of "connection_closed" event.
+        @param error The exception that caused closing, if any.
+        '''
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.socket.close()
+        finally:
+            if connection_closed:
+                connection_closed.send(self, error=error)
+
 
 class NSTSConnection(MessageStream):
     '''
@@ -223,3 +298,6 @@ class NSTSConnection(MessageStream):
         if response.params['version'] != VERSION:
             raise ProtocolError("Incompatible version")
         self.__local_addr = response.params['remote_addr']
+        if connection_opened:
+            connection_opened.send(self, local_addr=self.__local_addr,
+                                   remote_addr=self.__remote_addr)
@@ -0,0 +1,400 @@
+'''
+Scheduler of recurring measurements. A schedule file describes targets,
+the suite to run against each target and when to run it, and a single
+long-running process executes them, keeping a control connection open
+to every server between runs.
+
+A schedule file is an ini file with a section per target:
+
+    [global]
+    sink = /var/log/nsts.jsonl
+    store = /var/lib/nsts/results.nsts
+
+    [office]
+    connect = 10.0.0.1
+    suite = office.ini
+    every = 5 min
+    jitter = 30 sec
+
+    [backhaul]
+    connect = 10.0.1.1
+    tests = iperf_tcp,ping
+    samples = 5
+    cron = 0 */2 * * *
+
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+import sys
+import time
+import random
+import logging
+import datetime
+import threading
+import ConfigParser
+from nsts import core
+from nsts.units import Time
+from nsts.client import NSTSClient, ConnectionPool
+from nsts.io import suite as suite_io
+from nsts.io.terminal import ClientTerminal, MachineTerminal
+
+# Module logger
+logger = logging.getLogger("scheduler")
+
+# Default seconds until the next run of a target, up to which its control
+# connection is kept open. Servers serve one client at a time, so an open
+# connection blocks all other clients of the target.
+KEEP_CONNECTED = 60
+
+
+class ScheduleError(ValueError):
+    pass
+
+
+class IntervalSchedule(object):
+    '''
+    Run every fixed number of seconds
+    '''
+
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ScheduleError("Interval must be positive")
+        self.seconds = seconds
+
+    def first_after(self, timestamp):
+        return timestamp
+
+    def next_after(self, timestamp):
+        return timestamp + self.seconds
+
+    def __str__(self):
+        return "every {0}".format(Time(self.seconds))
+
+
+class CronSchedule(object):
+    '''
+    Run on times that match a cron expression with five fields
+    (minute, hour, day of month, month, day of week). Every field
+    accepts "*", numbers, ranges "a-b", steps "*/n" or "a-b/n" and
+    comma separated lists of them.
+    '''
+
+    FIELDS = [('minute', 0, 59), ('hour', 0, 23), ('day of month', 1, 31),
+              ('month', 1, 12), ('day of week', 0, 6)]
+
+    def __init__(self, expression):
+        self.expression = expression
+        parts = expression.split()
+        if len(parts) != len(self.FIELDS):
+            raise ScheduleError(
+                "Cron expression '{0}' must have {1} fields".format(
+                    expression, len(self.FIELDS)))
+        (self.minutes, self.hours, self.days, self.months,
+         self.weekdays) = [self.parse_field(part, *field)
+                           for part, field in zip(parts, self.FIELDS)]
+        # As in cron, when both days are restricted either may match
+        self.any_day = parts[2] == '*'
+        self.any_weekday = parts[4] == '*'
+
+    @staticmethod
+    def parse_field(text, name, lowest, highest):
+        '''
+        Parse a field of a cron expression
+        @return The set of matching values
+        '''
+        values = set()
+        for item in text.split(','):
+            step = 1
+            if '/' in item:
+                item, step = item.split('/', 1)
+                step = int(step)
+            if item == '*':
+                start, end = lowest, highest
+            elif '-' in item:
+                start, end = [int(v) for v in item.split('-', 1)]
+            else:
+                start = end = int(item)
+                if step != 1:
+                    end = highest
+            if start < lowest or end > highest or start > end or step < 1:
+                raise ScheduleError("Invalid {0} '{1}' in cron expression"
+                                    .format(name, text))
+            values.update(range(start, end + 1, step))
+        return values
+
+    def match_day(self, moment):
+        day = moment.day in self.days
+        # Cron counts Sunday as 0, python counts Monday as 0
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day:
+            return weekday
+        if self.any_weekday:
+            return day
+        return day or weekday
+
+    def next_after(self, timestamp):
+        moment = datetime.datetime.fromtimestamp(timestamp).replace(
+            second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = moment + datetime.timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months or \
+                    not self.match_day(moment):
+                moment = moment.replace(hour=0, minute=0) + \
+                    datetime.timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + \
+                    datetime.timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += datetime.timedelta(minutes=1)
+            else:
+                return time.mktime(moment.timetuple())
+        raise ScheduleError("Cron expression '{0}' never matches".format(
+            self.expression))
+
+    def first_after(self, timestamp):
+        return self.next_after(timestamp)
+
+    def __str__(self):
+        return "cron '{0}'".format(self.expression)
+
+
+class Job(object):
+    '''
+    Recurring execution of a suite against a target
+    '''
+
+    def __init__(self, name, host, schedule, port=core.DEFAULT_PORT,
+                 ipv6=False, suite_filename=None, tests=None, samples=10,
+                 jitter=0):
+        '''
+        @param name The name of the job, reported as target of results
+        @param schedule An IntervalSchedule or CronSchedule
+        @param suite_filename A suite file, loaded again on every run
+        @param tests Tests in command line format if there is no suite file
+        @param jitter Maximum random delay in seconds of every run
+        '''
+        if (suite_filename is None) == (tests is None):
+            raise ScheduleError(
+                "Job '{0}' needs either a suite or tests".format(name))
+        self.name = name
+        self.host = host
+        self.port = port
+        self.ipv6 = ipv6
+        self.schedule = schedule
+        self.suite_filename = suite_filename
+        self.tests = tests
+        self.samples = samples
+        self.jitter = jitter
+        self.client = None
+        self.scheduled_at = None
+        self.next_run = None
+        self.runs = 0
+        self.failures = 0
+
+    def plan(self, now, first=False):
+        '''
+        Set the time of the next run after now
+        @param first If True, plan the first run of the job
+        '''
+        if first:
+            self.scheduled_at = self.schedule.first_after(now)
+        else:
+            # Keep the pace of the schedule, unless a run was missed
+            self.scheduled_at = self.schedule.next_after(self.scheduled_at)
+            if self.scheduled_at < now:
+                self.scheduled_at = self.schedule.next_after(now)
+        self.next_run = self.scheduled_at + random.uniform(0, self.jitter)
+
+    def load_suite(self):
+        if self.suite_filename is not None:
+            spsuite = suite_io.load_file(self.suite_filename)
+        else:
+            spsuite = suite_io.parse_command_line(self.tests)
+        if spsuite.options['samples'] is None:
+            spsuite.options['samples'] = self.samples
+        if spsuite.options['interval'] is None:
+            spsuite.options['interval'] = 0
+        return spsuite
+
+    def disconnect(self):
+        if self.client is not None:
+            self.client.disconnect()
+
+    def execute(self, terminal, connections, profiler=None):
+        '''
+        Run the suite once, reusing the connection of previous runs
+        @param terminal The terminal to report to
+        @param connections The ConnectionPool of the scheduler
+        @param profiler A SelfProfiler to profile every test or None
+        @return The executed SpeedTestSuite or None on failure
+        '''
+        try:
+            if self.client is None:
+                manager = connections.get(self.host, self.port, self.ipv6)
+                self.client = NSTSClient(self.host, self.port, self.ipv6,
+                                         manager=manager, profiler=profiler)
+            self.client.connect()
+            spsuite = self.load_suite()
+            self.client.run_suite(spsuite, terminal)
+        except Exception, e:
+            # Connection state is unknown, reconnect on next run
+            self.failures += 1
+            logger.error("Job '{0}' failed: {1}".format(
+                self.name, str(e) or type(e).__name__))
+            self.disconnect()
+            return None
+        self.runs += 1
+        return spsuite
+
+
+class Scheduler(object):
+    '''
+    Execute jobs serially, each one at its planned time
+    '''
+
+    def __init__(self, jobs, sink=None, store=None, profiler=None,
+                 keep_connected=KEEP_CONNECTED):
+        '''
+        @param jobs A list of Job objects
+        @param sink A stream to write JSON Lines records of results
+        @param store A ResultsWriter to append results
+        @param profiler A SelfProfiler to profile every test or None
+        @param keep_connected Seconds until the next run of a target, up
+            to which its control connection is kept open
+        '''
+        self.jobs = jobs
+        self.sink = sink
+        self.store = store
+        self.profiler = profiler
+        self.keep_connected = keep_connected
+        self.connections = ConnectionPool()
+        self.__stopped = threading.Event()
+
+    def terminal_for(self, job):
+        if self.sink is None:
+            return ClientTerminal()
+        return MachineTerminal('jsonl', self.sink, {'target': job.name})
+
+    def run_job(self, job):
+        logger.info("Running job '{0}'".format(job.name))
+        spsuite = job.execute(self.terminal_for(job), self.connections,
+                              self.profiler)
+        if spsuite is not None and self.store is not None:
+            for test in spsuite.tests:
+                self.store.push_test(test, job.name)
+            self.store.flush()
+        job.plan(time.time())
+        logger.info("Next run of job '{0}' at {1}".format(
+            job.name, datetime.datetime.fromtimestamp(job.next_run)))
+        self.release_connection(job)
+
+    def release_connection(self, job):
+        '''
+        Close the control connection of the target of a job, unless a job
+        of the same target runs again soon
+        '''
+        target = (job.host, job.port, job.ipv6)
+        next_run = min([j.next_run for j in self.jobs
+                        if (j.host, j.port, j.ipv6) == target])
+        if next_run - time.time() > self.keep_connected:
+            logger.debug("Disconnecting from {0}:{1} until next run.".format(
+                job.host, job.port))
+            self.connections.get(*target).disconnect()
+
+    def run(self, max_runs=None):
+        '''
+        Execute jobs until stopped
+        @param max_runs Stop after this number of runs
+        '''
+        now = time.time()
+        for job in self.jobs:
+            job.plan(now, first=True)
+        runs = 0
+        while not self.__stopped.is_set() and self.jobs:
+            job = min(self.jobs, key=lambda j: j.next_run)
+            delay = job.next_run - time.time()
+            if delay > 0:
+                self.__stopped.wait(delay)
+                continue
+            self.run_job(job)
+            runs += 1
+            if max_runs is not None and runs >= max_runs:
+                break
+        self.connections.close()
+
+    def stop(self):
+        self.__stopped.set()
+
+
+def parse_schedule(config, section):
+    options = config.options(section)
+    if ('every' in options) == ('cron' in options):
+        raise ScheduleError(
+            "Job '{0}' needs either 'every' or 'cron'".format(section))
+    if 'every' in options:
+        return IntervalSchedule(Time(config.get(section, 'every')).raw_value)
+    return CronSchedule(config.get(section, 'cron'))
+
+
+def load_file(filename):
+    '''
+    Parse a schedule file
+    @return A tuple of (list of Job, dictionary of global options)
+    '''
+    config = ConfigParser.ConfigParser()
+    if not config.read(filename):
+        raise ScheduleError("Cannot read schedule file '{0}'".format(
+            filename))
+
+    options = {}
+    if config.has_section('global'):
+        options = dict(config.items('global'))
+        config.remove_section('global')
+
+    jobs = []
+    for name in config.sections():
+        if not config.has_option(name, 'connect'):
+            raise ScheduleError(
+                "'connect' entry is mandatory for job '{0}'".format(name))
+
+        def get(option, default=None):
+            if config.has_option(name, option):
+                return config.get(name, option)
+            return default
+        jobs.append(Job(
+            name, get('connect'), parse_schedule(config, name),
+            port=int(get('port', core.DEFAULT_PORT)),
+            ipv6=get('ipv6', 'false').lower() in ['1', 'yes', 'true', 'on'],
+            suite_filename=get('suite'), tests=get('tests'),
+            samples=int(get('samples', 10)),
+            jitter=Time(get('jitter', 0)).raw_value))
+    return jobs, options
+
+
+def main(filename, profiler=None):
+    '''
+    Run the scheduler of a schedule file until interrupted
+    @param profiler A SelfProfiler to profile every test or None
+    '''
+    jobs, options = load_file(filename)
+    sink = sys.stdout
+    if options.get('sink', '-') != '-':
+        sink = open(options['sink'], 'a')
+    store = None
+    if 'store' in options:
+        from nsts.io.results import ResultsWriter
+        store = ResultsWriter(options['store'])
+
+    scheduler = Scheduler(
+        jobs, sink, store, profiler,
+        Time(options.get('keep_connected', KEEP_CONNECTED)).raw_value)
+    for job in jobs:
+        logger.info("Job '{0}' against {1}:{2}, {3}".format(
+            job.name, job.host, job.port, job.schedule))
+    try:
+        scheduler.run()
+    finally:
+        if store is not None:
+            store.close()
+        if sink is not sys.stdout:
+            sink.close()
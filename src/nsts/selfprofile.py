@@ -0,0 +1,212 @@
+'''
+Profiling of NSTS itself. When enabled, the client profiles every test
+as a whole (samples, the gaps between them and terminal output) and the
+server profiles the dispatch of every message, with cProfile, and their
+memory allocations are tracked, so that the overhead of NSTS can be
+attributed to its modules (e.g. proto or the terminal). Calls that run
+in other threads (e.g. the rendering of a DeferredTerminal) are profiled
+separately with call() and merged in the section that they ran in.
+
+Memory is tracked with tracemalloc when it is available. Otherwise the
+growth of live objects per type is reported.
+
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+import os
+import gc
+import cProfile
+import pstats
+import logging
+import threading
+from cStringIO import StringIO
+from collections import defaultdict
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Module logger
+logger = logging.getLogger("selfprofile")
+
+# Number of entries in summaries
+TOP_ENTRIES = 25
+
+
+def count_objects_per_type():
+    '''
+    Count the objects tracked by the garbage collector per type
+    '''
+    counts = defaultdict(int)
+    for obj in gc.get_objects():
+        counts[type(obj).__name__] += 1
+    return counts
+
+
+def module_of(filename):
+    '''
+    Get a short module name for a source filename of a profile entry
+    '''
+    if filename.startswith('~') or filename.startswith('<'):
+        return 'builtins'
+    parts = os.path.splitext(filename.replace('\\', '/'))[0].split('/')
+    if 'nsts' in parts[:-1]:
+        index = len(parts) - 1 - parts[-2::-1].index('nsts') - 1
+        parts = parts[index:]
+    else:
+        parts = parts[-1:]
+    if len(parts) > 1 and parts[-1] == '__init__':
+        parts = parts[:-1]
+    return '.'.join(parts)
+
+
+class MemoryTracker(object):
+    '''
+    Track memory allocations between start() and stop()
+    '''
+
+    def start(self):
+        if tracemalloc is not None:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self.__snapshot = tracemalloc.take_snapshot()
+        else:
+            self.__snapshot = count_objects_per_type()
+
+    def stop(self):
+        '''
+        @return A list of lines with the top allocations
+        '''
+        if tracemalloc is not None:
+            stats = tracemalloc.take_snapshot().compare_to(
+                self.__snapshot, 'lineno')
+            return [str(s) for s in stats[:TOP_ENTRIES]]
+
+        current = count_objects_per_type()
+        growth = sorted(
+            [(current[t] - self.__snapshot.get(t, 0), t) for t in current],
+            reverse=True)
+        return ["{0}: +{1} objects".format(t, g)
+                for g, t in growth[:TOP_ENTRIES] if g > 0]
+
+
+class SelfProfiler(object):
+    '''
+    Profile sections of NSTS and write a dump and a summary per section
+    in a directory. A single section is profiled at a time.
+    '''
+
+    def __init__(self, directory, prefix):
+        '''
+        @param directory The directory to write profiling data
+        @param prefix A prefix of all filenames (e.g. "client")
+        '''
+        self.directory = directory
+        self.prefix = prefix
+        self.sections = 0
+        self.__profiler = None
+        self.__memory = None
+        self.__threads = []
+        self.__lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @property
+    def active(self):
+        '''
+        Check if a section is being profiled
+        '''
+        return self.__profiler is not None
+
+    def start(self):
+        '''
+        Start profiling a section
+        '''
+        if self.active:
+            raise RuntimeError("A section is already being profiled.")
+        self.__memory = MemoryTracker()
+        self.__memory.start()
+        with self.__lock:
+            self.__threads = []
+            self.__profiler = cProfile.Profile()
+        self.__profiler.enable()
+
+    def call(self, func, *args, **kwargs):
+        '''
+        Perform a call from any thread and profile it as part of the
+        current section. Calls that finish after the section has stopped
+        are not included in it.
+        @return The return value of the call
+        '''
+        with self.__lock:
+            section = self.__profiler
+        if section is None:
+            return func(*args, **kwargs)
+
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func, *args, **kwargs)
+        finally:
+            with self.__lock:
+                if self.__profiler is section:
+                    self.__threads.append(profiler)
+
+    def stop(self, name, execution_ids=()):
+        '''
+        Stop profiling the current section and write its data
+        @param name The name of the section, used in filenames
+        @param execution_ids The ids of profile executions of the section
+        @return The base filename of the written data
+        '''
+        if not self.active:
+            return None
+        self.__profiler.disable()
+        allocations = self.__memory.stop()
+        with self.__lock:
+            stats = pstats.Stats(self.__profiler)
+            for profiler in self.__threads:
+                stats.add(profiler)
+            self.__profiler = None
+            self.__threads = []
+        self.sections += 1
+        basename = os.path.join(self.directory, "{0}-{1:04d}-{2}".format(
+            self.prefix, self.sections, name))
+
+        stats.dump_stats(basename + '.prof')
+        with open(basename + '.txt', 'w') as f:
+            f.write("Executions: {0}\n\n".format(
+                ', '.join(execution_ids) or 'none'))
+            f.write(self.summary(stats, allocations))
+        logger.info("Profiling data of {0} written at {1}.*".format(
+            name, basename))
+        self.__memory = None
+        return basename
+
+    def summary(self, profiler, allocations):
+        '''
+        Render a text summary with time per module, top functions
+        and top allocations
+        @param profiler A cProfile.Profile or pstats.Stats object
+        '''
+        output = StringIO()
+        if isinstance(profiler, pstats.Stats):
+            stats = profiler
+            stats.stream = output
+        else:
+            stats = pstats.Stats(profiler, stream=output)
+
+        modules = defaultdict(float)
+        for (filename, _, _), entry in stats.stats.items():
+            modules[module_of(filename)] += entry[2]
+        output.write("Internal time per module\n")
+        for module, seconds in sorted(modules.items(),
+                                      key=lambda m: m[1], reverse=True):
+            output.write("  {0: <40} {1:.6f} sec\n".format(module, seconds))
+
+        output.write("\nTop functions\n")
+        stats.sort_stats('cumulative').print_stats(TOP_ENTRIES)
+
+        output.write("\nTop allocations\n")
+        for line in allocations:
+            output.write("  {0}\n".format(line))
+        return output.getvalue()
@@ -8,13 +8,31 @@ Created on Nov 4, 2013
 import socket
 import sys
 import logging
-from nsts import proto, core
+from nsts import proto, core, metrics, utils
 from nsts.speedtest import SpeedTest, SpeedTestSuite
 from nsts.profiles.base import ExecutionDirection, ProfileExecution, Profile
 from nsts.proto import NSTSConnection
+from nsts.events import dispatcher
 
 logger = logging.getLogger("proto")
 
+# Module metrics
+active_connections = metrics.registry.gauge(
+    'nsts_server_active_connections', 'Clients currently connected')
+connections_total = metrics.registry.counter(
+    'nsts_server_connections_total', 'Clients accepted by the server')
+profile_executions = metrics.registry.counter(
+    'nsts_profile_executions_total', 'Profile executions served',
+    ['profile', 'direction', 'status'])
+execution_duration = metrics.registry.histogram(
+    'nsts_profile_execution_duration_seconds',
+    'Duration of served profile executions', ['profile', 'direction'])
+
+# Module events
+execution_finished = dispatcher.register(
+    'profile_execution_finished', ['results'])
+execution_failed = dispatcher.register('profile_execution_failed', ['error'])
+
 
 class NSTSServer(object):
     '''
@@ -22,10 +40,25 @@ class NSTSServer(object):
     serving of clients to execute their profiles.
     '''
 
-    def __init__(self, host=None, port=None, ipv6=False):
+    def __init__(self, host=None, port=None, ipv6=False, quiet=False,
+                 profiler=None):
+        '''
+        @param profiler A SelfProfiler to profile the dispatch of messages
+        '''
         self.host = '' if host is None else host
         self.port = core.DEFAULT_PORT if port is None else port
         self.ipv6 = ipv6
+        self.quiet = quiet
+        self.profiler = profiler
+        self.server_socket = None
+        self.running = False
+
+    def __print(self, message):
+        '''
+        Print a message on console unless server is quiet
+        '''
+        if not self.quiet:
+            print message
 
     def __serve_cmd_checkprofile(self, connection, test_id):
         '''
@@ -44,6 +77,17 @@ class NSTSServer(object):
                 "error": "unknown"
                 })
 
+    def __serve_cmd_listprofiles(self, connection):
+        '''
+        Serve client command of listing the installed profiles
+        '''
+        from nsts.profiles import plugins
+        connection.send_msg(
+            "PROFILELIST", {
+                "profiles": [plugins.describe(profile) for profile
+                             in Profile.get_all_profiles().values()]
+                })
+
     def __serve_cmd_run_profile(self, ctx):
         '''
         Serve client command of executing a profile
@@ -52,61 +96,102 @@ class NSTSServer(object):
             "Client requested execution of profile {0}."
             .format(ctx.name))
 
+        labels = {'profile': ctx.profile.id, 'direction': str(ctx.direction)}
+        execution_started = utils.monotonic()
         try:
             executor = ctx.executor
             logger.debug("Preparing profile '{0}'.".format(ctx.name))
-            executor.prepare()
+            with ctx.phase('prepare'):
+                executor.prepare()
             ctx.connection.send_msg("OK")
 
             # RUN
             logger.debug("Profile '{0}' started.".format(ctx.name))
-            executor.run()
+            with ctx.phase('run'):
+                executor.run()
 
             # STOP
             logger.debug("Test '{0}' finished.".format(ctx.name))
-            ctx.connection.send_msg(
-                "EXECUTIONFINISHED", {"execution_id": ctx.id})
-            ctx.connection.wait_msg_type("EXECUTIONFINISHED")
+            with ctx.phase('finish'):
+                ctx.connection.send_msg(
+                    "EXECUTIONFINISHED", {
+                        "execution_id": ctx.id,
+                        "timings": dict(ctx.timings)})
+                ctx.connection.wait_msg_type("EXECUTIONFINISHED")
 
         except BaseException, e:
             logger.critical("Unhandled exception: " + str(type(e)) + str(e))
+            profile_executions.inc(status='failed', **labels)
+            if execution_failed:
+                execution_failed.send(ctx, error=e)
             executor.cleanup()
             raise
-        executor.cleanup()
+        with ctx.phase('cleanup'):
+            executor.cleanup()
+        if execution_finished:
+            execution_finished.send(ctx, results=ctx.results)
+        logger.debug("Profile '{0}' phases: {1}".format(
+            ctx.name, ", ".join(["{0}={1:.6f}s".format(p, d)
+                                 for p, d in ctx.timings.items()])))
+        profile_executions.inc(status='finished', **labels)
+        execution_duration.observe(
+            utils.monotonic() - execution_started, **labels)
 
     def __cmd_dispatcher(self, connection):
         '''
         Read messages from client and dispatch
-        to different commands
-        '''
-        while(True):
-
-            msg = connection.wait_msg()
-            if msg.type == "CHECKPROFILE":
-                # Check a profile
-                self.__serve_cmd_checkprofile(
-                    connection,
-                    msg.params["profile_id"])
-            elif msg.type == "INSTANTIATEPROFILE":
-                # Run a profile
-                profile = Profile.get_all_profiles()[msg.params['profile_id']]
-                direction = ExecutionDirection(msg.params["direction"])
-                execution_id = msg.params['execution_id']
-                options = msg.params['options']
-
-                execution = ProfileExecution(
-                    profile,
-                    direction,
-                    options,
-                    connection,
-                    execution_id)
+        to different commands. If a profiler is set, the dispatch of
+        messages is profiled, including their decoding, up to and
+        including every profile execution.
+        '''
+        try:
+            while(True):
+                if self.profiler is not None and not self.profiler.active:
+                    self.profiler.start()
+                self.__dispatch_msg(connection, connection.wait_msg())
+        finally:
+            if self.profiler is not None:
+                self.profiler.stop('connection')
+
+    def __dispatch_msg(self, connection, msg):
+        '''
+        Dispatch a message of the client to its command
+        '''
+        if msg.type == "CHECKPROFILE":
+            # Check a profile
+            self.__serve_cmd_checkprofile(
+                connection,
+                msg.params["profile_id"])
+        elif msg.type == "LISTPROFILES":
+            self.__serve_cmd_listprofiles(connection)
+        elif msg.type == "INSTANTIATEPROFILE":
+            # Run a profile
+            profile = Profile.get_all_profiles()[msg.params['profile_id']]
+            direction = ExecutionDirection(msg.params["direction"])
+            execution_id = msg.params['execution_id']
+            options = msg.params['options']
+
+            instantiate_started = utils.monotonic()
+            execution = ProfileExecution(
+                profile,
+                direction,
+                options,
+                connection,
+                execution_id)
+            execution.record_phase(
+                'instantiate', utils.monotonic() - instantiate_started)
+            try:
                 self.__serve_cmd_run_profile(execution)
+            finally:
+                if self.profiler is not None:
+                    self.profiler.stop("execution-{0}-{1}".format(
+                        profile.id, direction), [str(execution_id)])
 
-    def serve(self):
-        ''' Start the server and start serving serially
-        in the same thread.
+    def listen(self):
+        '''
+        Create the listening socket. If port is 0, an ephemeral
+        port is selected and stored in self.port
         '''
-        # Create socket
         try:
             if self.ipv6:
                 self.server_socket = socket.socket(
@@ -122,22 +207,56 @@ class NSTSServer(object):
             print 'Socket error.. Error code: ' + \
                 str(msg[0]) + 'Error message: ' + msg[1]
             sys.exit()
+        self.port = self.server_socket.getsockname()[1]
 
         logger.info("Server started listening at port {0}".format(self.port))
-        print "Server started listening at port {0}".format(self.port)
+        self.__print("Server started listening at port {0}".format(self.port))
+
+    def shutdown(self):
+        '''
+        Stop accepting new connections. A serve() that is blocked
+        waiting for a new connection returns.
+        '''
+        self.running = False
+        if self.server_socket is not None:
+            # Closing the socket does not wake up a blocked accept()
+            try:
+                self.server_socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.server_socket.close()
+
+    def serve(self):
+        ''' Start the server and start serving serially
+        in the same thread.
+        '''
+        if self.server_socket is None:
+            self.listen()
 
         # Get new connections loop
-        while(True):
-            print "Waiting for new connection..."
-            (socket_conn, socket_addr) = self.server_socket.accept()
-            print 'Got connection from client ' + socket_addr[0] \
-                + ':' + str(socket_addr[1])
+        self.running = True
+        while(self.running):
+            self.__print("Waiting for new connection...")
+            try:
+                (socket_conn, socket_addr) = self.server_socket.accept()
+            except socket.error:
+                if not self.running:
+                    break
+                raise
+            self.__print('Got connection from client ' + socket_addr[0]
+                         + ':' + str(socket_addr[1]))
+            connections_total.inc()
+            active_connections.inc()
+            connection = NSTSConnection(socket_conn)
+            error = None
             try:
-                connection = NSTSConnection(socket_conn)
                 connection.handshake(socket_addr[0])
                 self.__cmd_dispatcher(connection)
             except (proto.ConnectionClosedException, socket.error), msg:
-                print "Client disconnected."
+                self.__print("Client disconnected.")
             except Exception, e:
-                print "Client raised an exception: " + str(e)
-                socket_conn.close()
+                self.__print("Client raised an exception: " + str(e))
+                error = e
+            finally:
+                connection.close(error)
+                active_connections.dec()
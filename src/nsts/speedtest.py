@@ -4,6 +4,7 @@ Created on Nov 13, 2013
 @license: GPLv3
 @author: NSTS Contributors (see AUTHORS.txt)
 '''
+from collections import OrderedDict
 from nsts.profiles.base import Profile, ProfileExecution, \
     ExecutionDirection
 
@@ -19,6 +20,16 @@ class SpeedTestOptionsDescriptor(OptionsDescriptor):
         self.add_option('interval', '', Time)
         self.add_option('samples', '', int)
         self.add_option('name', '', unicode)
+        self.add_option('precision', 'Target relative half width of '
+                        'confidence interval for adaptive sampling', float)
+        self.add_option('precision_result', 'Result that adaptive sampling '
+                        'checks (default: the first result)', unicode)
+        self.add_option('confidence', 'Confidence level of adaptive '
+                        'sampling', float)
+        self.add_option('max_samples', 'Maximum samples of adaptive '
+                        'sampling', int)
+        self.add_option('max_duration', 'Maximum duration of adaptive '
+                        'sampling', Time)
 
 
 class SpeedTest(object):
@@ -36,6 +47,8 @@ class SpeedTest(object):
         self.__profile_options = Options(
             profile.supported_options, profile_options)
         self.samples = []
+        self.calibration = None
+        self.stop_reason = None
 
     @property
     def profile(self):
@@ -110,6 +123,25 @@ class SpeedTest(object):
 
         return reduced
 
+    def phase_statistics(self):
+        '''
+        Calculate statistics on the duration of execution phases
+        '''
+        durations = OrderedDict()
+        for sample in self.samples:
+            for phase, duration in sample.timings.items():
+                durations.setdefault(phase, []).append(Time(duration))
+
+        reduced = OrderedDict()
+        for phase, values in durations.items():
+            data = utils.UnitsStatisticsArray(values)
+            reduced[phase] = {
+                'mean': data.mean(),
+                'min': data.min(),
+                'max': data.max(),
+                'std': data.std()}
+        return reduced
+
     def execution_time(self):
         '''
         Get total execution time for all samples
@@ -120,6 +152,112 @@ class SpeedTest(object):
         return self.samples.__iter__()
 
 
+class StoppingRule(object):
+    '''
+    Stopping rule of adaptive sampling. Sampling stops as soon as the
+    confidence interval of the mean of a result is narrower than a
+    relative precision, or when the samples or time budget is exhausted.
+    Statistics are updated incrementally, so each check costs O(1).
+    '''
+
+    # Default budget of adaptive sampling
+    DEFAULT_CONFIDENCE = 0.95
+    DEFAULT_MAX_SAMPLES = 100
+
+    # Less samples make the t-distribution approximation unreliable
+    MIN_SAMPLES = 3
+
+    def __init__(self, unit_type, precision, confidence=None,
+                 min_samples=None, max_samples=None, max_duration=None):
+        '''
+        @param unit_type The unit type of the checked result
+        @param precision The target half width of the confidence interval
+            relative to the mean (e.g. 0.05 for +/-5%)
+        @param confidence The confidence level of the interval
+        @param min_samples Samples to execute before checking precision
+        @param max_samples The maximum number of samples, not less than
+            min_samples
+        @param max_duration The maximum duration of sampling as Time
+        '''
+        if precision <= 0:
+            raise ValueError("Precision must be a positive fraction")
+        self.precision = precision
+        self.confidence = confidence or self.DEFAULT_CONFIDENCE
+        self.min_samples = max(min_samples or 0, self.MIN_SAMPLES)
+        self.max_samples = max_samples or \
+            max(self.DEFAULT_MAX_SAMPLES, self.min_samples)
+        if self.max_samples < self.min_samples:
+            raise ValueError(
+                "Maximum samples ({0}) are less than the minimum samples "
+                "({1}) of adaptive sampling".format(
+                    self.max_samples, self.min_samples))
+        self.max_duration = max_duration
+        self.statistics = utils.RunningStatistics(unit_type)
+        self.__z = utils.normal_quantile(self.confidence)
+        self.__started_at = utils.monotonic()
+
+    @classmethod
+    def for_test(cls, test, samples, defaults=None):
+        '''
+        Create the stopping rule of a test, from its options or the
+        defaults of the suite.
+        @param test The SpeedTest
+        @param samples The minimum number of samples
+        @param defaults Options with suite-wide defaults
+        @return A StoppingRule or None if adaptive sampling is disabled
+        '''
+        def option(name):
+            if test.options[name] is not None or defaults is None:
+                return test.options[name]
+            return defaults[name]
+
+        if option('precision') is None:
+            return None
+        result_id = option('precision_result')
+        if result_id is None:
+            result_id = test.profile.supported_results.keys()[0]
+        rule = cls(test.profile.supported_results[result_id].unit_type,
+                   option('precision'), option('confidence'), samples,
+                   option('max_samples'), option('max_duration'))
+        rule.result_id = result_id
+        return rule
+
+    def push(self, sample):
+        '''
+        Account a finished sample
+        '''
+        self.statistics.push(sample.results[self.result_id])
+
+    def relative_precision(self):
+        '''
+        Get the current half width of the confidence interval
+        relative to the mean
+        '''
+        mean = abs(self.statistics.mean().raw_value)
+        half_width = self.statistics.raw_confidence_interval(self.__z)
+        if not mean:
+            return 0.0 if not half_width else float('inf')
+        return half_width / mean
+
+    def stop_reason(self):
+        '''
+        Check if sampling must stop
+        @return 'precision', 'max_samples', 'max_duration' or None to
+            continue sampling
+        '''
+        count = self.statistics.count
+        if count >= self.min_samples and \
+                self.relative_precision() <= self.precision:
+            return 'precision'
+        if count >= self.max_samples:
+            return 'max_samples'
+        if self.max_duration is not None and \
+                utils.monotonic() - self.__started_at >= \
+                self.max_duration.raw_value:
+            return 'max_duration'
+        return None
+
+
 class SpeedTestSuite(object):
 
     def __init__(self):
@@ -1 +1,12 @@
+import os
+import atexit
+import shutil
+import tempfile
+from nsts.profiles import plugins
+
 __all__ = ['test_units', 'test_sensors_shell']
+
+# Keep the index of plugin profiles of tests out of the home directory
+_index_directory = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, _index_directory, True)
+plugins.index_filename = os.path.join(_index_directory, 'profiles.json')
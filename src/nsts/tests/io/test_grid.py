@@ -0,0 +1,78 @@
+'''
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+
+import unittest
+from cStringIO import StringIO
+from nsts.io.grid import Grid
+from nsts import units
+
+
+class TestGrid(unittest.TestCase):
+
+    def sample_grid(self):
+        g = Grid(40)
+        g.add_column('', 'fit')
+        g.add_column('Value', 'equal', 'right')
+        g.add_column('Tag', 5)
+        return g
+
+    def test_no_columns(self):
+        with self.assertRaises(RuntimeError):
+            Grid(40).render()
+
+    def test_cell_format(self):
+        g = self.sample_grid()
+        g.add_row([1, units.BitRate(1500), ' tag '])
+        g.add_row([2, 0.5, 'tag'])
+        self.assertEqual(g.rows[0], ['1', '1.500 kbit/s', 'tag'])
+        self.assertEqual(g.rows[1], ['2', '0.500', 'tag'])
+
+    def test_fit_width_tracking(self):
+        g = self.sample_grid()
+        self.assertEqual(g.get_column_widths()[0], 0)
+        g.add_row([1, 1, ''])
+        self.assertEqual(g.get_column_widths()[0], 1)
+        g.add_row([1000, 1, ''])
+        self.assertEqual(g.get_column_widths()[0], 4)
+        g.add_row([10, 1, ''])
+        self.assertEqual(g.get_column_widths()[0], 4)
+
+        # Total width is preserved
+        widths = g.get_column_widths()
+        self.assertEqual(sum(widths) + (len(widths) - 1) * 3 + 4, 40)
+
+    def test_render(self):
+        g = self.sample_grid()
+        g.add_row([1, 1, 'abcdefgh'])
+        lines = g.render().split("\n")
+        self.assertEqual(lines[0], "+---+--------------------------+-------+")
+        self.assertEqual(lines[1], "|   |                    Value | Tag   |")
+        self.assertEqual(lines[3], "| 1 |                        1 | abcde |")
+        self.assertEqual(lines[4], "|   |                          | fgh   |")
+        self.assertEqual(lines[5], lines[0])
+        self.assertEqual(len(lines), 6)
+        for line in lines:
+            self.assertEqual(len(line), 40)
+
+    def test_write(self):
+        g = self.sample_grid()
+        for i in range(100):
+            g.add_row([i, i, 'x'])
+        stream = StringIO()
+        g.write(stream, chunk_rows=7)
+        self.assertEqual(stream.getvalue(), g.render() + "\n")
+
+    def test_paged(self):
+        g = self.sample_grid()
+        for i in range(10):
+            g.add_row([i, i, 'x'])
+        lines = list(g.iter_lines(page_rows=4))
+        # Header is rendered 3 times, every header has 3 lines
+        self.assertEqual(len(lines), 3 * 3 + 10 + 1)
+        self.assertEqual(lines.count(lines[1]), 3)
@@ -0,0 +1,145 @@
+'''
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+
+import unittest
+import tempfile
+import shutil
+import socket
+import datetime
+import numpy as np
+from nsts.io import results
+from nsts.io.results import ResultsWriter, ResultsFile
+from nsts.profiles.base import ExecutionDirection, ProfileExecution
+from nsts.speedtest import SpeedTest
+from nsts.proto import NSTSConnection
+from nsts.profiles import dummy
+from nsts import units
+
+
+def make_sample(direction, started_at, transfer):
+    ctx = ProfileExecution(
+        dummy.p, ExecutionDirection(direction),
+        SpeedTest(dummy.p, ExecutionDirection(direction)).profile_options,
+        NSTSConnection(socket.socket()))
+    ctx.started_at = started_at
+    ctx.ended_at = started_at + datetime.timedelta(seconds=1)
+    ctx.executor.store_result('random_transfer', transfer)
+    ctx.executor.store_result('random_time', 1)
+    return ctx
+
+
+class TestResults(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'results.nsts')
+        self.epoch = datetime.datetime(2014, 1, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_samples(self, count, target='host1'):
+        writer = ResultsWriter(self.filename)
+        for i in range(count):
+            writer.push_sample(make_sample(
+                's' if i % 2 else 'r',
+                self.epoch + datetime.timedelta(minutes=i),
+                i), target)
+        writer.close()
+
+    def test_empty(self):
+        ResultsWriter(self.filename).close()
+        f = ResultsFile(self.filename)
+        self.assertEqual(len(f), 0)
+        self.assertEqual(len(f.query('random_transfer')), 0)
+
+    def test_invalid_file(self):
+        with open(self.filename, 'wb') as f:
+            f.write('garbage' * 10)
+        with self.assertRaises(results.ResultsFileError):
+            ResultsFile(self.filename)
+
+    def test_long_target(self):
+        writer = ResultsWriter(self.filename)
+        with self.assertRaises(ValueError):
+            writer.push_sample(make_sample('s', self.epoch, 1), 'h' * 65)
+        writer.push_sample(make_sample('s', self.epoch, 1), 'h' * 64)
+        writer.close()
+        f = ResultsFile(self.filename)
+        self.assertEqual(len(f.query('random_transfer', target='h' * 64)), 1)
+
+    def test_statistics_match_speedtest(self):
+        test = SpeedTest(dummy.p, ExecutionDirection('s'))
+        for i in range(10):
+            test.push_sample(make_sample(
+                's', self.epoch + datetime.timedelta(seconds=i), i * 3))
+
+        writer = ResultsWriter(self.filename)
+        writer.push_test(test, 'host1')
+        writer.close()
+
+        selection = ResultsFile(self.filename).query(
+            'random_transfer', profile='dummy')
+        expected = test.statistics()['random_transfer']
+        stats = selection.statistics()
+        self.assertEqual(len(selection), 10)
+        for key in ['mean', 'min', 'max']:
+            self.assertEqual(stats[key], expected[key])
+        self.assertAlmostEqual(stats['std'].raw_value,
+                               expected['std'].raw_value)
+
+    def test_filters_across_blocks(self):
+        # Every sample stores two result values
+        count = results.BLOCK_SIZE + 50
+        self.write_samples(count)
+        self.write_samples(10, target='host2')
+
+        f = ResultsFile(self.filename)
+        self.assertEqual(len(f), (count + 10) * 2)
+        self.assertEqual(len(f.index), 3)
+
+        self.assertEqual(
+            len(f.query('random_transfer', target='host1')), count)
+        self.assertEqual(
+            len(f.query('random_transfer', target='host2')), 10)
+        self.assertEqual(
+            len(f.query('random_transfer', target='host3')), 0)
+        self.assertEqual(
+            len(f.query('random_transfer', target='host1', direction='s')),
+            count // 2)
+
+        since = self.epoch + datetime.timedelta(minutes=100)
+        until = self.epoch + datetime.timedelta(minutes=200)
+        selection = f.query('random_transfer', profile='dummy',
+                            target='host1', since=since, until=until)
+        self.assertEqual(len(selection), 100)
+        self.assertEqual(selection.statistics()['min'], units.BitRate(100))
+        self.assertEqual(selection.statistics()['max'], units.BitRate(199))
+
+    def test_percentiles(self):
+        self.write_samples(101)
+        selection = ResultsFile(self.filename).query(
+            'random_transfer', profile='dummy')
+        percentiles = dict(selection.percentiles([0, 50, 100]))
+        self.assertEqual(percentiles[0], units.BitRate(0))
+        self.assertEqual(percentiles[50], units.BitRate(50))
+        self.assertEqual(percentiles[100], units.BitRate(100))
+
+    def test_rollup(self):
+        self.write_samples(120)
+        selection = ResultsFile(self.filename).query('random_transfer')
+        rollup = selection.rollup(units.Time('1 hour'))
+        self.assertEqual(len(rollup), 2)
+        self.assertEqual(rollup[0]['started_at'], self.epoch)
+        self.assertEqual(rollup[0]['samples'], 60)
+        self.assertEqual(rollup[1]['samples'], 60)
+        self.assertEqual(rollup[1]['min'], 60)
+        self.assertEqual(rollup[1]['max'], 119)
+        self.assertAlmostEqual(rollup[1]['mean'], np.arange(60, 120).mean())
+        self.assertAlmostEqual(rollup[1]['std'], np.arange(60, 120).std())
@@ -0,0 +1,163 @@
+'''
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+
+import unittest
+import json
+import csv
+import socket
+import datetime
+from cStringIO import StringIO
+import threading
+from nsts.io.terminal import MachineTerminal, DeferredTerminal, \
+    ClientTerminal
+from nsts.profiles.base import ExecutionDirection, ProfileExecution
+from nsts.speedtest import SpeedTest, SpeedTestSuite
+from nsts.proto import NSTSConnection
+from nsts.profiles import dummy
+
+
+def make_test(samples):
+    test = SpeedTest(dummy.p, ExecutionDirection('s'))
+    for i in range(samples):
+        ctx = ProfileExecution(
+            dummy.p, ExecutionDirection('s'), test.profile_options,
+            NSTSConnection(socket.socket()))
+        ctx.ended_at = ctx.started_at + datetime.timedelta(seconds=1)
+        ctx.executor.store_result('random_transfer', i)
+        ctx.executor.store_result('random_time', 1)
+        test.push_sample(ctx)
+    return test
+
+
+class TestMachineTerminal(unittest.TestCase):
+
+    def run_suite(self, terminal):
+        suite = SpeedTestSuite()
+        test = make_test(2)
+        suite.add_test(test)
+        terminal.suite_execution_started(suite)
+        terminal.test_execution_started(test)
+        for sample in test.samples:
+            terminal.profile_execution_started(sample)
+            terminal.profile_execution_finished(sample)
+        terminal.test_execution_finished(test)
+        terminal.suite_execution_finished(suite)
+        return test
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            MachineTerminal('xml')
+
+    def test_jsonl(self):
+        stream = StringIO()
+        test = self.run_suite(MachineTerminal('jsonl', stream))
+        records = [json.loads(l) for l in stream.getvalue().splitlines()]
+
+        self.assertEqual(
+            ['profile_execution_finished', 'profile_execution_finished',
+             'test_execution_finished', 'suite_execution_finished'],
+            [r['event'] for r in records])
+        self.assertEqual(records[0]['execution_id'], test.samples[0].id)
+        self.assertEqual(records[1]['values']['random_transfer'], 1)
+        self.assertEqual(records[2]['samples'], 2)
+        self.assertEqual(
+            records[2]['values']['random_transfer']['mean'], 0.5)
+        self.assertEqual(records[3]['samples'], 2)
+        self.assertEqual(records[3]['execution_time'], 2)
+
+    def test_csv(self):
+        stream = StringIO()
+        self.run_suite(MachineTerminal('csv', stream))
+        rows = list(csv.DictReader(StringIO(stream.getvalue())))
+
+        # A row per value of every record
+        values = dict(((r['event'], r['execution_id'], r['result'],
+                        r['stat']), r['value']) for r in rows)
+        self.assertEqual(len(values), len(rows))
+        self.assertEqual('profile_execution_finished', rows[0]['event'])
+        self.assertEqual('dummy', rows[0]['profile'])
+        self.assertEqual('1.0', values[(
+            'profile_execution_finished', rows[2]['execution_id'],
+            'random_transfer', 'value')])
+        self.assertEqual('0.5', values[(
+            'test_execution_finished', '', 'random_transfer', 'mean')])
+        self.assertEqual(8, len([r for r in rows
+                                 if r['event'] == 'test_execution_finished']))
+        self.assertEqual('suite_execution_finished', rows[-1]['event'])
+        self.assertEqual('', rows[-1]['result'])
+
+    def test_csv_plain_values(self):
+        stream = StringIO()
+        test = make_test(1)
+        test.samples[0].executor.store_result('random_transfer', 0.1 + 0.2)
+        MachineTerminal('csv', stream).profile_execution_finished(
+            test.samples[0])
+        rows = list(csv.DictReader(StringIO(stream.getvalue())))
+        values = dict((r['result'], r['value']) for r in rows)
+        self.assertEqual('0.3', values['random_transfer'])
+
+    def test_test_without_samples(self):
+        stream = StringIO()
+        MachineTerminal('jsonl', stream).test_execution_finished(
+            make_test(0))
+        record = json.loads(stream.getvalue())
+        self.assertIsNone(record['started_at'])
+        self.assertEqual(0, record['samples'])
+        self.assertEqual({}, record['values'])
+
+
+class SlowTerminal(ClientTerminal):
+
+    def __init__(self):
+        super(SlowTerminal, self).__init__()
+        self.release = threading.Event()
+        self.calls = []
+
+    def profile_execution_finished(self, profile):
+        self.release.wait()
+        self.calls.append(('finished', profile))
+
+    def test_execution_finished(self, test):
+        raise RuntimeError("broken terminal")
+
+    def epilog(self):
+        self.calls.append(('epilog', None))
+
+
+class TestDeferredTerminal(unittest.TestCase):
+
+    def test_jsonl_in_order(self):
+        stream = StringIO()
+        deferred = DeferredTerminal(MachineTerminal('jsonl', stream))
+        TestMachineTerminal('run_suite').run_suite(deferred)
+        deferred.close()
+        records = [json.loads(l) for l in stream.getvalue().splitlines()]
+        self.assertEqual(
+            ['profile_execution_finished', 'profile_execution_finished',
+             'test_execution_finished', 'suite_execution_finished'],
+            [r['event'] for r in records])
+
+    def test_does_not_block_caller(self):
+        slow = SlowTerminal()
+        deferred = DeferredTerminal(slow)
+        self.assertIs(deferred.options, slow.options)
+
+        deferred.profile_execution_finished('first')
+        deferred.profile_execution_finished('second')
+        self.assertEqual(slow.calls, [])
+        slow.release.set()
+        deferred.test_execution_finished(None)
+        deferred.epilog()
+        deferred.close()
+
+        self.assertEqual(slow.calls, [('finished', 'first'),
+                                      ('finished', 'second'),
+                                      ('epilog', None)])
+        self.assertEqual(deferred.failed, 1)
+        self.assertEqual(deferred.pending, 0)
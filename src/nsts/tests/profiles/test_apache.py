@@ -0,0 +1,228 @@
+'''
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+
+import unittest
+import tempfile
+import shutil
+import socket
+import subprocess
+import threading
+from nsts.profiles import apache
+from nsts.profiles.apache import FileCache, quantize_size
+from nsts.profiles.base import ProfileExecution, ExecutionDirection, \
+    Profile, SpeedTestRuntimeError
+from nsts.profiles.http import FlowsResult, RequestStatistics
+from nsts.speedtest import SpeedTest
+from nsts.proto import NSTSConnection
+from nsts import units, utils
+
+
+class TestFileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = FileCache(os.path.join(self.tmpdir, 'cache'),
+                               limit=5 * apache.RANDOM_BLOCK_SIZE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_quantize_size(self):
+        self.assertEqual(quantize_size(1), 1024)
+        self.assertEqual(quantize_size(1024), 1024)
+        self.assertEqual(quantize_size(1024 ** 2), 1024 ** 2)
+        previous = 0
+        for size in range(1000, 10 ** 6, 997):
+            quantized = quantize_size(size)
+            self.assertTrue(size <= quantized < size * apache.SIZE_STEP + 1)
+            self.assertTrue(quantized >= previous)
+            previous = quantized
+
+    def test_generate_and_reuse(self):
+        size = apache.RANDOM_BLOCK_SIZE * 2 + 123
+        path = self.cache.get(size)
+        self.assertEqual(os.path.getsize(path), size)
+        inode = os.stat(path).st_ino
+        self.assertEqual(self.cache.get(size), path)
+        self.assertEqual(os.stat(path).st_ino, inode)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(apache.RANDOM_BLOCK_SIZE),
+                             f.read(apache.RANDOM_BLOCK_SIZE))
+
+    def test_byte_sizes(self):
+        size = units.Byte('1 Mbyte').raw_value
+        path = self.cache.get(size)
+        self.assertEqual(os.path.basename(path),
+                         'file-{0}'.format(int(size)))
+        self.assertEqual(os.path.getsize(path), int(size))
+        self.assertTrue(FileCache.FILENAME.match(os.path.basename(path)))
+
+    def test_eviction(self):
+        size = apache.RANDOM_BLOCK_SIZE * 2
+        first = self.cache.get(size)
+        os.utime(first, (0, 0))
+        second = self.cache.get(size + 1)
+        third = self.cache.get(size + 2)
+        self.assertFalse(os.path.exists(first))
+        self.assertTrue(os.path.exists(second))
+        self.assertTrue(os.path.exists(third))
+
+    def test_eviction_keeps_partial_files(self):
+        size = apache.RANDOM_BLOCK_SIZE * 2
+        self.cache.get(size)
+        partial = self.cache.path_for(size + 1) + '.1234.tmp'
+        with open(partial, 'wb') as f:
+            f.write(self.cache.block)
+        os.utime(partial, (0, 0))
+        self.cache.get(size + 2)
+        self.cache.get(size + 3)
+        self.assertTrue(os.path.exists(partial))
+
+    def test_private_directory(self):
+        self.cache.get(1024)
+        mode = os.stat(self.cache.directory).st_mode
+        self.assertEqual(mode & 0777, 0700)
+
+        os.chmod(self.cache.directory, 0777)
+        self.assertRaises(SpeedTestRuntimeError, self.cache.get, 2048)
+
+        shutil.rmtree(self.cache.directory)
+        os.symlink(self.tmpdir, self.cache.directory)
+        self.assertRaises(SpeedTestRuntimeError, self.cache.get, 2048)
+
+
+# A process that ignores SIGTERM, like a stuck apache
+STUCK_SERVER = '''
+import signal, time
+signal.signal(signal.SIGTERM, signal.SIG_IGN)
+print "ready"
+time.sleep(30)
+'''
+
+
+class TestApacheInstance(unittest.TestCase):
+
+    def test_stop_escalates(self):
+        process = subprocess.Popen([sys.executable, '-c', STUCK_SERVER],
+                                   stdout=subprocess.PIPE)
+        process.stdout.readline()
+        # Reap the process as soon as it is killed
+        reaper = threading.Thread(target=process.wait)
+        reaper.daemon = True
+        reaper.start()
+
+        self.addCleanup(setattr, apache, 'STOP_TIMEOUT', apache.STOP_TIMEOUT)
+        apache.STOP_TIMEOUT = 0.2
+        instance = apache.ApacheInstance(None, 0)
+        os.mkdir(instance.document_root)
+        with open(instance.pid_file, 'w') as f:
+            f.write(str(process.pid))
+        instance.running = True
+        instance.stop()
+
+        reaper.join(5)
+        self.assertEqual(process.returncode, -9)
+        self.assertFalse(instance.is_healthy())
+        self.assertFalse(os.path.exists(instance.pid_file))
+        self.assertFalse(os.path.exists(instance.document_root))
+
+
+class TestConcurrentResults(unittest.TestCase):
+
+    def make_executor(self, options, rate=10 ** 6):
+        '''
+        Create a wget client that downloads files of the fake server with
+        this rate per flow
+        '''
+        profile = Profile.get_all_profiles()['apache']
+        test = SpeedTest(profile, ExecutionDirection('r'), options)
+        ctx = ProfileExecution(profile, test.direction, test.profile_options,
+                               NSTSConnection(socket.socket()))
+        executor = ctx.executor
+        sizes = {}
+        self.downloads = []
+
+        def send_msg(msg_type, params=None):
+            if msg_type == 'GENERATEFILE' and params['size']:
+                self.assertIsInstance(params['size'], int)
+                sizes[params['filename']] = params['size']
+
+        def download_file(filename):
+            self.downloads.append(('wget', filename))
+            executor.download_duration = float(sizes[filename]) / rate
+            return units.ByteRate(rate)
+
+        def download_concurrently(filename, concurrency):
+            self.downloads.append((concurrency, filename))
+            size = sizes[filename]
+            flows = [[RequestStatistics(0.01, float(size) / rate, size, 200)]
+                     for _ in range(concurrency)]
+            return FlowsResult(flows, float(size) / rate, 0)
+
+        def probe_latency(filename):
+            self.downloads.append(('probe', filename))
+            histogram = utils.LogHistogram(units.Time)
+            histogram.push(0.01)
+            return histogram
+
+        executor.send_msg = send_msg
+        executor.wait_msg_type = lambda msg_type: None
+        executor.propagate_results = lambda: None
+        executor.download_file = download_file
+        executor.download_concurrently = download_concurrently
+        executor.probe_latency = probe_latency
+        return executor
+
+    def test_single_flow(self):
+        executor = self.make_executor({'filesize': '2 Mbyte'})
+        executor.run()
+        self.assertEqual(self.downloads,
+                         [('wget', 'file_static'), ('probe', 'file_static')])
+        results = executor.context.results
+        self.assertEqual(results['transfer_rate'], units.ByteRate(10 ** 6))
+        self.assertEqual(results['flow_rate'], units.ByteRate(10 ** 6))
+        self.assertEqual(results['fairness'], units.Percentage(100))
+        self.assertAlmostEqual(results['latency_p50'].raw_value, 0.01,
+                               places=3)
+
+    def test_single_flow_time_mode(self):
+        executor = self.make_executor({
+            'mode': 'time', 'filesize': '100 Kbyte', 'downloadtime': '1 sec'})
+        executor.run()
+        wget = [d for d in self.downloads if d[0] == 'wget']
+        self.assertTrue(len(wget) > 1)
+        self.assertEqual(self.downloads[-1], ('probe', wget[-1][1]))
+
+    def test_concurrent_time_mode(self):
+        executor = self.make_executor({
+            'concurrency': 4, 'mode': 'time', 'filesize': '100 Kbyte',
+            'downloadtime': '1 sec'})
+        executor.run()
+        self.assertNotIn('wget', [d[0] for d in self.downloads])
+        self.assertTrue(len(self.downloads) > 1)
+        results = executor.context.results
+        self.assertEqual(results['transfer_rate'],
+                         units.ByteRate(4 * 10 ** 6))
+        self.assertTrue(results['latency_p50'].raw_value > 1)
+
+    def test_store_flows_results(self):
+        profile = Profile.get_all_profiles()['apache']
+        test = SpeedTest(profile, ExecutionDirection('r'), {'concurrency': 2})
+        ctx = ProfileExecution(profile, test.direction, test.profile_options,
+                               NSTSConnection(socket.socket()))
+        flows = [[RequestStatistics(0.1, 1.0, 1000, 200)],
+                 [RequestStatistics(0.1, 2.0, 1000, 200)]]
+        ctx.executor.store_flows_results(FlowsResult(flows, 2.0, 0))
+
+        self.assertEqual(ctx.results['transfer_rate'], units.ByteRate(1000))
+        self.assertEqual(ctx.results['flow_rate'], units.ByteRate(750))
+        self.assertAlmostEqual(ctx.results['fairness'].raw_value, 90)
+        self.assertAlmostEqual(ctx.results['latency_p50'].raw_value, 1.0,
+                               places=1)
+        self.assertEqual(ctx.results['latency_p99'], units.Time(2))
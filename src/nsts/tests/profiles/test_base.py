@@ -10,6 +10,7 @@ import os
 import time
 import logging
 import unittest
+import subprocess
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
 
@@ -18,6 +19,7 @@ from nsts.profiles.base import ExecutionDirection, ResultValueDescriptor, \
 from nsts import units
 from nsts.options import Options, OptionsDescriptor
 from nsts.proto import NSTSConnection, Message, ProtocolError
+from nsts.events import dispatcher
 import socket
 from collections import deque
 
@@ -287,6 +289,35 @@ class TestProfile(unittest.TestCase):
                     ProfileExecutorB, description='mydesc')
         self.assertEqual(d.description, 'mydesc')
 
+    def test_lazy_executors(self):
+        d = Profile('myid', 'myname',
+                    __name__ + '.ProfileExecutorA',
+                    __name__ + '.ProfileExecutorB')
+        self.assertEqual(d.send_executor_class, ProfileExecutorA)
+        self.assertEqual(d.receive_executor_class, ProfileExecutorB)
+
+        # Paths are checked once they are imported
+        d = Profile('myid', 'myname', 'nsts.units.Time',
+                    __name__ + '.MissingExecutor')
+        with self.assertRaises(TypeError):
+            d.send_executor_class
+        with self.assertRaises(ImportError):
+            d.receive_executor_class
+
+    def test_builtin_profiles_are_lazy(self):
+        # Use a fresh interpreter, as other tests import executors
+        code = ("import sys\n"
+                "from nsts.profiles.base import Profile\n"
+                "profiles = Profile.get_all_profiles()\n"
+                "assert 'nsts.profiles.iperf' not in sys.modules\n"
+                "assert 'numpy' not in sys.modules\n"
+                "executor = profiles['iperf_tcp'].send_executor_class\n"
+                "assert 'nsts.profiles.iperf' in sys.modules\n"
+                "assert 'nsts.profiles.apache' not in sys.modules\n")
+        root = os.path.join(os.path.dirname(__file__), '..', '..', '..')
+        self.assertEqual(subprocess.call([sys.executable, '-c', code],
+                                         cwd=root), 0)
+
     def test_options(self):
         p = Profile('myid', 'myname', ProfileExecutorA, ProfileExecutorB)
 
@@ -378,3 +409,32 @@ class TestProfileExecution(unittest.TestCase):
 
         passed = ctx.execution_time()
         self.assertTrue(abs(passed.raw_value - 0.8) < 0.1)
+
+    def test_phases(self):
+        c = NullNSTSConnection()
+        p = Profile('myid', 'myname', ProfileExecutorA, ProfileExecutorB)
+        opt = Options(p.supported_options)
+        ctx = ProfileExecution(p, ExecutionDirection('s'), opt, c)
+        self.assertEqual(len(ctx.timings), 0)
+        self.assertEqual(ctx.overhead(), units.Time(0))
+
+        notifications = []
+        dispatcher.connect('execution_phase_finished', notifications.append)
+
+        with ctx.phase('prepare'):
+            time.sleep(0.1)
+        with ctx.phase('run'):
+            time.sleep(0.2)
+        ctx.record_phase('cleanup', 0.5)
+
+        self.assertEqual(['prepare', 'run', 'cleanup'], ctx.timings.keys())
+        self.assertTrue(abs(ctx.timings['prepare'] - 0.1) < 0.05)
+        self.assertTrue(abs(ctx.timings['run'] - 0.2) < 0.05)
+        self.assertTrue(abs(ctx.overhead().raw_value - 0.6) < 0.05)
+
+        self.assertEqual(['prepare', 'run', 'cleanup'],
+                         [n.extra['phase'] for n in notifications])
+        self.assertEqual(notifications[2].sender, ctx)
+        self.assertEqual(notifications[2].extra['duration'], 0.5)
+        dispatcher.disconnect('execution_phase_finished',
+                              notifications.append)
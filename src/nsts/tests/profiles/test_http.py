@@ -0,0 +1,109 @@
+'''
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+
+import unittest
+from nsts.profiles import http
+from nsts.profiles.http import ContentServer, HTTPFetcher, \
+    fetch_concurrently, content_path, generate_load, probe_latency
+
+
+class TestHTTP(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ContentServer(0, '127.0.0.1')
+        self.server.start()
+        self.fetcher = HTTPFetcher('127.0.0.1', self.server.port)
+
+    def tearDown(self):
+        self.fetcher.close()
+        self.server.stop()
+
+    def test_content(self):
+        size = http.CONTENT_BLOCK_SIZE * 2 + 10
+        stats = self.fetcher.fetch(content_path(size))
+        self.assertEqual(stats.status, 200)
+        self.assertEqual(stats.size, size)
+        self.assertTrue(0 < stats.ttfb <= stats.latency)
+
+        # Connection is kept alive
+        connection = self.fetcher.connection
+        self.assertEqual(self.fetcher.fetch(content_path(0)).size, 0)
+        self.assertIs(self.fetcher.connection, connection)
+
+    def test_not_found(self):
+        self.assertEqual(self.fetcher.fetch('/unknown').status, 404)
+
+    def test_ranges(self):
+        path = content_path(1000)
+        stats = self.fetcher.fetch(path, {'Range': 'bytes=100-199'})
+        self.assertEqual((stats.status, stats.size), (206, 100))
+        stats = self.fetcher.fetch(path, {'Range': 'bytes=900-'})
+        self.assertEqual((stats.status, stats.size), (206, 100))
+        stats = self.fetcher.fetch(path, {'Range': 'bytes=-10'})
+        self.assertEqual((stats.status, stats.size), (206, 10))
+        stats = self.fetcher.fetch(path, {'Range': 'bytes=1000-'})
+        self.assertEqual((stats.status, stats.size), (416, 0))
+
+    def test_concurrent(self):
+        result = fetch_concurrently('127.0.0.1', self.server.port,
+                                    [content_path(10000)] * 3, 4)
+        self.assertEqual(result.errors, 0)
+        self.assertEqual(len(result.flows), 4)
+        self.assertEqual(len(result.requests), 12)
+        self.assertEqual(result.total_size(), 120000)
+        self.assertTrue(result.throughput() > 0)
+        self.assertTrue(0 < result.fairness() <= 1)
+        histogram = result.latency_histogram()
+        self.assertEqual(histogram.count, 12)
+        self.assertTrue(histogram.percentile(50) <= histogram.percentile(99))
+
+    def test_concurrent_errors(self):
+        result = fetch_concurrently('127.0.0.1', self.server.port,
+                                    [content_path(100), '/unknown'], 2)
+        self.assertEqual(result.errors, 2)
+        self.assertEqual(len(result.requests), 2)
+        self.assertEqual(result.total_size(), 200)
+
+    def test_probe_latency(self):
+        histogram = probe_latency('127.0.0.1', self.server.port,
+                                  content_path(10 ** 6), count=3)
+        self.assertEqual(histogram.count, 3)
+        self.assertTrue(histogram.max().raw_value > 0)
+        self.assertEqual(probe_latency('127.0.0.1', self.server.port,
+                                       '/unknown').count, 0)
+
+    def test_load(self):
+        result = generate_load('127.0.0.1', self.server.port,
+                               content_path(100), 0.2, concurrency=2)
+        self.assertEqual(result.errors, 0)
+        self.assertTrue(result.requests > 0)
+        self.assertEqual(result.histogram.count, result.requests)
+        self.assertTrue(result.request_rate() > 0)
+
+    def test_load_rate(self):
+        result = generate_load('127.0.0.1', self.server.port,
+                               content_path(100), 0.5, concurrency=2,
+                               rate=40)
+        self.assertTrue(15 <= result.requests <= 21)
+
+    def test_load_errors(self):
+        result = generate_load('127.0.0.1', self.server.port, '/unknown',
+                               0.1, rate=50)
+        self.assertEqual(result.requests, 0)
+        self.assertTrue(result.errors > 0)
+
+    def test_load_connection_failures(self):
+        self.server.stop()
+        self.addCleanup(setattr, http, 'LOAD_MAX_BACKOFF',
+                        http.LOAD_MAX_BACKOFF)
+        http.LOAD_MAX_BACKOFF = 0.05
+        result = generate_load('127.0.0.1', self.server.port, '/unknown',
+                               5, concurrency=2)
+        self.assertEqual(result.errors, 2 * http.LOAD_MAX_FAILURES)
+        self.assertTrue(result.duration < 5)
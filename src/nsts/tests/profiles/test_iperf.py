@@ -0,0 +1,82 @@
+'''
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+
+import unittest
+import tempfile
+import shutil
+import socket
+from nsts.profiles.iperf import parse_interval_report, ThroughputConvergence
+from nsts.profiles.base import Profile, ProfileExecution, ExecutionDirection
+from nsts.speedtest import SpeedTest
+from nsts.proto import NSTSConnection
+
+# A fake iperf client that reports 5Mbps every interval and prints
+# the summary when it is interrupted.
+FAKE_IPERF = '''#!/bin/sh
+report() {
+    echo "20140101000000,127.0.0.1,5001,127.0.0.1,5002,3,$1-$2,625000,5000000"
+}
+trap 'report 0.0 $i.0; exit 0' INT
+i=0
+while [ $i -lt 30 ]; do
+    i=$((i+1))
+    report $((i-1)).0 $i.0
+    sleep 0.05
+done
+report 0.0 $i.0
+'''
+
+
+class TestIperf(unittest.TestCase):
+
+    def test_parse_interval_report(self):
+        self.assertEqual(parse_interval_report(
+            '20140101000000,10.0.0.1,5001,10.0.0.2,5002,3,1.0-2.0,1,800\n'),
+            (1.0, 2.0, 800.0))
+        self.assertIsNone(parse_interval_report('garbage'))
+        self.assertIsNone(parse_interval_report(''))
+
+    def test_convergence(self):
+        convergence = ThroughputConvergence(0.05, min_time=3, window=3)
+        self.assertFalse(convergence.push(1, 10))
+        self.assertFalse(convergence.push(2, 100))
+        self.assertFalse(convergence.push(3, 101))
+        self.assertTrue(convergence.push(4, 99))
+        self.assertFalse(convergence.push(5, 150))
+
+    def test_adaptive_run(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fake = os.path.join(tmpdir, 'iperf')
+            with open(fake, 'w') as f:
+                f.write(FAKE_IPERF)
+            os.chmod(fake, 0755)
+
+            profile = Profile.get_all_profiles()['iperf_tcp']
+            test = SpeedTest(profile, ExecutionDirection('s'),
+                             {'tolerance': 1, 'min_time': 3})
+            ctx = ProfileExecution(profile, test.direction,
+                                   test.profile_options,
+                                   NSTSConnection(socket.socket()))
+            executor = ctx.executor
+            self.assertTrue(executor.is_adaptive())
+            executor.subprocess_executable = fake
+            executor.output = []
+            executor.execute_subprocess()
+            executor.wait_convergence()
+            executor.subprocess_handle.wait()
+            executor.output.extend(
+                executor.get_subprocess_output().splitlines())
+            executor.parse_and_store_output()
+
+            self.assertEqual(ctx.results['transfer_rate'].raw_value, 5e6)
+            self.assertEqual(parse_interval_report(executor.output[-1]),
+                             (0.0, 3.0, 5e6))
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,138 @@
+'''
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+
+import unittest
+import json
+import shutil
+import tempfile
+from nsts import units
+from nsts.profiles import plugins
+from nsts.profiles.base import Profile
+
+
+def declare_plugin_profiles():
+    p = Profile('plugin_test', 'Plugin Test',
+                'nsts.profiles.dummy.DummyTestSender',
+                'nsts.profiles.dummy.DummyTestReceiver')
+    p.supported_options.add_option('time', 'help', units.Time, default=2)
+    p.supported_options.add_option('count', 'help', int)
+    p.add_result('rate', 'Rate', units.BitRate)
+
+
+def declare_duplicate():
+    Profile('dummy', 'Fake', 'nsts.profiles.dummy.DummyTestSender',
+            'nsts.profiles.dummy.DummyTestReceiver')
+
+
+def declare_broken():
+    raise RuntimeError("broken plugin")
+
+
+class FakeEntryPoint(object):
+
+    def __init__(self, target):
+        self.target = target
+        self.loads = 0
+
+    def load(self):
+        self.loads += 1
+        return self.target
+
+    def __str__(self):
+        return 'fake = {0}'.format(self.target.__name__)
+
+
+class TestPlugins(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.registry = Profile.get_all_profiles()
+        self.original = (plugins.index_filename, plugins.iter_entry_points)
+        plugins.index_filename = os.path.join(self.tmpdir, 'profiles.json')
+
+    def tearDown(self):
+        plugins.index_filename, plugins.iter_entry_points = self.original
+        self.registry.pop('plugin_test', None)
+        shutil.rmtree(self.tmpdir)
+
+    def test_describe(self):
+        declare_plugin_profiles()
+        entry = json.loads(json.dumps(
+            plugins.describe(self.registry.pop('plugin_test'))))
+        self.assertEqual(entry['send_executor'],
+                         'nsts.profiles.dummy.DummyTestSender')
+        self.assertEqual(entry['options'][0]['type'], 'nsts.units.Time')
+        self.assertEqual(entry['options'][1]['type'], '__builtin__.int')
+
+        profile = plugins.declare(entry)
+        self.assertIs(self.registry['plugin_test'], profile)
+        self.assertEqual(profile.supported_options['time'].default,
+                         units.Time(2))
+        self.assertIsNone(profile.supported_options['count'].default)
+        self.assertEqual(profile.supported_results['rate'].unit_type,
+                         units.BitRate)
+        self.assertEqual(profile.receive_executor_path,
+                         'nsts.profiles.dummy.DummyTestReceiver')
+
+    def test_index(self):
+        filename = plugins.index_filename
+        self.assertIsNone(plugins.read_index(filename, 'a'))
+        plugins.write_index(filename, 'a', [{'id': 'x'}])
+        self.assertEqual(plugins.read_index(filename, 'a'), [{'id': 'x'}])
+        self.assertIsNone(plugins.read_index(filename, 'b'))
+
+        with open(filename, 'w') as f:
+            f.write('{corrupted')
+        self.assertIsNone(plugins.read_index(filename, 'a'))
+
+    def test_fingerprint(self):
+        before = plugins.fingerprint([self.tmpdir])
+        os.mkdir(os.path.join(self.tmpdir, 'other.dist-info'))
+        self.assertEqual(plugins.fingerprint([self.tmpdir]), before)
+
+        metadata = os.path.join(self.tmpdir, 'plugin-1.0.dist-info')
+        os.mkdir(metadata)
+        with open(os.path.join(metadata, 'entry_points.txt'), 'w') as f:
+            f.write('[nsts.profiles]\ntest = plugin.profiles\n')
+        self.assertNotEqual(plugins.fingerprint([self.tmpdir]), before)
+
+    def test_discover(self):
+        entry_point = FakeEntryPoint(declare_plugin_profiles)
+        plugins.iter_entry_points = lambda: [entry_point]
+        profiles = plugins.discover(self.registry)
+        self.assertEqual([p.id for p in profiles], ['plugin_test'])
+        self.assertEqual(entry_point.loads, 1)
+
+        # The index is used instead of importing plugins again
+        del self.registry['plugin_test']
+        profiles = plugins.discover(self.registry)
+        self.assertEqual([p.id for p in profiles], ['plugin_test'])
+        self.assertEqual(entry_point.loads, 1)
+        self.assertIsInstance(profiles[0].send_executor_class, type)
+
+        # A stale index is rebuilt
+        del self.registry['plugin_test']
+        plugins.write_index(plugins.index_filename, 'stale', [])
+        plugins.discover(self.registry)
+        self.assertEqual(entry_point.loads, 2)
+
+    def test_bad_plugins(self):
+        dummy = self.registry['dummy']
+        plugins.iter_entry_points = lambda: [
+            FakeEntryPoint(declare_duplicate), FakeEntryPoint(declare_broken),
+            FakeEntryPoint(declare_plugin_profiles)]
+        profiles = plugins.discover(self.registry)
+        self.assertEqual([p.id for p in profiles], ['plugin_test'])
+        self.assertIs(self.registry['dummy'], dummy)
+
+        # Failed plugins are loaded again on the next discovery
+        self.assertFalse(os.path.exists(plugins.index_filename))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+'''
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+
+import unittest
+import socket
+from nsts import utils
+from nsts.profiles.base import SpeedTestRuntimeError
+from nsts.profiles.subprocess import is_listening
+from nsts.profiles.pool import ResourcePool, WarmResource
+from nsts.profiles.iperf import IperfServer
+
+
+class FakeResource(WarmResource):
+
+    def __init__(self, port=None):
+        self.port = port
+        self.started = 0
+        self.stopped = 0
+        self.healthy = True
+
+    def start(self):
+        self.started += 1
+
+    def stop(self):
+        self.stopped += 1
+
+    def is_healthy(self):
+        return self.healthy
+
+
+class TestResourcePool(unittest.TestCase):
+
+    def test_reuse(self):
+        pool = ResourcePool(60)
+        first = pool.acquire(('p', 1), FakeResource)
+        self.assertEqual(first.started, 1)
+        pool.release(('p', 1), first)
+        self.assertIn(('p', 1), pool)
+
+        self.assertIs(pool.acquire(('p', 1), FakeResource), first)
+        self.assertEqual(first.started, 1)
+        self.assertEqual(len(pool), 0)
+
+        other = pool.acquire(('p', 2), FakeResource)
+        self.assertIsNot(other, first)
+        pool.release(('p', 1), first)
+        pool.release(('p', 2), other)
+        self.assertEqual(len(pool), 2)
+        pool.close()
+        self.assertEqual(len(pool), 0)
+        self.assertEqual((first.stopped, other.stopped), (1, 1))
+
+    def test_unhealthy(self):
+        pool = ResourcePool(60)
+        first = pool.acquire(('p',), FakeResource)
+        pool.release(('p',), first)
+        first.healthy = False
+        second = pool.acquire(('p',), FakeResource)
+        self.assertIsNot(second, first)
+        self.assertEqual(first.stopped, 1)
+
+        second.healthy = False
+        pool.release(('p',), second)
+        self.assertEqual(second.stopped, 1)
+        self.assertEqual(len(pool), 0)
+
+    def test_disabled(self):
+        pool = ResourcePool(0)
+        resource = pool.acquire(('p',), FakeResource)
+        pool.release(('p',), resource)
+        self.assertEqual(resource.stopped, 1)
+        self.assertEqual(len(pool), 0)
+
+    def test_evict_idle(self):
+        pool = ResourcePool(10)
+        resource = pool.acquire(('p',), FakeResource)
+        pool.release(('p',), resource)
+        self.assertEqual(pool.evict_idle(utils.monotonic()), 0)
+        self.assertEqual(pool.evict_idle(utils.monotonic() + 11), 1)
+        self.assertEqual(resource.stopped, 1)
+        self.assertEqual(len(pool), 0)
+
+    def test_evict_port(self):
+        pool = ResourcePool(60)
+        first = pool.acquire(('a',), lambda: FakeResource(8080))
+        pool.release(('a',), first)
+        second = pool.acquire(('b',), lambda: FakeResource(8080))
+        self.assertEqual(first.stopped, 1)
+        self.assertEqual(second.started, 1)
+        self.assertEqual(len(pool), 0)
+
+    def test_discard(self):
+        pool = ResourcePool(60)
+        resource = pool.acquire(('p',), FakeResource)
+        pool.discard(('p',), resource)
+        self.assertEqual(resource.stopped, 1)
+        self.assertEqual(len(pool), 0)
+
+
+# A fake iperf server that listens to the port of its arguments
+FAKE_SERVER = '''
+import sys, time, socket
+s = socket.socket()
+s.bind(("127.0.0.1", int(sys.argv[sys.argv.index("-p") + 1])))
+time.sleep(0.2)
+s.listen(1)
+time.sleep(30)
+'''
+
+
+class TestIperfServer(unittest.TestCase):
+
+    def test_lifecycle(self):
+        probe = socket.socket()
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+        probe.close()
+
+        server = IperfServer(sys.executable,
+                             ['-c', FAKE_SERVER, '-p', str(port)])
+        self.assertEqual(server.port, port)
+        self.assertFalse(server.is_healthy())
+        server.start()
+        try:
+            self.assertTrue(server.is_healthy())
+            self.assertTrue(is_listening(port))
+        finally:
+            server.stop()
+        self.assertFalse(server.is_healthy())
+
+    def test_evict_port(self):
+        probe = socket.socket()
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+        probe.close()
+
+        # A server with other options on the same port replaces the idle one
+        pool = ResourcePool(60)
+        arguments = ['-c', FAKE_SERVER, '-p', str(port)]
+        first = pool.acquire(('iperf', 'tcp'), lambda: IperfServer(
+            sys.executable, arguments))
+        pool.release(('iperf', 'tcp'), first)
+        second = pool.acquire(('iperf', 'window'), lambda: IperfServer(
+            sys.executable, arguments + ['-w', '64K']))
+        try:
+            self.assertFalse(first.is_healthy())
+            self.assertTrue(second.is_healthy())
+        finally:
+            second.stop()
+            pool.close()
+
+    def test_exits_early(self):
+        server = IperfServer(utils.which('false'), ['-p', '1'])
+        self.assertRaises(SpeedTestRuntimeError, server.start)
+        self.assertFalse(server.is_healthy())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+'''
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+
+import unittest
+import socket
+from nsts import utils
+from nsts.profiles.base import SpeedTestRuntimeError, Profile, \
+    ExecutionDirection
+from nsts.profiles.subprocess import wait_until, is_listening, find_tools, \
+    capabilities
+
+
+class TestReadiness(unittest.TestCase):
+
+    def test_wait_until(self):
+        calls = []
+
+        def condition():
+            calls.append(1)
+            return len(calls) == 4
+        self.assertLess(wait_until(condition), 1)
+        self.assertEqual(len(calls), 4)
+
+    def test_wait_until_timeout(self):
+        self.assertRaises(SpeedTestRuntimeError, wait_until,
+                          lambda: False, 0.05)
+
+    def test_wait_until_not_alive(self):
+        self.assertRaises(SpeedTestRuntimeError, wait_until,
+                          lambda: False, None, lambda: False)
+
+    def test_is_listening_tcp(self):
+        s = socket.socket()
+        try:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+            self.assertFalse(is_listening(port))
+            s.listen(1)
+            self.assertTrue(is_listening(port))
+        finally:
+            s.close()
+
+    def test_is_listening_udp(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+            self.assertTrue(is_listening(port, 'udp'))
+            self.assertFalse(is_listening(port, 'tcp'))
+        finally:
+            s.close()
+
+
+class TestTools(unittest.TestCase):
+
+    def test_find_tools(self):
+        profiles = Profile.get_all_profiles()
+        self.assertEqual(
+            find_tools(profiles['dummy'], ExecutionDirection('s')), [])
+        self.assertEqual(
+            find_tools(profiles['iperf_tcp'], ExecutionDirection('r')),
+            [('iperf', utils.which('iperf'))])
+        self.assertEqual(
+            find_tools(profiles['ping'], ExecutionDirection('s'), ipv6=True),
+            [('ping6', utils.which('ping6'))])
+        self.assertEqual(
+            find_tools(profiles['ping'], ExecutionDirection('r')), [])
+
+    def test_capabilities(self):
+        profiles = Profile.get_all_profiles()
+        report = capabilities([profiles['dummy'], profiles['iperf_tcp']])
+        self.assertEqual([(e['profile'], e['direction'], e['binary'])
+                          for e in report],
+                         [('iperf_tcp', 'send', 'iperf'),
+                          ('iperf_tcp', 'receive', 'iperf')])
+        for entry in report:
+            if entry['executable'] is None:
+                self.assertIsNone(entry['version'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+'''
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+
+import unittest
+import tempfile
+import threading
+import shutil
+from nsts import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_measure(self):
+        calls = []
+        seconds = benchmark.measure(lambda: calls.append(1),
+                                    operations=10, min_time=0.01)
+        self.assertTrue(calls)
+        self.assertTrue(seconds > 0)
+
+    def test_run_and_roundtrip(self):
+        results = benchmark.run(['units.construct'], min_time=0.01)
+        self.assertEqual(results.keys(), ['units.construct'])
+        self.assertTrue(results['units.construct']['ops_per_sec'] > 0)
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'bench.json')
+            benchmark.save(filename, results)
+            self.assertEqual(benchmark.load(filename), results)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_teardown(self):
+        results = benchmark.run(['client.dummy_sample'], min_time=0.01,
+                                repeat=1)
+        self.assertTrue(results['client.dummy_sample']['ops_per_sec'] > 0)
+        self.assertNotIn('benchmark-server',
+                         [t.name for t in threading.enumerate()])
+
+    def test_compare(self):
+        baseline = {
+            'fast': {'ops_per_sec': 100.0, 'seconds_per_op': 0.01},
+            'slow': {'ops_per_sec': 100.0, 'seconds_per_op': 0.01},
+            'removed': {'ops_per_sec': 1.0, 'seconds_per_op': 1.0}}
+        results = {
+            'fast': {'ops_per_sec': 90.0, 'seconds_per_op': 1 / 90.0},
+            'slow': {'ops_per_sec': 50.0, 'seconds_per_op': 0.02},
+            'new': {'ops_per_sec': 1.0, 'seconds_per_op': 1.0}}
+        comparison = dict((c[0], c) for c in
+                          benchmark.compare(results, baseline, 0.2))
+        self.assertEqual(sorted(comparison), ['fast', 'slow'])
+        self.assertFalse(comparison['fast'][4])
+        self.assertTrue(comparison['slow'][4])
+        self.assertAlmostEqual(comparison['slow'][3], -0.5)
@@ -0,0 +1,82 @@
+'''
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+
+import unittest
+import tempfile
+import shutil
+from nsts import calibration
+from nsts.calibration import Calibration, CalibrationCache, \
+    LoopbackCalibrator
+from nsts.profiles.base import ExecutionDirection
+from nsts.speedtest import SpeedTest
+from nsts.profiles import dummy
+from nsts import units
+
+
+class TestCalibration(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'nsts', 'calibration.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_key(self):
+        test = SpeedTest(dummy.p, ExecutionDirection('s'))
+        key = calibration.calibration_key(test)
+        self.assertEqual(key, calibration.calibration_key(test))
+        self.assertNotEqual(key, calibration.calibration_key(
+            SpeedTest(dummy.p, ExecutionDirection('r'))))
+        self.assertNotEqual(key, calibration.calibration_key(
+            SpeedTest(dummy.p, ExecutionDirection('s'),
+                      {'max_time': 5})))
+        self.assertNotEqual(key, calibration.calibration_key(
+            test, {'iperf': '2.0.5'}))
+
+    def test_cache(self):
+        cache = CalibrationCache(self.filename)
+        self.assertEqual(len(cache), 0)
+        cache.put(Calibration('k', 3, 0.5, 0.1, {'random_time': 2.0}))
+        cache.save()
+
+        cache = CalibrationCache(self.filename)
+        self.assertIsNone(cache.get('unknown'))
+        cal = cache.get('k')
+        self.assertEqual(cal.samples, 3)
+        self.assertEqual(cal.overhead, 0.5)
+        self.assertEqual(cal.ceiling, {'random_time': 2.0})
+
+    def test_loopback(self):
+        test = SpeedTest(dummy.p, ExecutionDirection('s'),
+                         {'min_time': 1, 'max_time': 1})
+        calibrator = LoopbackCalibrator(samples=2)
+        try:
+            cal = calibrator.calibrate(test)
+        finally:
+            calibrator.stop()
+        self.assertEqual(cal.key, calibration.calibration_key(test))
+        self.assertEqual(cal.samples, 2)
+        self.assertTrue(cal.overhead > 0)
+        self.assertAlmostEqual(cal.ceiling['random_time'], 1)
+        self.assertEqual(len(test.samples), 0)
+
+        # Correct a test with the same results
+        calibrator = LoopbackCalibrator()
+        try:
+            calibrator.start()
+            calibrator.client.run_test(test, 2, units.Time(0),
+                                       calibration.ClientTerminal())
+        finally:
+            calibrator.stop()
+        rows = dict((r[0], r) for r in cal.correct(test))
+        self.assertEqual(rows['Random Time'][1], units.Time(1))
+        self.assertEqual(rows['Random Time'][3], units.Time(0))
+        self.assertEqual(rows['Random Transfer'][1],
+                         rows['Random Transfer'][3])
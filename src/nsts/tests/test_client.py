@@ -0,0 +1,125 @@
+'''
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+
+import unittest
+import socket
+import threading
+import time
+from nsts.client import NSTSClient, ConnectionManager, ConnectionPool, \
+    ConnectionFailedError
+from nsts.server import NSTSServer
+from nsts.proto import ConnectionClosedException
+from nsts.profiles import dummy
+from nsts.profiles.base import ExecutionDirection
+from nsts.speedtest import SpeedTest
+from nsts.units import Time
+from nsts.io.terminal import ClientTerminal
+
+
+class DroppingTerminal(ClientTerminal):
+    '''
+    Terminal that breaks the connection at the start of some samples
+    '''
+
+    def __init__(self, client, drops):
+        super(DroppingTerminal, self).__init__()
+        self.client = client
+        self.drops = drops
+        self.started = 0
+
+    def profile_execution_started(self, profile):
+        self.started += 1
+        if self.started in self.drops:
+            self.client.connection.socket.shutdown(socket.SHUT_RDWR)
+
+
+def closed_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+class TestClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = NSTSServer('127.0.0.1', 0, quiet=True)
+        self.server.listen()
+        self.thread = threading.Thread(target=self.server.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def test_shutdown(self):
+        # Wait for the server to block on accept()
+        time.sleep(0.1)
+        self.server.shutdown()
+        self.thread.join(5)
+        self.assertFalse(self.thread.is_alive())
+
+    def test_resume_after_connection_loss(self):
+        client = NSTSClient('127.0.0.1', self.server.port, reconnect=2)
+        client.manager.backoff = 0.01
+        client.connect()
+        test = SpeedTest(dummy.p, ExecutionDirection('s'))
+        terminal = DroppingTerminal(client, [2, 4, 5])
+        client.run_test(test, 4, Time(0), terminal)
+        client.disconnect()
+
+        self.assertEqual(len(test.samples), 4)
+        self.assertEqual(terminal.started, 7)
+        self.assertEqual(client.manager.connections, 4)
+
+    def test_resume_limit(self):
+        client = NSTSClient('127.0.0.1', self.server.port, reconnect=1)
+        client.manager.backoff = 0.01
+        client.connect()
+        test = SpeedTest(dummy.p, ExecutionDirection('s'))
+        terminal = DroppingTerminal(client, [2, 3])
+        self.assertRaises((ConnectionClosedException, socket.error),
+                          client.run_test, test, 4, Time(0), terminal)
+        self.assertEqual(len(test.samples), 1)
+        client.disconnect()
+
+    def test_list_profiles(self):
+        client = NSTSClient('127.0.0.1', self.server.port)
+        client.connect()
+        profiles = dict((p['id'], p) for p in client.list_profiles())
+        client.disconnect()
+        self.assertEqual(profiles['dummy']['send_executor'],
+                         'nsts.profiles.dummy.DummyTestSender')
+        self.assertIn('iperf_tcp', profiles)
+
+    def test_connect_failure(self):
+        manager = ConnectionManager('127.0.0.1', closed_port(),
+                                    attempts=3, backoff=0.01)
+        self.assertRaises(ConnectionFailedError, manager.connect)
+        self.assertFalse(manager.is_connected())
+        self.assertEqual(manager.connections, 0)
+
+    def test_pool(self):
+        pool = ConnectionPool()
+        manager = pool.get('127.0.0.1', self.server.port)
+        self.assertIs(pool.get('127.0.0.1', self.server.port), manager)
+        self.assertIsNot(pool.get('127.0.0.1', closed_port()), manager)
+
+        connection = manager.connect()
+        self.assertIs(manager.connect(), connection)
+        self.assertTrue(connection.socket.getsockopt(
+            socket.IPPROTO_TCP, socket.TCP_NODELAY))
+        self.assertTrue(connection.socket.getsockopt(
+            socket.SOL_SOCKET, socket.SO_KEEPALIVE))
+        pool.close()
+        self.assertFalse(manager.is_connected())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,6 +8,7 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
 
 import unittest
+import threading
 from nsts import events
 from nsts.events import dispatcher
 
@@ -82,3 +83,73 @@ class TestEvents(unittest.TestCase):
         self.assertEquals(r1.calls[0].event_name, "event1")
         self.assertEquals(r1.calls[0].sender, None)
         self.assertEquals(r1.calls[0].extra, {})
+
+
+class TestTypedEvents(unittest.TestCase):
+
+    def test_register(self):
+        d = events.Dispatcher()
+        e = d.register("typed", ["a", "b"])
+        self.assertIs(e, d.register("typed"))
+        self.assertFalse(e)
+
+        r = TestReceiver()
+        d.connect("typed", r)
+        self.assertTrue(e)
+
+        e.send("me", a=1, b=2)
+        d.send("typed", a=3, b=4)
+        self.assertEquals([{"a": 1, "b": 2}, {"a": 3, "b": 4}],
+                          [n.extra for n in r.calls])
+
+        with self.assertRaises(TypeError):
+            e.send(a=1)
+
+        d.disconnect("typed", r)
+        self.assertFalse(e)
+        e.send(a=1)
+        self.assertEquals(2, len(r.calls))
+
+
+class TestAsyncSubscriber(unittest.TestCase):
+
+    def test_delivery(self):
+        d = events.Dispatcher()
+        r = TestReceiver()
+        s = d.connect("event", r, queue_size=10)
+        self.assertIsInstance(s, events.AsyncSubscriber)
+        for i in range(5):
+            d.send("event", i=i)
+        s.flush()
+        self.assertEquals(range(5), [n.extra["i"] for n in r.calls])
+        self.assertEquals(5, s.delivered)
+        self.assertEquals(0, s.dropped)
+        s.close()
+
+    def test_drop(self):
+        release = threading.Event()
+
+        def slow(n):
+            release.wait()
+
+        s = events.AsyncSubscriber(slow, maxsize=2, policy='drop')
+        for i in range(10):
+            s(events.Notification("event", None, {}))
+        # One in worker, two in queue, the rest dropped
+        self.assertTrue(s.dropped >= 7)
+        release.set()
+        s.close()
+        self.assertEquals(10, s.delivered + s.dropped)
+
+    def test_failure(self):
+        def failing(n):
+            raise RuntimeError()
+
+        s = events.AsyncSubscriber(failing, policy='block')
+        s(events.Notification("event", None, {}))
+        s.close()
+        self.assertEquals(1, s.failed)
+
+    def test_policy(self):
+        with self.assertRaises(ValueError):
+            events.AsyncSubscriber(None, policy='unknown')
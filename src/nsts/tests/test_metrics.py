@@ -0,0 +1,70 @@
+'''
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+
+import unittest
+import urllib2
+from nsts import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counter(self):
+        r = metrics.Registry()
+        c = r.counter('test_total', 'A counter', ['kind'])
+        c.inc(kind='a')
+        c.inc(2, kind='a')
+        c.inc(kind='b"')
+        self.assertEqual(c.value(kind='a'), 3)
+        self.assertEqual(c.value(kind='c'), 0)
+
+        with self.assertRaises(ValueError):
+            c.inc()
+
+        lines = r.render().splitlines()
+        self.assertIn('# TYPE test_total counter', lines)
+        self.assertIn('test_total{kind="a"} 3.0', lines)
+        self.assertIn('test_total{kind="b\\""} 1.0', lines)
+
+    def test_gauge(self):
+        r = metrics.Registry()
+        g = r.gauge('test_gauge', 'A gauge')
+        g.inc()
+        g.inc()
+        g.dec()
+        self.assertEqual(g.value(), 1)
+        g.set(10)
+        self.assertIn('test_gauge 10.0', r.render().splitlines())
+
+    def test_histogram(self):
+        r = metrics.Registry()
+        h = r.histogram('test_seconds', 'A histogram', buckets=[1, 10])
+        h.observe(0.5)
+        h.observe(5)
+        h.observe(50)
+        self.assertEqual(h.value(), 3)
+
+        lines = r.render().splitlines()
+        self.assertIn('test_seconds_bucket{le="1"} 1.0', lines)
+        self.assertIn('test_seconds_bucket{le="10"} 2.0', lines)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 3.0', lines)
+        self.assertIn('test_seconds_count 3.0', lines)
+        self.assertIn('test_seconds_sum 55.5', lines)
+
+    def test_server(self):
+        r = metrics.Registry()
+        r.counter('test_total', 'A counter').inc()
+        server = metrics.MetricsServer(0, registry=r)
+        server.start()
+        try:
+            url = 'http://127.0.0.1:{0}/metrics'.format(
+                server.server_address[1])
+            body = urllib2.urlopen(url).read()
+            self.assertEqual(body, r.render())
+        finally:
+            server.stop()
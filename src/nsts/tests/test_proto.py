@@ -0,0 +1,58 @@
+'''
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+
+import unittest
+import socket
+from nsts.proto import MessageStream, ProtocolError
+from nsts.events import dispatcher
+
+
+class TestMessageStream(unittest.TestCase):
+
+    def setUp(self):
+        a, b = socket.socketpair()
+        self.a = MessageStream(socket.socket(_sock=a))
+        self.b = MessageStream(socket.socket(_sock=b))
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+
+    def test_exchange(self):
+        self.a.send_msg('PING', {'value': 1})
+        self.a.send_msg('PONG')
+        msg = self.b.wait_msg_type('PING')
+        self.assertEqual(msg.params, {'value': 1})
+        with self.assertRaises(ProtocolError):
+            self.b.wait_msg_type('PING')
+
+    def test_events(self):
+        notifications = []
+        for event in ['message_sent', 'message_received',
+                      'connection_closed']:
+            dispatcher.connect(event, notifications.append)
+        try:
+            self.a.send_msg('PING', {'value': 1})
+            self.b.wait_msg()
+            self.a.close()
+            self.a.close()
+        finally:
+            for event in ['message_sent', 'message_received',
+                          'connection_closed']:
+                dispatcher.disconnect(event, notifications.append)
+
+        self.assertEqual(
+            ['message_sent', 'message_received', 'connection_closed'],
+            [n.event_name for n in notifications])
+        self.assertEqual(notifications[0].sender, self.a)
+        self.assertEqual(notifications[0].extra['type'], 'PING')
+        self.assertEqual(notifications[1].sender, self.b)
+        self.assertEqual(notifications[0].extra['size'],
+                         notifications[1].extra['size'])
+        self.assertIsNone(notifications[2].extra['error'])
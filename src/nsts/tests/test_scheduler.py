@@ -0,0 +1,179 @@
+'''
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+
+import unittest
+import json
+import time
+import socket
+import datetime
+import tempfile
+import shutil
+import threading
+from cStringIO import StringIO
+from nsts.server import NSTSServer
+from nsts.client import NSTSClient
+from nsts.scheduler import CronSchedule, IntervalSchedule, Job, Scheduler, \
+    ScheduleError, load_file
+
+
+def timestamp(*args):
+    return time.mktime(datetime.datetime(*args).timetuple())
+
+
+class TestSchedules(unittest.TestCase):
+
+    def test_interval(self):
+        schedule = IntervalSchedule(300)
+        self.assertEqual(schedule.first_after(1000), 1000)
+        self.assertEqual(schedule.next_after(1000), 1300)
+        self.assertRaises(ScheduleError, IntervalSchedule, 0)
+
+    def test_cron_fields(self):
+        self.assertEqual(CronSchedule.parse_field('*/15', 'minute', 0, 59),
+                         set([0, 15, 30, 45]))
+        self.assertEqual(CronSchedule.parse_field('1-3,7', 'hour', 0, 23),
+                         set([1, 2, 3, 7]))
+        self.assertEqual(CronSchedule.parse_field('50/5', 'minute', 0, 59),
+                         set([50, 55]))
+        self.assertRaises(ScheduleError, CronSchedule, '* * *')
+        self.assertRaises(ScheduleError, CronSchedule, '60 * * * *')
+
+    def test_cron_next(self):
+        schedule = CronSchedule('*/15 * * * *')
+        self.assertEqual(schedule.next_after(timestamp(2014, 1, 1, 10, 7)),
+                         timestamp(2014, 1, 1, 10, 15))
+        self.assertEqual(schedule.next_after(timestamp(2014, 1, 1, 10, 15)),
+                         timestamp(2014, 1, 1, 10, 30))
+
+        # 2014-01-01 is a Wednesday, next Sunday is the 5th
+        schedule = CronSchedule('30 2 * * 0')
+        self.assertEqual(schedule.next_after(timestamp(2014, 1, 1, 10, 7)),
+                         timestamp(2014, 1, 5, 2, 30))
+
+        # Either day of month or day of week
+        schedule = CronSchedule('0 0 3 * 0')
+        self.assertEqual(schedule.next_after(timestamp(2014, 1, 1)),
+                         timestamp(2014, 1, 3))
+        self.assertEqual(schedule.next_after(timestamp(2014, 1, 3)),
+                         timestamp(2014, 1, 5))
+
+        self.assertRaises(ScheduleError,
+                          CronSchedule('0 0 31 2 *').next_after, 0)
+
+    def test_plan(self):
+        job = Job('target', 'localhost', IntervalSchedule(60), tests='dummy')
+        job.plan(1000, first=True)
+        self.assertEqual(job.next_run, 1000)
+        job.plan(1010)
+        self.assertEqual(job.next_run, 1060)
+        # Runs that are missed are skipped
+        job.plan(1200)
+        self.assertEqual(job.next_run, 1260)
+
+        job.jitter = 10
+        job.plan(1260)
+        self.assertTrue(1320 <= job.next_run <= 1330)
+
+    def test_load_file(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'schedule.ini')
+            with open(filename, 'w') as f:
+                f.write("[global]\nsink = out.jsonl\n\n"
+                        "[office]\nconnect = 10.0.0.1\ntests = dummy\n"
+                        "every = 5 min\njitter = 30 sec\n\n"
+                        "[backhaul]\nconnect = 10.0.0.2\nport = 2000\n"
+                        "suite = suite.ini\ncron = 0 */2 * * *\n")
+            jobs, options = load_file(filename)
+            self.assertEqual(options, {'sink': 'out.jsonl'})
+            jobs = dict((job.name, job) for job in jobs)
+            self.assertEqual(jobs['office'].schedule.seconds, 300)
+            self.assertEqual(jobs['office'].jitter, 30)
+            self.assertEqual(jobs['backhaul'].port, 2000)
+            self.assertEqual(jobs['backhaul'].suite_filename, 'suite.ini')
+            self.assertEqual(jobs['backhaul'].schedule.hours,
+                             set(range(0, 24, 2)))
+
+            with open(filename, 'w') as f:
+                f.write("[office]\nconnect = 10.0.0.1\ntests = dummy\n")
+            self.assertRaises(ScheduleError, load_file, filename)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_runs_and_reconnects(self):
+        server = NSTSServer('127.0.0.1', 0, quiet=True)
+        server.listen()
+        thread = threading.Thread(target=server.serve)
+        thread.daemon = True
+        thread.start()
+
+        # A port without server
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        closed_port = closed.getsockname()[1]
+        closed.close()
+
+        job = Job('local', '127.0.0.1', IntervalSchedule(0.01),
+                  port=server.port, tests='dummy-s', samples=2)
+        other = Job('other', '127.0.0.1', IntervalSchedule(0.01),
+                    port=server.port, tests='dummy-r', samples=1)
+        broken = Job('broken', '127.0.0.1', IntervalSchedule(0.01),
+                     port=closed_port, tests='dummy-s')
+        sink = StringIO()
+        scheduler = Scheduler([job, other, broken], sink)
+        try:
+            scheduler.run(max_runs=6)
+        finally:
+            server.shutdown()
+
+        self.assertEqual(job.runs + other.runs + broken.failures, 6)
+        self.assertTrue(job.runs and other.runs and broken.failures)
+        self.assertEqual(job.failures + other.failures, 0)
+        self.assertIsNone(job.client.connection)
+
+        # Jobs of the same server share a single connection
+        self.assertIs(job.client.manager, other.client.manager)
+        self.assertEqual(job.client.manager.connections, 1)
+
+        records = [json.loads(l) for l in sink.getvalue().splitlines()]
+        self.assertEqual(
+            set(['local', 'other']), set(r['target'] for r in records))
+        self.assertEqual(
+            job.runs + other.runs,
+            len([r for r in records
+                 if r['event'] == 'suite_execution_finished']))
+
+    def test_releases_connection(self):
+        server = NSTSServer('127.0.0.1', 0, quiet=True)
+        server.listen()
+        thread = threading.Thread(target=server.serve)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.shutdown)
+
+        job = Job('local', '127.0.0.1', IntervalSchedule(0.2),
+                  port=server.port, tests='dummy-s', samples=1)
+        scheduler = Scheduler([job], keep_connected=0.1)
+        scheduler.run(max_runs=2)
+        self.assertEqual(job.runs, 2)
+        self.assertEqual(job.client.manager.connections, 2)
+
+        # Another client is served while the scheduler waits
+        scheduler.run_job(job)
+        self.assertFalse(job.client.manager.is_connected())
+        other = NSTSClient('127.0.0.1', server.port)
+        other.connect()
+        other.check_profile('dummy')
+        other.disconnect()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+'''
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+
+import unittest
+import glob
+import pstats
+import shutil
+import tempfile
+import threading
+from nsts.selfprofile import module_of, MemoryTracker, SelfProfiler
+from nsts.client import NSTSClient
+from nsts.server import NSTSServer
+from nsts.profiles import dummy
+from nsts.profiles.base import ExecutionDirection
+from nsts.speedtest import SpeedTest
+from nsts.units import Time
+from nsts.io.terminal import ClientTerminal, DeferredTerminal
+
+
+class TestSelfProfile(unittest.TestCase):
+
+    def test_module_of(self):
+        self.assertEqual('nsts.proto', module_of('/src/nsts/proto.py'))
+        self.assertEqual('nsts.profiles.base',
+                         module_of('/src/nsts/profiles/base.py'))
+        self.assertEqual('nsts.events', module_of('/nsts/nsts/events/'
+                                                  '__init__.py'))
+        self.assertEqual('pickle', module_of('/usr/lib/python2.7/pickle.py'))
+        self.assertEqual('builtins', module_of('~'))
+
+    def test_memory_tracker(self):
+        tracker = MemoryTracker()
+        tracker.start()
+        keep = [Exception() for _ in range(1000)]
+        allocations = tracker.stop()
+        self.assertIsInstance(allocations, list)
+        self.assertTrue(allocations)
+        del keep
+
+    def test_profile_tests(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        server = NSTSServer('127.0.0.1', 0, quiet=True,
+                            profiler=SelfProfiler(directory, 'server'))
+        server.listen()
+        thread = threading.Thread(target=server.serve)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.shutdown)
+
+        client = NSTSClient('127.0.0.1', server.port,
+                            profiler=SelfProfiler(directory, 'client'))
+        client.connect()
+        test = SpeedTest(dummy.p, ExecutionDirection('s'))
+        client.run_test(test, 2, Time(0), ClientTerminal())
+        client.disconnect()
+
+        # A dump per test with the ids of its samples
+        summaries = glob.glob(os.path.join(directory, 'client-*.txt'))
+        self.assertEqual([os.path.basename(f) for f in summaries],
+                         ['client-0001-test-dummy-send.txt'])
+        with open(summaries[0]) as f:
+            header = f.readline()
+        for sample in test.samples:
+            self.assertIn(str(sample.id), header)
+        self.assertTrue(os.path.exists(summaries[0][:-4] + '.prof'))
+
+        # A dump per served execution, written after it has finished
+        server.shutdown()
+        thread.join(5)
+        summaries = sorted(glob.glob(
+            os.path.join(directory, 'server-*-execution-*.txt')))
+        self.assertEqual(len(summaries), 2)
+        for sample, summary in zip(test.samples, summaries):
+            with open(summary) as f:
+                self.assertIn(str(sample.id), f.readline())
+
+    def test_profile_deferred_terminal(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        server = NSTSServer('127.0.0.1', 0, quiet=True)
+        server.listen()
+        thread = threading.Thread(target=server.serve)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.shutdown)
+
+        profiler = SelfProfiler(directory, 'client')
+        client = NSTSClient('127.0.0.1', server.port, profiler=profiler)
+        client.connect()
+        terminal = DeferredTerminal(ClientTerminal(), profiler=profiler)
+        self.addCleanup(terminal.close)
+        client.run_test(SpeedTest(dummy.p, ExecutionDirection('s')), 2,
+                        Time(0), terminal)
+        client.disconnect()
+
+        # Rendering in the worker thread is part of the test section
+        dumps = glob.glob(os.path.join(directory, 'client-*.prof'))
+        self.assertEqual(len(dumps), 1)
+        functions = [f for _, _, f in pstats.Stats(dumps[0]).stats]
+        self.assertIn('test_execution_finished', functions)
+
+    def test_sections(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        profiler = SelfProfiler(directory, 'test')
+        self.assertIsNone(profiler.stop('nothing'))
+        profiler.start()
+        self.assertTrue(profiler.active)
+        self.assertRaises(RuntimeError, profiler.start)
+        basename = profiler.stop('section', ['a', 'b'])
+        self.assertFalse(profiler.active)
+        self.assertEqual(os.path.basename(basename), 'test-0001-section')
+        with open(basename + '.txt') as f:
+            self.assertEqual(f.readline(), 'Executions: a, b\n')
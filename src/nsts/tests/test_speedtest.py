@@ -0,0 +1,117 @@
+'''
+@license: GPLv3
+@author: NSTS Contributors (see AUTHORS.txt)
+'''
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+
+import unittest
+import threading
+from nsts.speedtest import SpeedTest, SpeedTestSuite, StoppingRule
+from nsts.profiles.base import ExecutionDirection
+from nsts.profiles import dummy
+from nsts.server import NSTSServer
+from nsts.client import NSTSClient
+from nsts.io.terminal import ClientTerminal
+from nsts import units
+
+
+class FakeSample(object):
+
+    def __init__(self, value):
+        self.results = {'random_transfer': units.BitRate(value)}
+
+
+class TestStoppingRule(unittest.TestCase):
+
+    def test_disabled(self):
+        test = SpeedTest(dummy.p, ExecutionDirection('s'))
+        self.assertIsNone(StoppingRule.for_test(test, 1))
+
+    def test_options(self):
+        suite = SpeedTestSuite()
+        suite.options['precision'] = 0.1
+        suite.options['max_samples'] = 7
+        test = SpeedTest(dummy.p, ExecutionDirection('s'))
+        test.options['precision'] = 0.01
+        rule = StoppingRule.for_test(test, 1, suite.options)
+        self.assertEqual(rule.precision, 0.01)
+        self.assertEqual(rule.max_samples, 7)
+        self.assertEqual(rule.min_samples, StoppingRule.MIN_SAMPLES)
+        self.assertEqual(rule.result_id,
+                         dummy.p.supported_results.keys()[0])
+
+    def test_precision(self):
+        rule = StoppingRule(units.BitRate, 0.05)
+        rule.result_id = 'random_transfer'
+        for value in [100, 101]:
+            rule.push(FakeSample(value))
+            self.assertIsNone(rule.stop_reason())
+        rule.push(FakeSample(100))
+        self.assertEqual(rule.stop_reason(), 'precision')
+
+    def test_budget(self):
+        rule = StoppingRule(units.BitRate, 0.01, max_samples=10)
+        rule.result_id = 'random_transfer'
+        for i in range(9):
+            rule.push(FakeSample(i % 2 * 100))
+            self.assertIsNone(rule.stop_reason())
+        rule.push(FakeSample(0))
+        self.assertEqual(rule.stop_reason(), 'max_samples')
+
+        rule = StoppingRule(units.BitRate, 0.01, max_duration=units.Time(0))
+        rule.result_id = 'random_transfer'
+        rule.push(FakeSample(1))
+        self.assertEqual(rule.stop_reason(), 'max_duration')
+
+    def test_samples_bounds(self):
+        self.assertRaises(ValueError, StoppingRule, units.BitRate, 0.01,
+                          min_samples=10, max_samples=5)
+        self.assertRaises(ValueError, StoppingRule, units.BitRate, 0.01,
+                          max_samples=2)
+        rule = StoppingRule(units.BitRate, 0.01, min_samples=200)
+        self.assertEqual(rule.max_samples, 200)
+
+
+class TestAdaptiveSampling(unittest.TestCase):
+
+    def setUp(self):
+        self.server = NSTSServer('127.0.0.1', 0, quiet=True)
+        self.server.listen()
+        thread = threading.Thread(target=self.server.serve)
+        thread.daemon = True
+        thread.start()
+        self.client = NSTSClient('127.0.0.1', self.server.port)
+        self.client.connect()
+
+    def tearDown(self):
+        self.client.disconnect()
+        self.server.shutdown()
+
+    def run_test(self, test, samples):
+        self.client.run_test(test, samples, units.Time(0), ClientTerminal())
+
+    def test_fixed(self):
+        test = SpeedTest(dummy.p, ExecutionDirection('s'))
+        self.run_test(test, 4)
+        self.assertEqual(len(test.samples), 4)
+        self.assertIsNone(test.stop_reason)
+
+    def test_adaptive(self):
+        # Constant results converge on the minimum samples
+        test = SpeedTest(dummy.p, ExecutionDirection('s'),
+                         {'min_transfer': 5, 'max_transfer': 5})
+        test.options['precision'] = 0.01
+        self.run_test(test, 5)
+        self.assertEqual(len(test.samples), 5)
+        self.assertEqual(test.stop_reason, 'precision')
+
+        # Wide random results exhaust the budget
+        test = SpeedTest(dummy.p, ExecutionDirection('s'))
+        test.options['precision'] = 0.0001
+        test.options['max_samples'] = 6
+        self.run_test(test, 1)
+        self.assertEqual(len(test.samples), 6)
+        self.assertEqual(test.stop_reason, 'max_samples')
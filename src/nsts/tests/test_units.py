@@ -346,3 +346,15 @@ class TestByte(unittest.TestCase):
                          10 * (10 ** 12))
         self.assertEqual(units.Byte('10 Tbyte').raw_value,
                          10 * (10 ** 12))
+
+
+class TestRequestRate(unittest.TestCase):
+
+    def test_constructor(self):
+        self.assertEqual(units.RequestRate('100').raw_value, 100)
+        self.assertEqual(units.RequestRate('10 rps').raw_value, 10)
+        self.assertEqual(units.RequestRate('2 kreq/s').raw_value, 2000)
+        self.assertEqual(units.Requests('3 kreq').raw_value, 3000)
+
+    def test_str(self):
+        self.assertEqual(str(units.RequestRate(1500)), '1.5 kreq/s')
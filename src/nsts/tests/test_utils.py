@@ -10,7 +10,14 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
 
 import unittest
-from nsts.utils import InHouseUnitsStatisticsArray, NumPyUnitsStatisticsArray
+import time
+import shutil
+import tempfile
+from nsts import utils
+from nsts.utils import InHouseUnitsStatisticsArray, \
+    NumPyUnitsStatisticsArray, UnitsStatisticsArray
+from nsts.utils import RunningStatistics, monotonic, normal_quantile, \
+    student_t_quantile, LogHistogram
 from nsts import units
 
 
@@ -37,3 +44,162 @@ class TestStatisticsArray(unittest.TestCase):
         self.assertEqual(stats.max(), units.BitRate(4))
         self.assertEqual(stats.mean(), units.BitRate(2.5))
         self.assertTrue(abs(stats.std().raw_value - 1.11803398875) < 0.000001)
+
+    def test_default(self):
+        stats = UnitsStatisticsArray(map(units.Time, [1, 3]))
+        self.assertIsInstance(stats, NumPyUnitsStatisticsArray)
+        self.assertEqual(stats.mean(), units.Time(2))
+
+
+class TestRunningStatistics(unittest.TestCase):
+
+    def test_empty(self):
+        stats = RunningStatistics(units.BitRate)
+        self.assertEqual(stats.count, 0)
+        self.assertIsNone(stats.last)
+        self.assertEqual(stats.raw_variance(), 0)
+
+    def test_against_array(self):
+        values = map(units.BitRate, [5, 1, 7, 3, 3, 12, 0.5])
+        stats = RunningStatistics(units.BitRate)
+        for v in values:
+            stats.push(v)
+        expected = InHouseUnitsStatisticsArray(values)
+
+        self.assertEqual(stats.count, len(values))
+        self.assertEqual(stats.last, units.BitRate(0.5))
+        self.assertEqual(stats.min(), expected.min())
+        self.assertEqual(stats.max(), expected.max())
+        self.assertAlmostEqual(stats.mean().raw_value,
+                               expected.mean().raw_value)
+        self.assertAlmostEqual(stats.std().raw_value,
+                               expected.std().raw_value)
+
+
+class TestQuantiles(unittest.TestCase):
+
+    def test_normal(self):
+        self.assertAlmostEqual(normal_quantile(0.95), 1.95996, places=4)
+        self.assertAlmostEqual(normal_quantile(0.99), 2.57583, places=4)
+        with self.assertRaises(ValueError):
+            normal_quantile(1)
+
+    def test_student_t(self):
+        z = normal_quantile(0.95)
+        for dof, expected in [(2, 4.303), (5, 2.571), (30, 2.042)]:
+            self.assertAlmostEqual(student_t_quantile(z, dof), expected,
+                                   delta=0.05)
+
+    def test_confidence_interval(self):
+        stats = RunningStatistics(units.Time)
+        stats.push(units.Time(1))
+        self.assertEqual(stats.raw_confidence_interval(1.96), float('inf'))
+        for value in [2, 3, 4, 5]:
+            stats.push(units.Time(value))
+        self.assertAlmostEqual(stats.raw_sample_variance(), 2.5)
+        self.assertAlmostEqual(
+            stats.raw_confidence_interval(normal_quantile(0.95)),
+            2.776 * (2.5 / 5) ** 0.5, delta=0.02)
+
+
+class TestLogHistogram(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertIsNone(LogHistogram(units.Time).percentile(50))
+
+    def test_percentiles(self):
+        histogram = LogHistogram(units.Time, precision=0.01)
+        for i in range(1, 10001):
+            histogram.push(units.Time(i / 1000.0))
+        self.assertEqual(histogram.count, 10000)
+        self.assertEqual(histogram.min(), units.Time(0.001))
+        self.assertEqual(histogram.max(), units.Time(10))
+        for percent, expected in [(1, 0.1), (50, 5), (99, 9.9)]:
+            value = histogram.percentile(percent).raw_value
+            self.assertTrue(abs(value - expected) <= expected * 0.01)
+        self.assertEqual(histogram.percentile(100), units.Time(10))
+
+        # Memory depends on range of values, not their count
+        buckets = len(histogram.buckets)
+        for i in range(10000):
+            histogram.push(5)
+        self.assertEqual(len(histogram.buckets), buckets)
+
+    def test_merge(self):
+        first = LogHistogram(units.Time)
+        second = LogHistogram(units.Time)
+        for i in range(1, 101):
+            (first if i % 2 else second).push(i)
+        first.merge(second)
+        self.assertEqual(first.count, 100)
+        self.assertEqual(first.min(), units.Time(1))
+        self.assertEqual(first.max(), units.Time(100))
+        self.assertTrue(abs(first.percentile(50).raw_value - 50) <= 0.5)
+
+
+class TestMonotonic(unittest.TestCase):
+
+    def test_monotonic(self):
+        started = monotonic()
+        time.sleep(0.1)
+        passed = monotonic() - started
+        self.assertTrue(abs(passed - 0.1) < 0.05)
+
+
+class TestTools(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.environ.get('PATH')
+        utils.forget_tools()
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        utils.forget_tools()
+        shutil.rmtree(self.tmpdir)
+
+    def make_tool(self, directory, name, output):
+        if not os.path.isdir(directory):
+            os.mkdir(directory)
+        filename = os.path.join(directory, name)
+        with open(filename, 'w') as f:
+            f.write('#!/bin/sh\necho "{0}"\n'.format(output))
+        os.chmod(filename, 0755)
+        return filename
+
+    def test_which_cache(self):
+        first = os.path.join(self.tmpdir, 'first')
+        second = os.path.join(self.tmpdir, 'second')
+        tool = self.make_tool(first, 'nsts-tool', 'tool 1.0')
+        os.environ['PATH'] = os.pathsep.join([first, second])
+        self.assertEqual(utils.which('nsts-tool'), tool)
+        self.assertIsNone(utils.which('nsts-missing'))
+
+        # Found executables are cached while PATH is the same,
+        # missing ones are searched again
+        os.remove(tool)
+        self.make_tool(second, 'nsts-missing', 'missing 1.0')
+        self.assertEqual(utils.which('nsts-tool'), tool)
+        self.assertEqual(utils.which('nsts-missing'),
+                         os.path.join(second, 'nsts-missing'))
+
+        # And searched again once it changes
+        os.environ['PATH'] = second
+        self.assertIsNone(utils.which('nsts-tool'))
+
+    def test_tool_version(self):
+        tool = self.make_tool(self.tmpdir, 'nsts-tool', 'tool version 2.0.5')
+        self.assertEqual(utils.tool_version(tool), 'tool version 2.0.5')
+        self.make_tool(self.tmpdir, 'nsts-tool', 'tool version 3.1')
+        self.assertEqual(utils.tool_version(tool), 'tool version 2.0.5')
+        utils.forget_tools()
+        self.assertEqual(utils.tool_version(tool), 'tool version 3.1')
+
+    def test_tool_version_hangs(self):
+        tool = os.path.join(self.tmpdir, 'nsts-server')
+        with open(tool, 'w') as f:
+            f.write('#!/bin/sh\nread line\necho "server 1.2"\nsleep 30\n')
+        os.chmod(tool, 0755)
+        started = time.time()
+        self.assertEqual(utils.tool_version(tool, timeout=0.2), 'server 1.2')
+        self.assertTrue(time.time() - started < 5)
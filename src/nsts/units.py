@@ -308,3 +308,36 @@ class Byte(Unit):
         super(Byte, self).__init__(
             'Information Quantity', initial_value,
             magnitudes, alt_magnitude_names)
+
+
+class Requests(Unit):
+    '''
+    Number of requests
+    '''
+
+    def __init__(self, initial_value=0):
+        magnitudes = [
+            (1,       'req'),
+            (10 ** 3, 'kreq'),
+            (10 ** 6, 'Mreq')]
+        super(Requests, self).__init__("Requests", initial_value, magnitudes)
+
+
+class RequestRate(Unit):
+    '''
+    Request rate measurement unit
+    '''
+
+    def __init__(self, initial_value=0):
+        magnitudes = [
+            (1,       'req/s'),
+            (10 ** 3, 'kreq/s'),
+            (10 ** 6, 'Mreq/s')]
+
+        alt_magnitude_names = {
+            'req/s': ['rps'],
+            'kreq/s': ['krps'],
+            'Mreq/s': ['Mrps']}
+
+        super(RequestRate, self).__init__(
+            "Request Rate", initial_value, magnitudes, alt_magnitude_names)
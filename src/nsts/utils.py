@@ -5,14 +5,50 @@ Created on Nov 3, 2013
 @author: NSTS Contributors (see AUTHORS.txt)
 '''
 import os
+import re
 import math
+import time
+import signal
+import threading
+import ctypes
+import ctypes.util
+import importlib
+import subprocess
+
+# The numpy module once it is imported, None if it is not installed
+_numpy = False
+
+
+class _TimeSpec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+# CLOCK_MONOTONIC as defined in <linux/time.h>
+_CLOCK_MONOTONIC = 1
+
 try:
-    import numpy as np
-except ImportError:
-    pass
+    _clock_gettime = ctypes.CDLL(
+        ctypes.util.find_library('rt') or ctypes.util.find_library('c'),
+        use_errno=True).clock_gettime
+    _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_TimeSpec)]
+except (OSError, AttributeError, TypeError):
+    _clock_gettime = None
 
 
-def which(program):
+def monotonic():
+    '''
+    Get the time in seconds of a clock that cannot go backwards. The
+    reference point is undefined, only differences are meaningful. Falls
+    back to time.time() on systems without clock_gettime().
+    '''
+    if _clock_gettime is None:
+        return time.time()
+    spec = _TimeSpec()
+    if _clock_gettime(_CLOCK_MONOTONIC, ctypes.byref(spec)) != 0:
+        return time.time()
+    return spec.tv_sec + spec.tv_nsec * 1e-9
+
+
+def find_executable(program, search_path):
     '''
     @ref http://stackoverflow.com/questions/377017/
         test-if-executable-exists-in-python
@@ -26,7 +62,7 @@ def which(program):
         if is_exe(program):
             return program
     else:
-        for path in os.environ["PATH"].split(os.pathsep):
+        for path in search_path.split(os.pathsep):
             path = path.strip('"')
             exe_file = os.path.join(path, program)
             if is_exe(exe_file):
@@ -35,6 +71,94 @@ def which(program):
     return None
 
 
+# Executables found by which() and the PATH that they were searched in
+_executables = {}
+_executables_path = None
+
+
+def which(program):
+    '''
+    Find the executable of a program in PATH. Found executables are cached
+    until PATH changes. Missing programs are searched again every time, so
+    that a program installed later is found.
+    @return The path of the executable or None if it is not found
+    '''
+    global _executables_path
+    search_path = os.environ.get("PATH", os.defpath)
+    if search_path != _executables_path:
+        _executables.clear()
+        _executables_path = search_path
+    if program not in _executables:
+        executable = find_executable(program, search_path)
+        if executable is None:
+            return None
+        _executables[program] = executable
+    return _executables[program]
+
+
+# Versions of tools that have already been probed
+_tool_versions = {}
+
+# Seconds to wait for the output of a tool while probing its version
+TOOL_VERSION_TIMEOUT = 2
+
+
+def forget_tools():
+    '''
+    Clear the cached executables and versions of tools, e.g. after
+    installing or upgrading a tool
+    '''
+    _executables.clear()
+    _tool_versions.clear()
+
+
+def _kill_group(process):
+    '''
+    Kill a process that leads its own process group, with its children
+    '''
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def tool_version(executable, flags=('--version', '-V', '-v'),
+                 timeout=TOOL_VERSION_TIMEOUT):
+    '''
+    Probe the version of an external tool by trying common version flags.
+    Results are cached per executable. Tools read no input and are killed
+    if they do not exit in time, e.g. when a flag starts a server.
+    @param executable The path of the tool
+    @param timeout Seconds to wait for each flag
+    @return The first output line that looks like a version or None
+    '''
+    if executable in _tool_versions:
+        return _tool_versions[executable]
+    version = None
+    for flag in flags:
+        try:
+            with open(os.devnull) as devnull:
+                process = subprocess.Popen(
+                    [executable, flag], stdin=devnull, stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT, close_fds=True,
+                    preexec_fn=os.setsid)
+        except OSError:
+            break
+        timer = threading.Timer(timeout, _kill_group, [process])
+        timer.start()
+        try:
+            output = process.communicate()[0]
+        finally:
+            timer.cancel()
+        lines = [l.strip() for l in output.splitlines()
+                 if re.search(r'\d+\.\d+', l)]
+        if lines:
+            version = lines[0]
+            break
+    _tool_versions[executable] = version
+    return version
+
+
 def check_pid(pid):
     """
     Check For the existence of a unix pid.
@@ -47,6 +171,27 @@ def check_pid(pid):
         return True
 
 
+def object_path(obj):
+    '''
+    Get the dotted path of a class or function (e.g. "nsts.units.Time")
+    '''
+    return "{0}.{1}".format(obj.__module__, obj.__name__)
+
+
+def import_object(path):
+    '''
+    Import the class or function of a dotted path
+    @raise ImportError If the module or the object does not exist
+    '''
+    module_name, _, name = path.rpartition('.')
+    obj = getattr(importlib.import_module(module_name or '__builtin__'),
+                  name, None)
+    if obj is None:
+        raise ImportError("Module {0} has no attribute {1}".format(
+            module_name, name))
+    return obj
+
+
 class InHouseUnitsStatisticsArray(object):
     '''
     Implementation of UnitsStatisticsArray using in house routines
@@ -81,27 +226,235 @@ class InHouseUnitsStatisticsArray(object):
     def std(self):
         return self.unit_type(self.__raw_std)
 
-if np is not None:
-    class NumPyUnitsStatisticsArray(object):
+
+def normal_quantile(confidence):
+    '''
+    Get the two-sided quantile of the standard normal distribution
+    for a confidence level (e.g. 1.96 for 0.95)
+    '''
+    if not 0 < confidence < 1:
+        raise ValueError("Confidence must be between 0 and 1")
+    low, high = 0.0, 40.0
+    for _ in range(100):
+        middle = (low + high) / 2
+        if math.erf(middle / math.sqrt(2)) < confidence:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+def student_t_quantile(z, dof):
+    '''
+    Approximate the quantile of Student's t distribution from the
+    respective normal quantile, with the Cornish-Fisher expansion
+    (Abramowitz & Stegun 26.7.5).
+    @param z The standard normal quantile
+    @param dof Degrees of freedom
+    '''
+    z3 = z ** 3
+    z5 = z ** 5
+    z7 = z ** 7
+    z9 = z ** 9
+    g1 = (z3 + z) / 4
+    g2 = (5 * z5 + 16 * z3 + 3 * z) / 96
+    g3 = (3 * z7 + 19 * z5 + 17 * z3 - 15 * z) / 384
+    g4 = (79 * z9 + 776 * z7 + 1482 * z5 - 1920 * z3 - 945 * z) / 92160
+    n = float(dof)
+    return z + g1 / n + g2 / n ** 2 + g3 / n ** 3 + g4 / n ** 4
+
+
+class RunningStatistics(object):
+    '''
+    Statistics that are updated incrementally, one value at a time,
+    using Welford's algorithm. Each push() costs O(1) regardless of the
+    number of values already seen.
+    '''
+    def __init__(self, unit_type):
+        self.unit_type = unit_type
+        self.count = 0
+        self.last = None
+        self.__raw_mean = 0.0
+        self.__raw_m2 = 0.0
+        self.__raw_min = None
+        self.__raw_max = None
+
+    def push(self, value):
         '''
-        Implementation of UnitsStatisticsArray using numpy
+        Account a new value in statistics
         '''
+        self.last = value
+        raw_value = float(value.raw_value)
+        self.count += 1
+        delta = raw_value - self.__raw_mean
+        self.__raw_mean += delta / self.count
+        self.__raw_m2 += delta * (raw_value - self.__raw_mean)
+        if self.__raw_min is None or raw_value < self.__raw_min:
+            self.__raw_min = raw_value
+        if self.__raw_max is None or raw_value > self.__raw_max:
+            self.__raw_max = raw_value
 
-        def __init__(self, array):
-            self.unit_type = type(array[0])
-            self.array = np.array([a.raw_value for a in array])
+    def raw_variance(self):
+        '''
+        Get the (population) variance of values in raw magnitude
+        '''
+        if not self.count:
+            return 0.0
+        return self.__raw_m2 / self.count
 
-        def max(self):
-            return self.unit_type(self.array.max())
+    def raw_sample_variance(self):
+        '''
+        Get the (unbiased) sample variance of values in raw magnitude
+        '''
+        if self.count < 2:
+            return float('inf')
+        return self.__raw_m2 / (self.count - 1)
+
+    def raw_confidence_interval(self, z):
+        '''
+        Get the half width of the confidence interval of the mean
+        @param z The standard normal quantile of the confidence level
+            (see normal_quantile())
+        '''
+        if self.count < 2:
+            return float('inf')
+        return student_t_quantile(z, self.count - 1) * \
+            math.sqrt(self.raw_sample_variance() / self.count)
+
+    def max(self):
+        return self.unit_type(self.__raw_max)
+
+    def min(self):
+        return self.unit_type(self.__raw_min)
+
+    def mean(self):
+        return self.unit_type(self.__raw_mean)
+
+    def std(self):
+        return self.unit_type(math.sqrt(self.raw_variance()))
+
+
+class LogHistogram(object):
+    '''
+    Histogram of positive values in logarithmic buckets (HDR-style).
+    Each bucket spans a fixed relative width, so percentiles have a
+    bounded relative error and memory depends only on the range of
+    values, not on their number.
+    '''
+    def __init__(self, unit_type, precision=0.01, lowest=1e-6):
+        '''
+        @param unit_type The unit type of values
+        @param precision Relative width of each bucket
+        @param lowest Values up to this raw value share the first bucket
+        '''
+        self.unit_type = unit_type
+        self.precision = precision
+        self.lowest = float(lowest)
+        self.count = 0
+        self.buckets = {}
+        self.__log_base = math.log(1 + precision)
+        self.__raw_min = None
+        self.__raw_max = None
+
+    def push(self, value):
+        '''
+        Account a new value (a unit object or a raw value)
+        '''
+        raw_value = float(getattr(value, 'raw_value', value))
+        if raw_value <= self.lowest:
+            index = 0
+        else:
+            index = int(math.ceil(
+                math.log(raw_value / self.lowest) / self.__log_base))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        if self.__raw_min is None or raw_value < self.__raw_min:
+            self.__raw_min = raw_value
+        if self.__raw_max is None or raw_value > self.__raw_max:
+            self.__raw_max = raw_value
+
+    def merge(self, other):
+        '''
+        Account all values of another histogram of the same precision
+        '''
+        assert other.precision == self.precision and \
+            other.lowest == self.lowest
+        if not other.count:
+            return
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        other_min, other_max = other.min().raw_value, other.max().raw_value
+        if self.__raw_min is None or other_min < self.__raw_min:
+            self.__raw_min = other_min
+        if self.__raw_max is None or other_max > self.__raw_max:
+            self.__raw_max = other_max
+
+    def percentile(self, percent):
+        '''
+        Get the value below which this percent of values fall
+        '''
+        if not self.count:
+            return None
+        rank = max(int(math.ceil(self.count * percent / 100.0)), 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                break
+        raw_value = self.lowest * (1 + self.precision) ** index
+        raw_value = min(max(raw_value, self.__raw_min), self.__raw_max)
+        return self.unit_type(raw_value)
+
+    def min(self):
+        return self.unit_type(self.__raw_min)
+
+    def max(self):
+        return self.unit_type(self.__raw_max)
+
+
+def numpy():
+    '''
+    Import numpy on first use, as it is slow to import and only needed
+    for statistics of finished tests.
+    @return The numpy module or None if it is not installed
+    '''
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+        _numpy = np
+    return _numpy
+
+
+class NumPyUnitsStatisticsArray(object):
+    '''
+    Implementation of UnitsStatisticsArray using numpy
+    '''
+
+    def __init__(self, array):
+        self.unit_type = type(array[0])
+        self.array = numpy().array([a.raw_value for a in array])
+
+    def max(self):
+        return self.unit_type(self.array.max())
 
-        def min(self):
-            return self.unit_type(self.array.min())
+    def min(self):
+        return self.unit_type(self.array.min())
+
+    def mean(self):
+        return self.unit_type(self.array.mean())
 
-        def mean(self):
-            return self.unit_type(self.array.mean())
+    def std(self):
+        return self.unit_type(self.array.std())
 
-        def std(self):
-            return self.unit_type(self.array.std())
-    UnitsStatisticsArray = NumPyUnitsStatisticsArray
-else:
-    UnitsStatisticsArray = InHouseUnitsStatisticsArray
+
+def UnitsStatisticsArray(array):
+    '''
+    Statistics of an array of unit values, using numpy if it is installed
+    '''
+    if numpy() is not None:
+        return NumPyUnitsStatisticsArray(array)
+    return InHouseUnitsStatisticsArray(array)